@@ -1,15 +1,26 @@
 # akita_email/companion_cli.py
 import serial
+import functools
+import io
 import json
 import time
 import threading
 import logging
+import os
+import re
+import selectors
 import sys
 try:
     import readline # Enables history and editing in input()
 except ImportError:
     readline = None # Not available on Windows
-from typing import Optional, Dict, Any, List, cast
+try:
+    # Optional: lets notifications print without disturbing the prompt being typed
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.patch_stdout import patch_stdout
+except ImportError:
+    PromptSession = None
+from typing import Optional, Dict, Any, List, Tuple, Union, cast
 
 # Assumes running from repository root or package installed
 try:
@@ -29,10 +40,21 @@ log_file = config.COMPANION_LOG_FILE
 logger = config.setup_logger(config.APP_NAME + ".Companion", config.COMPANION_LOG_LEVEL, log_file, console=True)
 
 
-# Global variable to signal the listener thread to stop
-listener_running = False
+# Set to signal the listener thread and main loop to stop
+listener_stop = threading.Event()
 # Global variable for the serial connection to the plugin
 plugin_serial: Optional[serial.Serial] = None
+# (read_fd, write_fd) pipe used to wake the listener thread out of select()
+_listener_wake_pipe: Optional[Tuple[int, int]] = None
+# Held while writing to or closing the wake pipe, so a wake never writes to a reused fd
+_listener_wake_lock = threading.Lock()
+# Serial read timeout for the plugin port. POSIX listeners block in a selector instead;
+# on Windows reads are unblocked with cancel_read(), so this only bounds stray waits.
+_PLUGIN_READ_TIMEOUT = 0.5 if sys.platform == 'win32' else 0.25
+# Active prompt_toolkit session while the command loop runs (None when using input())
+_prompt_session = None
+# Set while the plugin reports its outbox is near capacity (RESP_BACKPRESSURE)
+_plugin_outbox_throttled = False
 
 def connect_to_plugin() -> Optional[serial.Serial]:
     """
@@ -49,29 +71,29 @@ def connect_to_plugin() -> Optional[serial.Serial]:
         print("Error: Plugin serial port not configured. Please set COMPANION_PLUGIN_PORT in akita_email/config.py.", file=sys.stderr)
         return None
 
-    logger.info(f"Attempting to connect to Akita Plugin on {port} at {baud} baud...")
+    logger.info("Attempting to connect to Akita Plugin on %s at %s baud...", port, baud)
     for attempt in range(retries):
         try:
             ser = serial.Serial(
                 port=port,
                 baudrate=baud,
-                timeout=1 # Read timeout
+                timeout=_PLUGIN_READ_TIMEOUT
             )
-            logger.info(f"Connected successfully to Akita Plugin on attempt {attempt + 1}.")
+            logger.info("Connected successfully to Akita Plugin on attempt %s.", attempt + 1)
             print(f"--- Connected to Akita Plugin on {port} ---")
             return ser
         except serial.SerialException as e:
-            logger.warning(f"Connection attempt {attempt + 1}/{retries} failed: {e}")
+            logger.warning("Connection attempt %s/%s failed: %s", attempt + 1, retries, e)
             if attempt < retries - 1:
                 print(f"Warning: Could not connect to plugin, retrying in {retry_delay}s...")
                 time.sleep(retry_delay)
             else:
-                logger.error(f"Failed to connect to Akita Plugin after {retries} attempts.")
+                logger.error("Failed to connect to Akita Plugin after %s attempts.", retries)
                 print(f"\nError: Could not connect to the Akita Plugin on {port}.", file=sys.stderr)
                 print("Ensure the plugin is running and the correct port (COMPANION_PLUGIN_PORT) is specified in config.py.", file=sys.stderr)
                 return None
         except Exception as e:
-            logger.error(f"Unexpected error during connection attempt {attempt + 1}: {e}", exc_info=True)
+            logger.error("Unexpected error during connection attempt %s: %s", attempt + 1, e, exc_info=True)
             print(f"Error: An unexpected error occurred while connecting: {e}", file=sys.stderr)
             return None # Unexpected error, stop trying
     return None # Should not be reached, but satisfies type checker
@@ -80,161 +102,415 @@ def connect_to_plugin() -> Optional[serial.Serial]:
 def send_command_to_plugin(ser: serial.Serial, command_type: str, **kwargs):
     """Encodes and sends a command to the plugin via the serial connection."""
     if not ser or not ser.is_open:
-        logger.error(f"Cannot send command '{command_type}': Serial port not open.")
+        logger.error("Cannot send command '%s': Serial port not open.", command_type)
         print("Error: Not connected to the plugin.", file=sys.stderr)
         return False
     try:
-        cmd_str = protocol.encode_companion_command(command_type, **kwargs)
-        ser.write(cmd_str.encode('utf-8'))
-        logger.debug(f"Sent command: {cmd_str.strip()}")
+        cmd_bytes = protocol.encode_companion_command(command_type, **kwargs)
+        ser.write(cmd_bytes)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Sent command: %s", cmd_bytes.decode('utf-8', errors='replace').rstrip())
         return True
     except (serial.SerialException, protocol.ProtocolError) as e:
-        logger.error(f"Error sending command '{command_type}': {e}", exc_info=True)
+        logger.error("Error sending command '%s': %s", command_type, e, exc_info=True)
         print(f"Error sending command: {e}", file=sys.stderr)
         # Assume connection is lost on serial error
         if isinstance(e, serial.SerialException):
              close_plugin_connection() # Attempt to close gracefully
         return False
     except Exception as e:
-        logger.error(f"Unexpected error sending command '{command_type}': {e}", exc_info=True)
+        logger.error("Unexpected error sending command '%s': %s", command_type, e, exc_info=True)
         print(f"Unexpected error sending command: {e}", file=sys.stderr)
         return False
 
+def _serial_fileno(ser: serial.Serial) -> Optional[int]:
+    """Returns the OS file descriptor backing the serial port, or None if it is not selectable."""
+    try:
+        return ser.fileno()
+    except (AttributeError, OSError, serial.SerialException):
+        # pyserial on Windows does not expose a selectable descriptor
+        return None
+
+def _cancel_pending_read(ser: Optional[serial.Serial]):
+    """Aborts a blocking read in progress on the port so the listener returns at once."""
+    if ser is None or not ser.is_open:
+        return
+    try:
+        ser.cancel_read()
+    except Exception:
+        pass # Not supported by this pyserial backend; the read timeout still applies
+
+def _wake_listener():
+    """
+    Wakes the listener thread if it is blocked waiting for data: posts a byte to its
+    wake pipe, or cancels the pending read on ports that are not selectable (Windows).
+    """
+    with _listener_wake_lock:
+        wake_pipe = _listener_wake_pipe
+        if wake_pipe:
+            try:
+                os.write(wake_pipe[1], b'\0')
+            except OSError:
+                pass # Pipe full (a wake is already pending)
+            return
+    _cancel_pending_read(plugin_serial)
+
+def stop_listener():
+    """Signals the listener thread to stop and wakes it if it is blocked waiting for data."""
+    listener_stop.set()
+    _wake_listener()
+
+# Bound once at import to skip the module attribute lookup for every received line
+_decode_plugin_message = protocol.decode_companion_message
+_decode_plugin_frame = protocol.decode_companion_frame
+_plugin_frame_end = protocol.companion_frame_end
+_FRAME_MAGIC = protocol.COMPANION_FRAME_MAGIC
+
+# Matches the leading '{"resp":"<type>"' written by protocol.encode_companion_response (whitespace tolerated)
+_RESP_TYPE_RE = re.compile(rb'^\s*\{\s*"resp"\s*:\s*"([^"\\]*)"')
+
+
+class LazyMsg:
+    """
+    A line received from the plugin whose JSON body is only parsed on demand.
+    The response type is sniffed from the start of the raw bytes, which is enough
+    to route messages that do not need their structured data; the line is only
+    decoded to text when it has to be shown verbatim.
+    """
+    __slots__ = ('raw', '_text', '_parsed', '_is_parsed')
+
+    def __init__(self, raw_line: Union[bytes, bytearray]):
+        self.raw = raw_line
+        self._text: Optional[str] = None
+        self._parsed: Optional[Dict[str, Any]] = None
+        self._is_parsed = False
+
+    @property
+    def text(self) -> str:
+        """The line as text, without surrounding whitespace (decoded on first use)."""
+        if self._text is None:
+            self._text = self.raw.decode('utf-8', errors='ignore').strip()
+        return self._text
+
+    @property
+    def resp_type(self) -> Optional[str]:
+        """The response type, read from the line prefix without a full parse when possible."""
+        match = _RESP_TYPE_RE.match(self.raw)
+        if match:
+            return match.group(1).decode('utf-8', errors='ignore')
+        parsed = self.parsed
+        return parsed.get('resp') if parsed else None
+
+    @property
+    def parsed(self) -> Optional[Dict[str, Any]]:
+        """The fully decoded message (cached), or None if it is not valid JSON."""
+        if not self._is_parsed:
+            self._parsed = _decode_plugin_message(self.raw) # Both JSON parsers take the bytes as-is
+            self._is_parsed = True
+        return self._parsed
+
+
+def _handle_plugin_line(raw_line: Union[bytes, bytearray]):
+    """Decodes one newline-delimited message from the plugin and displays it."""
+    if not raw_line or raw_line.isspace():
+        return
+    msg = LazyMsg(raw_line)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Received from plugin: %s", msg.text)
+    resp_type = msg.resp_type
+    if resp_type is not None and resp_type not in _RESPONSE_FORMATTERS:
+        # Unknown responses are only shown verbatim; skip decoding the body
+        display_plugin_response(resp_type, None, raw=msg.text)
+        return
+
+    # Decode the JSON message
+    response_data = msg.parsed
+
+    # Process if valid response structure
+    if response_data and 'resp' in response_data and 'data' in response_data:
+        display_plugin_response(response_data['resp'], response_data['data'])
+    elif response_data:
+         logger.warning("Malformed response structure from plugin: %s", response_data)
+    # else: decode already logged warnings for non-JSON etc.
+
+def _handle_plugin_frame(frame: Union[bytes, bytearray]):
+    """Decodes one binary frame from the plugin (see protocol.encode_inbox_row_frame) and displays it."""
+    response_data = _decode_plugin_frame(frame)
+    if response_data:
+        display_plugin_response(response_data['resp'], response_data['data'])
+
+def _dispatch_plugin_message(handler, raw: Union[bytes, bytearray]):
+    """
+    Runs one line or frame handler. A message that fails to display is logged and
+    dropped, so it cannot stall the messages after it in the receive buffer.
+    """
+    try:
+        handler(raw)
+    except Exception as e:
+        logger.error("Failed to handle message from plugin (%r): %s", bytes(raw[:80]), e, exc_info=True)
+
 def plugin_response_listener_thread(ser: serial.Serial):
     """
     Background thread that continuously listens for responses and notifications
     from the plugin process over the serial connection.
+
+    Where the serial port exposes a file descriptor, the thread blocks in a selector
+    on both the port and a wake pipe, so it reacts to incoming bytes and to
+    stop_listener()/close_plugin_connection() without polling. Otherwise it falls
+    back to blocking reads bounded by the serial read timeout.
+    Received bytes accumulate in one reusable buffer that is split on newlines.
     """
-    global listener_running
-    listener_running = True
+    global _listener_wake_pipe
     logger.info("Plugin response listener thread started.")
 
-    while listener_running:
-        if not ser or not ser.is_open:
-            logger.warning("Listener thread: Serial port closed or unavailable. Stopping.")
-            listener_running = False # Signal main loop/self to stop
-            break
-
-        try:
-            if ser.in_waiting > 0:
-                # Read one line from the plugin
-                line = ser.readline().decode('utf-8', errors='ignore')
-                line = line.strip()
-
-                if line:
-                    logger.debug(f"Received from plugin: {line}")
-                    # Decode the JSON message
-                    response_data = protocol.decode_companion_message(line)
-
-                    # Process if valid response structure
-                    if response_data and 'resp' in response_data and 'data' in response_data:
-                        display_plugin_response(response_data['resp'], response_data['data'])
-                    elif response_data:
-                         logger.warning(f"Malformed response structure from plugin: {response_data}")
-                    # else: decode already logged warnings for non-JSON etc.
-
-            # Small sleep to prevent 100% CPU usage when idle
-            time.sleep(0.1)
+    sel: Optional[selectors.BaseSelector] = None
+    wake_r = -1
+    rx_buffer = bytearray() # Bytes received but not yet terminated by a newline
+    serial_fd = _serial_fileno(ser)
+    if serial_fd is not None:
+        wake_r, wake_w = os.pipe()
+        os.set_blocking(wake_w, False) # A full pipe already holds a pending wake
+        _listener_wake_pipe = (wake_r, wake_w)
+        sel = selectors.DefaultSelector()
+        sel.register(serial_fd, selectors.EVENT_READ)
+        sel.register(wake_r, selectors.EVENT_READ)
+    else:
+        logger.debug("Plugin serial port is not selectable, using blocking read listener.")
 
-        except serial.SerialException as e:
-            logger.error(f"Plugin serial communication error in listener: {e}. Stopping listener.")
-            print("\nError: Lost connection to Akita Plugin.", file=sys.stderr)
-            close_plugin_connection() # Close connection
-            listener_running = False # Signal main loop to exit
-            break # Exit thread loop
-        except UnicodeDecodeError as e:
-             logger.warning(f"Received non-UTF8 data from plugin, ignoring line: {e}")
-        except Exception as e:
-            # Catch unexpected errors in the listener loop
-            logger.error(f"Unexpected error in plugin listener thread: {e}", exc_info=True)
-            # Avoid tight loop on unexpected errors, maybe signal main thread?
-            time.sleep(1)
+    try:
+        while not listener_stop.is_set():
+            if not ser or not ser.is_open:
+                logger.warning("Listener thread: Serial port closed or unavailable. Stopping.")
+                listener_stop.set() # Signal main loop/self to stop
+                break
+
+            try:
+                if sel is None:
+                    # Blocking read; returns b'' when the serial read timeout expires,
+                    # which gives the loop a natural point to re-check listener_stop.
+                    rx_buffer += ser.read(ser.in_waiting or 1)
+                else:
+                    for key, _ in sel.select(timeout=None):
+                        if key.fd == wake_r:
+                            os.read(wake_r, 64) # Drain wake bytes; loop condition decides whether to stop
+                        elif ser.is_open:
+                            rx_buffer += ser.read(ser.in_waiting or 1)
+
+                # Dispatch every complete line or binary frame, then drop them from the
+                # buffer in one step; anything still partial stays for the next read
+                line_start = 0
+                while True:
+                    if rx_buffer.startswith(_FRAME_MAGIC, line_start):
+                        frame_end = _plugin_frame_end(rx_buffer, line_start)
+                        if frame_end is None:
+                            break
+                        _dispatch_plugin_message(_handle_plugin_frame, rx_buffer[line_start:frame_end])
+                        line_start = frame_end
+                        continue
+                    newline_pos = rx_buffer.find(b'\n', line_start)
+                    if newline_pos < 0:
+                        break
+                    _dispatch_plugin_message(_handle_plugin_line, rx_buffer[line_start:newline_pos])
+                    line_start = newline_pos + 1
+                if line_start:
+                    del rx_buffer[:line_start]
+
+            except serial.SerialException as e:
+                logger.error("Plugin serial communication error in listener: %s. Stopping listener.", e)
+                print("\nError: Lost connection to Akita Plugin.", file=sys.stderr)
+                close_plugin_connection() # Close connection
+                listener_stop.set() # Signal main loop to exit
+                break # Exit thread loop
+            except UnicodeDecodeError as e:
+                 logger.warning("Received non-UTF8 data from plugin, ignoring line: %s", e)
+            except Exception as e:
+                # Catch unexpected errors in the listener loop
+                logger.error("Unexpected error in plugin listener thread: %s", e, exc_info=True)
+                # Avoid tight loop on unexpected errors, maybe signal main thread?
+                listener_stop.wait(1)
+    finally:
+        if sel is not None:
+            sel.close()
+            with _listener_wake_lock:
+                _listener_wake_pipe = None
+                os.close(wake_r)
+                os.close(wake_w)
 
     logger.info("Plugin response listener thread stopped.")
 
 
-def display_plugin_response(resp_type: str, data: Dict[str, Any]):
+@functools.lru_cache(maxsize=512)
+def _fmt_minute(ts_min: int) -> str:
+    """Formats an epoch timestamp given in whole minutes; cached since inbox rows often share a minute."""
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(ts_min * 60))
+
+@functools.lru_cache(maxsize=256)
+def _hex_id(node_id: Any) -> str:
+    """Formats a Node ID as hex; cached because the same few node IDs repeat across responses."""
+    return f"{node_id:#0x}" if isinstance(node_id, int) else str(node_id)
+
+def _fmt_new_email(out: List[str], data: Dict[str, Any]):
+    out.append(
+        f"[*] New Email Received!\n"
+        f"    ID:   {data.get('message_id', 'N/A')}\n"
+        f"    From: {_hex_id(data.get('from_node_id', '?'))}\n" # Display Node ID in hex
+        f"    Subj: {data.get('subject', '(No Subject)')}\n"
+        f"    (Use 'read' command to see full message)\n"
+    )
+
+def _fmt_inbox_row(index: int, email_dict: Dict[str, Any]) -> str:
+    """Formats one inbox entry as a single multi-line string."""
+    # Look up each field once per row
+    get = email_dict.get
+    ts_float = get('timestamp', 0)
+    from_id = get('from_node_id', '?')
+    subj = get('subject', '(No Subject)')
+    body = get('body', '')
+    msg_id = get('message_id', 'N/A')
+
+    # Convert timestamp back to readable format
+    ts_str = _fmt_minute(int(ts_float) // 60) if ts_float else "N/A"
+    body_preview = body[:60] + "..." if len(body) > 60 else body # Preview first 60 chars
+
+    return (
+        f"    [{index}] From: {_hex_id(from_id)}  Rcvd: {ts_str}\n"
+        f"        Subj: {subj}\n"
+        f"        Body: {body_preview}\n"
+        f"        (ID: {msg_id})\n"
+    )
+
+def _fmt_inbox(out: List[str], data: Dict[str, Any]):
+    emails = data.get('emails', [])
+    if not emails:
+        out.append("    Inbox is empty.\n")
+        return
+
+    out.append(f"    Inbox ({len(emails)} messages):\n")
+    # Build all rows first so the output list grows once rather than per row
+    out.extend([_fmt_inbox_row(i, email_dict) for i, email_dict in enumerate(emails, 1)])
+    out.append("    --- End of List ---\n")
+
+# Streamed inbox (RESP_INBOX_ROW lines, then RESP_INBOX_END): each row is printed as it
+# arrives, so these formatters write the response banner themselves (see _UNFRAMED_RESPONSES)
+def _fmt_inbox_stream_row(out: List[str], data: Dict[str, Any]):
+    index = data.get('index', 0)
+    if index == 1:
+        out.append(_RESPONSE_HEADER)
+        out.append("    Inbox:\n")
+    out.append(_fmt_inbox_row(index, data.get('email') or {}))
+
+def _fmt_inbox_end(out: List[str], data: Dict[str, Any]):
+    count = data.get('count', 0)
+    if not count:
+        out.append(_RESPONSE_HEADER)
+        out.append("    Inbox is empty.\n")
+    else:
+        out.append(f"    --- End of List ({count} messages) ---\n")
+    out.append(_RESPONSE_FOOTER)
+
+def _fmt_status(out: List[str], data: Dict[str, Any]):
+    status = data.get('status', 'unknown')
+    msg_id = data.get('message_id')
+    info = data.get('info')
+    recipient = data.get('recipient_node_id')
+    acked_by = data.get('acked_by')
+    retries = data.get('retry_count')
+    alias = data.get('alias')
+
+    out.append("[*] Status Update:\n")
+    if msg_id: out.append(f"    Message ID: {msg_id}\n")
+    out.append(f"    Status: {status.upper()}\n")
+    if recipient: out.append(f"    Recipient: {_hex_id(recipient)}\n")
+    if acked_by: out.append(f"    Confirmed By: {_hex_id(acked_by)}\n")
+    if retries is not None: out.append(f"    Retry Count: {retries}\n")
+    if alias: out.append(f"    Alias: '{alias}'\n")
+    if info: out.append(f"    Info: {info}\n")
+
+def _fmt_pong(out: List[str], data: Dict[str, Any]):
+    ts = data.get('timestamp', time.time())
+    latency = time.time() - ts
+    out.append(f"[*] Pong received from plugin! (Latency: {latency:.3f}s)\n")
+
+def _fmt_error(out: List[str], data: Dict[str, Any]):
+    out.append("[!] Error from Plugin:\n")
+    if data.get('command'): out.append(f"    Command: {data['command']}\n")
+    if data.get('message_id'): out.append(f"    Message ID: {data['message_id']}\n")
+    out.append(f"    Message: {data.get('message', 'Unknown error')}\n")
+
+def _fmt_backpressure(out: List[str], data: Dict[str, Any]):
+    global _plugin_outbox_throttled
+    _plugin_outbox_throttled = bool(data.get('throttle'))
+    fill = f"{data.get('pending', '?')}/{data.get('limit', '?')} pending"
+    if _plugin_outbox_throttled:
+        out.append(f"[!] Plugin outbox is nearly full ({fill}). Please hold off sending new mail.\n")
+    else:
+        out.append(f"[*] Plugin outbox has room again ({fill}).\n")
+
+def _fmt_unknown(out: List[str], resp_type: str, data: Optional[Dict[str, Any]], raw: Optional[str]):
+    out.append(f"[*] Unknown Response Type '{resp_type}':\n")
+    if data is None:
+        out.append(f"    Raw: {raw}\n")
+    elif logger.isEnabledFor(logging.DEBUG):
+        out.append(f"    Data: {json.dumps(data, indent=2)}\n")
+    else:
+        # Keep the console output (and time spent formatting it) small outside debug mode
+        out.append(f"    Data: {repr(data)[:200]}\n")
+
+# Response type -> formatter appending the console lines for that response
+_RESPONSE_FORMATTERS = {
+    config.RESP_NEW_EMAIL_NOTIFY: _fmt_new_email,
+    config.RESP_INBOX_LIST: _fmt_inbox,
+    config.RESP_INBOX_ROW: _fmt_inbox_stream_row,
+    config.RESP_INBOX_END: _fmt_inbox_end,
+    config.RESP_STATUS_UPDATE: _fmt_status,
+    config.RESP_PONG: _fmt_pong,
+    config.RESP_ERROR: _fmt_error,
+    config.RESP_BACKPRESSURE: _fmt_backpressure,
+}
+# Responses that are parts of a larger one; their formatters add the banner lines
+_UNFRAMED_RESPONSES = frozenset((config.RESP_INBOX_ROW, config.RESP_INBOX_END))
+_RESPONSE_HEADER = "--- Plugin Response ---\n"
+_RESPONSE_FOOTER = "-----------------------\n"
+
+
+def display_plugin_response(resp_type: str, data: Optional[Dict[str, Any]], raw: Optional[str] = None):
     """
     Formats and prints responses/notifications received from the plugin
     to the console in a user-friendly way.
+    The whole response is assembled first and emitted with a single write.
+    For unknown response types, `raw` (the undecoded line) may be given instead of `data`.
     """
-    # Use readline's tools to preserve current input line
-    if readline:
-        current_input = readline.get_line_buffer()
-        sys.stdout.write('\r' + ' ' * len(current_input) + '\r') # Clear current line
-    else:
-        current_input = ""
-
-    # Print the formatted response
-    print("--- Plugin Response ---")
-    if resp_type == config.RESP_NEW_EMAIL_NOTIFY:
-        print(f"[*] New Email Received!")
-        print(f"    ID:   {data.get('message_id', 'N/A')}")
-        print(f"    From: {data.get('from_node_id', '?'):#0x}") # Display Node ID in hex
-        print(f"    Subj: {data.get('subject', '(No Subject)')}")
-        print(f"    (Use 'read' command to see full message)")
-
-    elif resp_type == config.RESP_INBOX_LIST:
-        emails = data.get('emails', [])
-        if not emails:
-            print("    Inbox is empty.")
+    out: List[str] = []
+
+    # Use readline's tools to preserve current input line; only clear/restore
+    # it when the user has actually typed something. Under prompt_toolkit,
+    # patch_stdout() already keeps the prompt intact.
+    current_input = readline.get_line_buffer() if readline and _prompt_session is None else ""
+    if current_input:
+        out.append('\r' + ' ' * len(current_input) + '\r') # Clear current line
+
+    # Format the response
+    formatter = _RESPONSE_FORMATTERS.get(resp_type)
+    if formatter is not None and data is not None:
+        if resp_type in _UNFRAMED_RESPONSES:
+            formatter(out, data)
         else:
-            print(f"    Inbox ({len(emails)} messages):")
-            for i, email_dict in enumerate(emails):
-                 # Convert timestamp back to readable format
-                 ts_float = email_dict.get('timestamp', 0)
-                 ts_str = time.strftime('%Y-%m-%d %H:%M', time.localtime(ts_float)) if ts_float else "N/A"
-                 from_id = email_dict.get('from_node_id', '?')
-                 subj = email_dict.get('subject', '(No Subject)')
-                 body_preview = email_dict.get('body', '')[:60] # Preview first 60 chars
-                 if len(email_dict.get('body', '')) > 60: body_preview += "..."
-
-                 print(f"    [{i+1}] From: {from_id:#0x}  Rcvd: {ts_str}")
-                 print(f"        Subj: {subj}")
-                 print(f"        Body: {body_preview}")
-                 print(f"        (ID: {email_dict.get('message_id', 'N/A')})")
-            print("    --- End of List ---")
-
-    elif resp_type == config.RESP_STATUS_UPDATE:
-         status = data.get('status', 'unknown')
-         msg_id = data.get('message_id')
-         info = data.get('info')
-         recipient = data.get('recipient_node_id')
-         acked_by = data.get('acked_by')
-         retries = data.get('retry_count')
-         alias = data.get('alias')
-
-         print(f"[*] Status Update:")
-         if msg_id: print(f"    Message ID: {msg_id}")
-         print(f"    Status: {status.upper()}")
-         if recipient: print(f"    Recipient: {recipient:#0x}")
-         if acked_by: print(f"    Confirmed By: {acked_by:#0x}")
-         if retries is not None: print(f"    Retry Count: {retries}")
-         if alias: print(f"    Alias: '{alias}'")
-         if info: print(f"    Info: {info}")
-
-    elif resp_type == config.RESP_PONG:
-         ts = data.get('timestamp', time.time())
-         latency = time.time() - ts
-         print(f"[*] Pong received from plugin! (Latency: {latency:.3f}s)")
-
-    elif resp_type == config.RESP_ERROR:
-         print(f"[!] Error from Plugin:")
-         if data.get('command'): print(f"    Command: {data['command']}")
-         if data.get('message_id'): print(f"    Message ID: {data['message_id']}")
-         print(f"    Message: {data.get('message', 'Unknown error')}")
-
+            out.append(_RESPONSE_HEADER)
+            formatter(out, data)
+            out.append(_RESPONSE_FOOTER)
     else:
         # Fallback for unknown response types
-        print(f"[*] Unknown Response Type '{resp_type}':")
-        print(f"    Data: {json.dumps(data, indent=2)}")
-
-    print("-----------------------")
+        out.append(_RESPONSE_HEADER)
+        _fmt_unknown(out, resp_type, data, raw)
+        out.append(_RESPONSE_FOOTER)
 
     # Restore the user's input line and cursor position
-    if readline:
-        sys.stdout.write(current_input)
-        sys.stdout.flush()
+    if current_input:
+        out.append(current_input)
+
+    sys.stdout.write("".join(out))
+    sys.stdout.flush()
 
 
 def print_help():
@@ -269,21 +545,48 @@ def close_plugin_connection():
     global plugin_serial
     if plugin_serial and plugin_serial.is_open:
         try:
+            _cancel_pending_read(plugin_serial)
             plugin_serial.close()
             logger.info("Plugin serial connection closed.")
         except Exception as e:
-            logger.error(f"Error closing plugin serial connection: {e}", exc_info=True)
+            logger.error("Error closing plugin serial connection: %s", e, exc_info=True)
     plugin_serial = None
+    # Wake the listener after closing so it observes the closed port and exits
+    _wake_listener()
 
 
+def _prompt(message: str = "") -> str:
+    """Reads one line of user input, via prompt_toolkit when it is active."""
+    if _prompt_session is not None:
+        return _prompt_session.prompt(message)
+    return input(message)
+
 def main_cli_loop():
-    """The main interactive loop for the command-line interface."""
-    global listener_running, plugin_serial
+    """
+    The main interactive loop for the command-line interface.
+    Uses prompt_toolkit when installed so plugin notifications printed by the
+    listener thread do not tear the input line; otherwise falls back to input().
+    """
+    global _prompt_session
+    if PromptSession is None:
+        _command_loop()
+        return
 
-    while listener_running: # Loop relies on listener thread status
+    _prompt_session = PromptSession()
+    try:
+        with patch_stdout():
+            _command_loop()
+    finally:
+        _prompt_session = None
+
+def _command_loop():
+    """Reads and dispatches CLI commands until the user exits or the listener stops."""
+    global plugin_serial
+
+    while not listener_stop.is_set(): # Loop relies on listener thread status
         try:
-            # Use input() with readline support
-            command_line = input("Akita> ").strip()
+            # Use prompt_toolkit, or input() with readline support
+            command_line = _prompt("Akita> ").strip()
             if not command_line:
                 continue # Skip empty input
 
@@ -293,7 +596,7 @@ def main_cli_loop():
 
             # --- Command Handling ---
             if cmd in ["quit", "exit"]:
-                listener_running = False # Signal listener thread to stop
+                stop_listener() # Signal listener thread to stop
                 break # Exit main loop
 
             elif cmd == "help":
@@ -305,29 +608,32 @@ def main_cli_loop():
 
             elif cmd == "send":
                 try:
-                    recipient_str = input("To Node ID (e.g., 0xabcd1234 or decimal): ").strip()
+                    recipient_str = _prompt("To Node ID (e.g., 0xabcd1234 or decimal): ").strip()
                     recipient_id = parse_node_id(recipient_str)
                     if recipient_id is None: continue # Error already printed by parse_node_id
 
-                    subject = input("Subject: ").strip()
+                    subject = _prompt("Subject: ").strip()
                     print("Body (end with 'EOF' or Ctrl+D on a new line):")
-                    body_lines = []
+                    body_buf = io.StringIO()
                     while True:
                         try:
-                            line = input()
+                            line = _prompt()
                             # Allow EOF marker, case-insensitive
                             if line.strip().upper() == "EOF": break
-                            body_lines.append(line)
+                            body_buf.write(line)
+                            body_buf.write('\n')
                         except EOFError:
                             print() # Print newline after Ctrl+D
                             break # Ctrl+D also ends input
 
-                    body = "\n".join(body_lines)
+                    body = body_buf.getvalue()[:-1] # Drop the final line terminator
 
                     if not body:
                          print("Email body cannot be empty. Sending cancelled.")
                          continue
 
+                    if _plugin_outbox_throttled:
+                        print("Note: the plugin outbox is nearly full; the oldest queued mail may be dropped.")
                     print("Sending email via plugin...")
                     send_command_to_plugin(plugin_serial, config.CMD_SEND_EMAIL,
                                            to_node_id=recipient_id,
@@ -341,7 +647,7 @@ def main_cli_loop():
                      print("\nInput cancelled.")
                 except Exception as e: # Catch unexpected errors during send input
                      print(f"An error occurred during the 'send' command: {e}")
-                     logger.error(f"Error during 'send' command input: {e}", exc_info=True)
+                     logger.error("Error during 'send' command input: %s", e, exc_info=True)
 
             elif cmd == "read":
                  limit = 50
@@ -381,20 +687,20 @@ def main_cli_loop():
             # Don't exit immediately, allow user to type quit
         except EOFError:
              print("\nEOF detected. Exiting.")
-             listener_running = False # Signal listener thread to stop
+             stop_listener() # Signal listener thread to stop
              break # Exit main loop
         except Exception as e:
             # Catch unexpected errors in the main loop
             print(f"\nAn unexpected error occurred in the CLI: {e}", file=sys.stderr)
-            logger.critical(f"Unexpected critical error in main CLI loop: {e}", exc_info=True)
+            logger.critical("Unexpected critical error in main CLI loop: %s", e, exc_info=True)
             # Maybe sleep or attempt recovery? For now, just log and continue.
             time.sleep(1)
 
 
 def run_companion():
     """Sets up and runs the companion CLI application."""
-    global plugin_serial, listener_running
-    logger.info(f"--- Starting Akita eMail Companion CLI v{config.VERSION} ---")
+    global plugin_serial
+    logger.info("--- Starting Akita eMail Companion CLI v%s ---", config.VERSION)
     print(f"--- Akita eMail Companion CLI v{config.VERSION} ---")
     print(f"Logging to: {log_file}")
 
@@ -403,6 +709,7 @@ def run_companion():
         sys.exit(1) # Exit if connection failed
 
     # Start the background listener thread
+    listener_stop.clear()
     listener_thread = threading.Thread(
         target=plugin_response_listener_thread,
         args=(plugin_serial,),
@@ -411,9 +718,9 @@ def run_companion():
     )
     listener_thread.start()
 
-    # Give the listener a moment to start up
-    time.sleep(0.5)
-    if not listener_running:
+    # Give the listener a moment to start up (returns early if it stops straight away)
+    listener_stop.wait(0.5)
+    if listener_stop.is_set() or not listener_thread.is_alive():
          logger.error("Listener thread failed to start.")
          print("Error: Could not start background listener thread.", file=sys.stderr)
          close_plugin_connection()
@@ -424,7 +731,8 @@ def run_companion():
 
     # --- Cleanup ---
     print("\nExiting Akita eMail Companion...")
-    # Listener thread should stop based on listener_running flag
+    # Listener thread should stop based on listener_stop; set it in case the loop exited otherwise
+    stop_listener()
     if listener_thread.is_alive():
          logger.debug("Waiting for listener thread to stop...")
          listener_thread.join(timeout=2.0) # Wait briefly for listener
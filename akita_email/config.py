@@ -1,6 +1,11 @@
 # akita_email/config.py
 import logging
+import logging.handlers
+import os
 import sys
+import threading
+import time
+import weakref
 
 # --- General Configuration ---
 APP_NAME = "AkitaEmail"
@@ -8,6 +13,19 @@ VERSION = "0.2.0" # Indicate refactored version
 
 # --- Meshtastic Plugin Configuration ---
 PLUGIN_DATABASE_FILE = "akita_plugin_store.db"
+# SQLite tuning (applied to every connection; the database runs in WAL mode)
+PLUGIN_DB_RELAXED_SYNC = True # synchronous=NORMAL; set False for synchronous=FULL (fsync every commit)
+PLUGIN_DB_CACHE_KIB = 8000    # Page cache size (~8 MiB)
+PLUGIN_DB_MMAP_BYTES = 64 * 1024 * 1024 # Memory-mapped I/O window
+PLUGIN_DB_BUSY_TIMEOUT_MS = 5000 # Wait this long for a lock before raising "database is locked"
+PLUGIN_DB_READER_POOL_SIZE = 4 # Read-only connections for inbox/status queries (0 = read via the writer)
+PLUGIN_DB_STATEMENT_CACHE_SIZE = 256 # Prepared statements kept per connection (sqlite3 default is 128)
+PLUGIN_DB_WRITE_BATCH_MAX = 64 # Queued outbox status updates committed per writer transaction
+PLUGIN_DB_FLUSH_TIMEOUT = 5.0 # Max seconds a read waits for earlier queued writes to commit
+PLUGIN_DB_OPTIMIZE_INTERVAL = 3600 * 6 # Seconds between PRAGMA optimize runs from the queue processor
+PLUGIN_DB_STATUS_CACHE_SIZE = 10000 # Outbox status rows kept in memory for get_outbox_status
+PLUGIN_WORKER_THREADS = min(4, os.cpu_count() or 1) # Threads processing received mesh packets
+PLUGIN_MAX_INFLIGHT = 64 # Received packets queued or in progress before new ones are dropped
 PLUGIN_LOG_FILE = "akita_plugin.log"
 PLUGIN_LOG_LEVEL = logging.INFO
 # Log Format - Consistent across modules
@@ -18,6 +36,15 @@ PRIMARY_CHANNEL_INDEX = 0 # Explicitly use Channel 0 (Primary Channel)
 MESSAGE_HOP_LIMIT = 7     # Max hops for a message (Meshtastic default is often 3 or 7)
 MESSAGE_RETRY_INTERVAL = 60 * 5 # Seconds between retries for un-ACKed messages (5 minutes)
 MESSAGE_EXPIRY_TIME = 3600 * 6 # Seconds before giving up on a message (6 hours)
+OUTBOX_SEND_BATCH_SIZE = 8 # Max outbox messages sent per queue processor pass
+OUTBOX_SEND_GAP = 0.2 # Seconds of airtime budgeted per sent message; the processor paces each batch to this
+OUTBOX_SEND_ERROR_WAIT = 10 # Seconds the processor waits after a batch in which no send attempt succeeded
+OUTBOX_IDLE_WAIT = 300 # Safety cap on idle waits; the processor sleeps until the next retry/expiry is due or mail is queued
+RECEIVED_ID_CACHE_SIZE = 2048 # Recently received email IDs remembered to short-circuit duplicates
+DUPLICATE_ACK_INTERVAL = 60 # Seconds before a duplicate of a received email is ACKed again (keep below MESSAGE_RETRY_INTERVAL)
+OUTBOX_MAX_PENDING = 500 # Max pending outbox messages; forwarding past this drops the oldest pending message
+OUTBOX_BACKPRESSURE_LEVEL = 0.8 # Pending fill ratio at which the companion is asked to hold off sending
+ACK_TX_QUEUE_SIZE = 128 # ACKs waiting for the radio; the oldest are dropped when full (their senders retry)
 # Use a private Meshtastic application port instead of the human text channel.
 MESHTASTIC_APP_PORT = 256
 MESHTASTIC_ACCEPTED_PORTS = {
@@ -40,6 +67,11 @@ MESSAGE_ID_MAX_LENGTH = 64
 # Example Windows: "COM3"
 COMPANION_SERIAL_PORT = "/dev/ttyUSB0" # CHANGE THIS TO YOUR PLUGIN -> COMPANION PORT
 COMPANION_SERIAL_BAUD = 115200
+COMPANION_LOW_LATENCY = True # Linux: put a USB serial companion adapter into low-latency mode (FTDI latency timer 16 ms -> 1 ms)
+COMPANION_TX_QUEUE_SIZE = 256 # Lines buffered for the companion; the oldest are dropped when full
+COMPANION_WRITE_CHUNK_BYTES = 4096 # Queued companion lines are coalesced into writes of about this size
+COMPANION_MAX_LINE_BYTES = 4096 # Longer command lines from the companion are discarded unparsed
+COMPANION_WIRE_FORMAT = "json" # "binary": stream inbox rows to the companion as packed frames (about 2.5x fewer bytes; the companion CLI reads both)
 
 # --- Companion CLI Configuration ---
 # Serial port the *companion CLI* uses to talk TO the plugin process
@@ -61,6 +93,21 @@ MSG_KEY_TIMESTAMP = 'ts' # Original Send Timestamp (Unix epoch, integer)
 MSG_KEY_HOPS = 'hp'      # Current Hop Count (Integer)
 MSG_KEY_ACK_FOR = 'af'   # ID of the message being ACKed (String)
 # MSG_KEY_ERROR = 'err'  # Optional: Error message content
+# MessagePack payloads use these one-byte integer keys instead. Wire format: never renumber.
+MSG_KEY_INT_MAP = {
+    MSG_KEY_TYPE: 0,
+    MSG_KEY_ID: 1,
+    MSG_KEY_TO: 2,
+    MSG_KEY_FROM: 3,
+    MSG_KEY_SUBJECT: 4,
+    MSG_KEY_BODY: 5,
+    MSG_KEY_TIMESTAMP: 6,
+    MSG_KEY_HOPS: 7,
+    MSG_KEY_ACK_FOR: 8,
+}
+# Encoding for outgoing LoRa payloads: "json", or "msgpack" for smaller packets (less airtime).
+# Receivers with the msgpack package installed accept both; nodes without it only understand JSON.
+LORA_WIRE_FORMAT = "json"
 
 # Message Types
 MSG_TYPE_EMAIL = 'eml'
@@ -76,24 +123,70 @@ CMD_GET_STATUS = "get_status" # Request status of an outgoing message
 CMD_PING_PLUGIN = "ping"      # Check if plugin is responsive
 
 # Response/Notification types for Plugin -> Companion communication
-RESP_INBOX_LIST = "inbox_list"
+RESP_INBOX_LIST = "inbox_list" # Whole inbox in one line (older plugins; the companion still understands it)
+RESP_INBOX_ROW = "inbox_row" # One inbox email per line, in reply to CMD_READ_EMAILS...
+RESP_INBOX_END = "inbox_end" # ...followed by this, with the number of rows sent
 RESP_STATUS_UPDATE = "status_update" # For ACK/fail/progress notifications
 RESP_NEW_EMAIL_NOTIFY = "new_email_notify"
 RESP_PONG = "pong" # Response to ping
 RESP_ERROR = "error_response" # General error reporting to companion
+RESP_BACKPRESSURE = "backpressure" # Outbox fill level crossed OUTBOX_BACKPRESSURE_LEVEL (either way)
 
 # --- Utility Functions ---
+LOG_FILE_BUFFER_CAPACITY = 64 # Records buffered before a file write (WARNING+ flushes immediately)
+LOG_FILE_FLUSH_INTERVAL = 2.0 # Seconds buffered INFO/DEBUG records may wait before they are written
+
+# Shared formatter instance for every handler created by setup_logger
+_LOG_FORMATTER = logging.Formatter(LOG_FORMAT)
+
+# Buffered file handlers, flushed every LOG_FILE_FLUSH_INTERVAL by one daemon thread
+# (logging.shutdown flushes and closes them at exit)
+_buffered_handlers: "weakref.WeakSet[logging.handlers.MemoryHandler]" = weakref.WeakSet()
+_log_flusher = None # Started with the first buffered handler
+_log_flusher_lock = threading.Lock()
+
+def _flush_log_buffers():
+    """Daemon thread loop: writes out buffered log records so a quiet node's log stays current."""
+    while True:
+        time.sleep(LOG_FILE_FLUSH_INTERVAL)
+        for handler in list(_buffered_handlers):
+            try:
+                handler.flush()
+            except Exception:
+                pass # A handler closed at shutdown; nothing left to write
+
+def _register_buffered_handler(handler: logging.handlers.MemoryHandler):
+    """Adds a buffered handler to the periodic flush, starting the flusher thread on first use."""
+    global _log_flusher
+    _buffered_handlers.add(handler)
+    with _log_flusher_lock:
+        if _log_flusher is None:
+            _log_flusher = threading.Thread(target=_flush_log_buffers, name="AkitaLogFlusher", daemon=True)
+            _log_flusher.start()
+
 def setup_logger(name: str, level: int, log_file: str, console: bool = True):
-    """Configures and returns a logger instance."""
+    """
+    Configures and returns a logger instance.
+    Calling it again for an already configured logger returns it unchanged,
+    so handlers are never attached twice.
+    """
     logger = logging.getLogger(name)
+    if logger.handlers:
+        return logger
     logger.setLevel(level)
-    formatter = logging.Formatter(LOG_FORMAT)
 
-    # File Handler
+    # File Handler (buffered so routine records are written in batches; warnings and
+    # errors are written at once, and the rest within LOG_FILE_FLUSH_INTERVAL)
     try:
-        fh = logging.FileHandler(log_file)
-        fh.setFormatter(formatter)
+        raw_fh = logging.FileHandler(log_file)
+        raw_fh.setFormatter(_LOG_FORMATTER)
+        fh = logging.handlers.MemoryHandler(
+            capacity=LOG_FILE_BUFFER_CAPACITY,
+            flushLevel=logging.WARNING,
+            target=raw_fh,
+        )
         logger.addHandler(fh)
+        _register_buffered_handler(fh)
     except Exception as e:
         print(f"Warning: Could not set up file logging to {log_file}: {e}", file=sys.stderr)
 
@@ -101,10 +194,9 @@ def setup_logger(name: str, level: int, log_file: str, console: bool = True):
     # Console Handler
     if console:
         ch = logging.StreamHandler(sys.stdout)
-        ch.setFormatter(formatter)
+        ch.setFormatter(_LOG_FORMATTER)
         logger.addHandler(ch)
 
     # Prevent duplicate logging if called multiple times
     logger.propagate = False
     return logger
-
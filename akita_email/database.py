@@ -1,22 +1,190 @@
 # akita_email/database.py
+import collections
+import contextlib
+import queue
 import sqlite3
+import threading
 import time
 import logging
-from typing import List, Optional
+import weakref
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError # Not builtin TimeoutError before 3.11
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from . import config
-from .models import Email, NodeId, STATUS_PENDING, STATUS_SENT, STATUS_ACKED, STATUS_FAILED, STATUS_RECEIVED
+from .models import Email, NodeId, OutboxStatus, STATUS_PENDING, STATUS_SENT, STATUS_ACKED, STATUS_FAILED, STATUS_RECEIVED
 from .exceptions import DatabaseError
 
 # Get a logger specific to this module
 logger = config.setup_logger(__name__, config.PLUGIN_LOG_LEVEL, config.PLUGIN_LOG_FILE, console=False)
 
+# Time columns are stored as INTEGER microseconds since the epoch; Email fields
+# stay float seconds, and conversion happens at this module's boundary.
+_US_PER_SECOND = 1_000_000
+
+def _to_us(t: float) -> int:
+    """Converts epoch seconds to the integer microseconds stored in the database."""
+    return round(t * _US_PER_SECOND)
+
+# PRAGMA user_version of the current schema (1: time columns in INTEGER microseconds)
+_SCHEMA_VERSION = 1
+
+# Column lists for the read queries. Rows come back as plain tuples in this
+# order, which matches the positional parameters of Email.from_row.
+_OUTBOX_COLS = (
+    "message_id", "to_node_id", "from_node_id", "subject", "body", "timestamp", "hops",
+    "status", "last_attempt_time", "retry_count", "created_time", "acked_by_node_id",
+)
+_OUTBOX_SELECT = f"SELECT {', '.join(_OUTBOX_COLS)} FROM outbox"
+# Status checks skip the body column
+_OUTBOX_STATUS_SELECT = f"SELECT {', '.join(c for c in _OUTBOX_COLS if c != 'body')} FROM outbox"
+_INBOX_COLS = (
+    "message_id", "to_node_id", "from_node_id", "subject", "body", "timestamp", "hops",
+    "received_time",
+)
+_INBOX_SELECT = f"SELECT {', '.join(_INBOX_COLS)} FROM inbox"
+
+# Statements for the hot paths. Passing the same string object on every call
+# keeps them resident in each connection's prepared statement cache.
+_SQL_ADD_INBOX = '''INSERT OR IGNORE INTO inbox
+    (message_id, to_node_id, from_node_id, subject, body, timestamp, hops, received_time)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)'''
+_SQL_ADD_OUTBOX = '''INSERT OR IGNORE INTO outbox
+    (message_id, to_node_id, from_node_id, subject, body, timestamp, hops, status, created_time)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+# Fails unfinished messages that are past their lifetime or already at the hop limit
+# (which can only be reached by lowering MESSAGE_HOP_LIMIT at runtime)
+_SQL_EXPIRE_OUTBOX = '''UPDATE outbox SET status = ?, last_attempt_time = ?
+    WHERE status IN (?, ?) AND (created_time < ? OR hops >= ?)'''
+# Each branch of the UNION ALL gets its own index search instead of one scan
+# matching either status. ORDER BY still applies to the combined result: the
+# retry branch is sorted in a temp B-tree and the two branches are merged.
+_SQL_OUTBOX_QUEUE = (
+    _OUTBOX_SELECT + " WHERE status = ?"
+    " UNION ALL " + _OUTBOX_SELECT + " WHERE status = ? AND last_attempt_time < ?"
+    " ORDER BY created_time ASC" # Process oldest first
+    " LIMIT ?" # -1 means no limit
+)
+_SQL_MARK_SENT = '''UPDATE outbox
+    SET status = ?, last_attempt_time = ?, retry_count = retry_count + 1
+    WHERE message_id = ?'''
+_SQL_MARK_ACKED = '''UPDATE outbox
+    SET status = ?, last_attempt_time = ?, acked_by_node_id = ?
+    WHERE message_id = ?'''
+_SQL_MARK_FAILED = '''UPDATE outbox SET status = ?, last_attempt_time = ?
+    WHERE message_id = ?'''
+_SQL_OUTBOX_PENDING_COUNT = "SELECT COUNT(*) FROM outbox WHERE status = ?"
+# Oldest send attempt still awaiting an ACK (idx_outbox_queue order) and oldest unfinished
+# message (idx_outbox_status_created); each subquery stops at its first index entry
+_SQL_OUTBOX_NEXT_DUE = (
+    "SELECT (SELECT last_attempt_time FROM outbox WHERE status = ? ORDER BY last_attempt_time LIMIT 1),"
+    " (SELECT MIN(created_time) FROM outbox WHERE status = ?),"
+    " (SELECT MIN(created_time) FROM outbox WHERE status = ?)"
+)
+# The n oldest pending messages (index search on idx_outbox_status_created). Eviction selects
+# them and fails them in one transaction; UPDATE ... RETURNING needs SQLite 3.35+.
+_SQL_OLDEST_PENDING = "SELECT message_id FROM outbox WHERE status = ? ORDER BY created_time ASC LIMIT ?"
+_SQL_OUTBOX_EXISTS = "SELECT 1 FROM outbox WHERE message_id = ?"
+_SQL_INBOX_PAGE = _INBOX_SELECT + " ORDER BY received_time DESC LIMIT ?"
+_SQL_OUTBOX_STATUS = _OUTBOX_STATUS_SELECT + " WHERE message_id = ?"
+
+# Queued by close() to stop the writer thread
+_WRITER_STOP = object()
+
+class _ClosedConnection:
+    """
+    Stands in for AkitaDatabase.conn before it connects and after close().
+    Any use raises DatabaseError, so methods don't need to check the connection first.
+    """
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        raise DatabaseError("Database not connected")
+
+    def __enter__(self):
+        raise DatabaseError("Database not connected")
+
+    def __exit__(self, *exc_info):
+        return False
+
+_CLOSED = _ClosedConnection()
+
+def _safe_close(conn: sqlite3.Connection, readers: List[sqlite3.Connection], write_q: "queue.Queue[Any]"):
+    """
+    Finalizer for an AkitaDatabase that was never closed. Stops its writer thread and
+    closes the connections. Only touches these objects, so it is safe to run during
+    interpreter shutdown.
+    """
+    write_q.put(_WRITER_STOP)
+    for c in [*readers, conn]:
+        try:
+            c.close()
+        except Exception:
+            pass
+
+def _writer_loop(db_ref: "weakref.ref[AkitaDatabase]", write_q: "queue.Queue[Any]"):
+    """
+    Background thread loop that commits queued writes.
+    Drains up to PLUGIN_DB_WRITE_BATCH_MAX queued (sql, params, future) items and
+    commits them in one transaction, in the order they were queued (see AkitaDatabase._commit_batch).
+    Flush markers queued by flush_writes are set once the writes ahead of them are done.
+    Holds the database only through a weak reference between batches, so an AkitaDatabase
+    dropped without close() can still be finalized (which queues _WRITER_STOP).
+    """
+    stopping = False
+    while not stopping:
+        batch: List[Tuple[str, tuple, Optional[Future]]] = []
+        markers: List[threading.Event] = []
+        item = write_q.get()
+        while True:
+            if item is _WRITER_STOP:
+                stopping = True
+            elif isinstance(item, threading.Event):
+                markers.append(item)
+            else:
+                batch.append(item)
+            if stopping or len(batch) >= config.PLUGIN_DB_WRITE_BATCH_MAX:
+                break
+            try:
+                item = write_q.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            db = db_ref()
+            if db is None:
+                return # Dropped without close(); its finalizer has closed the connections
+            if batch:
+                db._commit_batch(batch)
+            del db
+        finally:
+            for marker in markers:
+                marker.set()
+
+# Outbox timing and hop limit used by the queue scan, bound once so the hot path skips the config lookups
+_RETRY_INTERVAL = config.MESSAGE_RETRY_INTERVAL
+_EXPIRY_TIME = config.MESSAGE_EXPIRY_TIME
+_HOP_LIMIT = config.MESSAGE_HOP_LIMIT
+
+def reload_config():
+    """Re-reads the outbox retry/expiry/hop settings after config values are changed at runtime."""
+    global _RETRY_INTERVAL, _EXPIRY_TIME, _HOP_LIMIT
+    _RETRY_INTERVAL = config.MESSAGE_RETRY_INTERVAL
+    _EXPIRY_TIME = config.MESSAGE_EXPIRY_TIME
+    _HOP_LIMIT = config.MESSAGE_HOP_LIMIT
+
 class AkitaDatabase:
     """
     Handles all SQLite database operations for the Akita eMail Plugin.
     Manages inbox and outbox tables.
-    Ensures thread safety for database operations using a connection per instance
-    and relying on SQLite's default serialization for writes within transactions.
+    All writes go through a single writer connection (self.conn), one
+    transaction at a time (see _transaction). Read-only queries
+    check out a connection from a small pool of query_only reader connections,
+    so under WAL they do not wait behind the writer.
+    Outbox status updates (sent/acked/failed) are queued and committed in
+    batches by a background writer thread; methods that read outbox state
+    wait for queued updates to land first.
+    Recently used outbox status rows are also kept in a bounded in-memory
+    cache that is updated as status changes are queued, so get_outbox_status
+    usually doesn't touch SQLite. The database remains the source of truth.
     """
 
     def __init__(self, db_path: str = config.PLUGIN_DATABASE_FILE):
@@ -30,27 +198,299 @@ class AkitaDatabase:
             DatabaseError: If the connection or table creation fails.
         """
         self.db_path = db_path
-        self.conn: Optional[sqlite3.Connection] = None
+        self.conn: sqlite3.Connection = _CLOSED # type: ignore[assignment]
+        # Reader connections are opened lazily up to the pool size. An in-memory
+        # database is private to its connection, so it reads through self.conn.
+        self._reader_pool: Optional["queue.Queue[sqlite3.Connection]"] = None
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        # Serializes transactions on the shared writer connection across threads
+        self._write_lock = threading.RLock()
+        if db_path != ":memory:" and config.PLUGIN_DB_READER_POOL_SIZE > 0:
+            self._reader_pool = queue.Queue()
+        self._write_q: "queue.Queue[Any]" = queue.Queue()
+        self._writer_thread: Optional[threading.Thread] = None
+        # message_id -> row in _SQL_OUTBOX_STATUS column order, least recently used first
+        self._status_cache: "collections.OrderedDict[str, tuple]" = collections.OrderedDict()
+        self._status_lock = threading.Lock()
+        self._status_generation = 0 # Bumped on every status change; guards cache fills
+        self._finalizer: Optional[weakref.finalize] = None
         try:
-            # Connect to the database. check_same_thread=False allows the connection
-            # to be used by multiple threads (plugin, queue processor, companion listener),
-            # but requires careful transaction management (using 'with self.conn:')
-            self.conn = sqlite3.connect(self.db_path, check_same_thread=False,
-                                        detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-            self.conn.row_factory = sqlite3.Row # Access columns by name (e.g., row['subject'])
+            # Connect to the database (this is the single writer connection)
+            self.conn = self._open_connection()
+            # Stops the writer thread and closes the connections if the object is dropped
+            # (or the interpreter exits) without close()
+            self._finalizer = weakref.finalize(self, _safe_close, self.conn, self._readers, self._write_q)
             self._create_tables()
-            logger.info(f"Database initialized successfully at {self.db_path}")
+            logger.info("Database initialized successfully at %s", self.db_path)
         except sqlite3.Error as e:
-            logger.error(f"Database connection or table creation failed: {e}", exc_info=True)
+            logger.error("Database connection or table creation failed: %s", e, exc_info=True)
             raise DatabaseError(f"Database connection/setup failed: {e}") from e
+        self._writer_thread = threading.Thread(
+            target=_writer_loop,
+            args=(weakref.ref(self), self._write_q),
+            name="AkitaDatabaseWriter",
+            daemon=True
+        )
+        self._writer_thread.start()
+
+    def _open_connection(self) -> sqlite3.Connection:
+        """Opens and configures a new connection to the database file."""
+        # check_same_thread=False lets any thread use the connection. Readers get their
+        # own pooled connections (see _reader). All writes share the one writer connection:
+        # SQLite admits a single writer at a time even under WAL, so per-thread write
+        # connections would only trade _write_lock for SQLITE_BUSY retries.
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+                               cached_statements=config.PLUGIN_DB_STATEMENT_CACHE_SIZE)
+        self._configure_connection(conn)
+        return conn
+
+    @contextlib.contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """
+        Checks out a read-only connection for the duration of the block.
+        Falls back to the writer connection when no reader pool is in use.
+        """
+        pool = self._reader_pool
+        if pool is None:
+            yield self.conn
+            return
 
-    def _create_tables(self):
-        """Creates the inbox and outbox tables if they don't exist."""
-        if not self.conn:
-            raise DatabaseError("Database connection is not available.")
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            with self._readers_lock:
+                can_open = len(self._readers) < config.PLUGIN_DB_READER_POOL_SIZE
+                if can_open:
+                    conn = self._open_connection()
+                    conn.execute("PRAGMA query_only=1")
+                    self._readers.append(conn)
+            if not can_open:
+                conn = pool.get() # All readers busy; wait for one to be returned
+        try:
+            yield conn
+        finally:
+            pool.put(conn)
 
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Runs the block in a transaction on the writer connection, committing on
+        success and rolling back on error, including a failed commit, so the
+        connection is never left inside an open transaction. Any transaction that may write starts
+        with BEGIN IMMEDIATE, so the write lock is taken up front rather than
+        upgraded from a read lock partway through (which can fail with SQLITE_BUSY
+        under WAL instead of waiting on busy_timeout).
+        """
+        with self._write_lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def _commit_batch(self, batch: List[Tuple[str, tuple, Optional[Future]]]):
+        """
+        Commits queued writes in one transaction. Items with a future (inserts from
+        _group_commit) run one by one so each gets its own rowcount, which is handed back
+        once the transaction has committed. If the transaction fails, the items are retried
+        one transaction each, so one bad write neither loses the others nor fails their futures.
+        Never raises: a write that cannot be committed is logged (and its future failed).
+        """
+        results: List[Tuple[Future, int]] = []
         try:
-            with self.conn: # Use context manager for automatic commit/rollback
+            with self._transaction() as conn:
+                # Consecutive updates of the same kind go through one executemany
+                start = 0
+                for end in range(1, len(batch) + 1):
+                    if end < len(batch) and batch[end][0] == batch[start][0] \
+                            and batch[end][2] is None and batch[start][2] is None:
+                        continue
+                    sql, params, future = batch[start]
+                    if future is not None:
+                        results.append((future, conn.execute(sql, params).rowcount))
+                    else:
+                        conn.executemany(sql, [item[1] for item in batch[start:end]])
+                    start = end
+        except Exception as e:
+            batch_error: Optional[Exception] = e
+            if len(batch) > 1:
+                logger.warning("Failed to commit %s queued writes together (%s); retrying them one at a time.",
+                               len(batch), e)
+                batch_error = None
+            lost = 0
+            for sql, params, future in batch:
+                try:
+                    if batch_error is not None:
+                        raise batch_error # A lone write already failed on its own
+                    rowcount = self._write_now(sql, params)
+                except Exception as item_error:
+                    lost += 1
+                    logger.error("Dropped queued write '%s...': %s", sql.split('\n', 1)[0], item_error,
+                                 exc_info=True)
+                    if future is not None:
+                        future.set_exception(item_error)
+                else:
+                    if future is not None:
+                        future.set_result(rowcount)
+            if lost:
+                # A lost status update leaves the row at its previous status: a message is then
+                # resent on its next retry, or fails at expiry. The cache already reflects the
+                # lost updates, so fall back to the database.
+                with self._status_lock:
+                    self._status_cache.clear()
+                    self._status_generation += 1
+            return
+        logger.debug("Committed %s queued write(s).", len(batch))
+        for future, rowcount in results:
+            future.set_result(rowcount)
+
+    def _write_now(self, sql: str, params: tuple) -> int:
+        """Runs a single write in its own transaction on the calling thread and returns its rowcount."""
+        with self._transaction() as conn:
+            return conn.execute(sql, params).rowcount
+
+    def _queue_write(self, sql: str, params: tuple, future: Optional[Future] = None) -> bool:
+        """
+        Queues an outbox update (or, with a future, an insert) for the writer thread.
+
+        Returns:
+            False, without queuing, if the writer thread is not running; the caller
+            then commits the write itself with _write_now.
+        """
+        writer = self._writer_thread
+        if writer is None or not writer.is_alive():
+            return False
+        self._write_q.put((sql, params, future))
+        return True
+
+    def _group_commit(self, sql: str, params: tuple) -> int:
+        """
+        Runs a single-row write through the writer thread and returns its rowcount once
+        committed. Writes arriving together from several threads (e.g. a burst of received
+        emails on the packet workers) share one transaction instead of one commit each.
+        If that shared transaction fails, the writer retries its writes individually, so
+        the returned rowcount or raised error is always this write's own outcome.
+        Runs its own transaction if the writer thread is not running.
+
+        Raises:
+            sqlite3.Error: If this write fails.
+            DatabaseError: If the database is closed before the write commits.
+        """
+        future: Future = Future()
+        if not self._queue_write(sql, params, future):
+            return self._write_now(sql, params)
+        while True:
+            try:
+                return future.result(timeout=1.0)
+            except FutureTimeoutError:
+                writer = self._writer_thread
+                if (writer is None or not writer.is_alive()) and not future.done():
+                    # Queued behind close(); close() commits stranded writes, so give it a moment
+                    try:
+                        return future.result(timeout=1.0)
+                    except FutureTimeoutError:
+                        raise DatabaseError("Database closed before the write was committed") from None
+
+    def _cache_status_row(self, row: tuple):
+        """Adds or refreshes an outbox status row in the cache. Caller holds _status_lock."""
+        cache = self._status_cache
+        cache[row[0]] = row
+        cache.move_to_end(row[0])
+        if len(cache) > config.PLUGIN_DB_STATUS_CACHE_SIZE:
+            cache.popitem(last=False)
+
+    def _queue_status_change(self, sql: str, params: tuple, message_id: str, status: str,
+                             now: float, attempted: bool = False, acked_by: Optional[NodeId] = None):
+        """
+        Applies a status change to the cached row (if any) and queues it for the writer thread,
+        or commits it directly if the writer is not running.
+
+        Raises:
+            DatabaseError: If a direct commit fails (including after close()).
+        """
+        with self._status_lock:
+            self._status_generation += 1
+            row = self._status_cache.get(message_id)
+            if row is not None:
+                # (message_id, to, from, subject, timestamp, hops, status, last_attempt, retries, created, acked_by)
+                self._status_cache[message_id] = row[:6] + (
+                    status, now, row[8] + attempted, row[9], acked_by if acked_by is not None else row[10]
+                )
+            # Queued under the lock, so the writer applies changes in the order the cache saw them
+            if self._queue_write(sql, params):
+                return
+        # Committed outside _status_lock: transactions take _write_lock before _status_lock
+        try:
+            self._write_now(sql, params)
+        except sqlite3.Error as e:
+            logger.error("Failed to update outbox email %s to '%s': %s", message_id, status, e, exc_info=True)
+            with self._status_lock:
+                self._status_cache.pop(message_id, None)
+                self._status_generation += 1
+            raise DatabaseError(f"Failed to update outbox status: {e}") from e
+
+    def flush_writes(self, timeout: float = config.PLUGIN_DB_FLUSH_TIMEOUT) -> bool:
+        """
+        Blocks until the writes queued before this call have been committed (or have failed).
+        Writes queued afterwards are not waited for, so steady write traffic cannot stall readers.
+
+        Returns:
+            True once flushed (or if there is no writer thread), False if `timeout` seconds passed first.
+        """
+        writer = self._writer_thread
+        if writer is None or not writer.is_alive():
+            return True
+        marker = threading.Event()
+        self._write_q.put(marker)
+        deadline = time.monotonic() + timeout
+        while not marker.wait(min(1.0, max(0.0, deadline - time.monotonic()))):
+            if not writer.is_alive():
+                return marker.is_set()
+            if time.monotonic() >= deadline:
+                logger.warning("Queued database writes not flushed within %ss; reading without them.", timeout)
+                return False
+        return True
+
+    def _configure_connection(self, conn: sqlite3.Connection):
+        """
+        Applies performance PRAGMAs to a freshly opened connection.
+        WAL lets readers run alongside the queue writer and turns each commit into a
+        single log append; synchronous=NORMAL is only used if config allows it.
+        """
+        conn.execute("PRAGMA journal_mode=WAL") # Reports 'memory' for in-memory databases
+        synchronous = "NORMAL" if config.PLUGIN_DB_RELAXED_SYNC else "FULL"
+        conn.execute(f"PRAGMA synchronous={synchronous}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA cache_size=-{config.PLUGIN_DB_CACHE_KIB}") # Negative value = KiB
+        conn.execute(f"PRAGMA mmap_size={config.PLUGIN_DB_MMAP_BYTES}")
+        conn.execute(f"PRAGMA busy_timeout={config.PLUGIN_DB_BUSY_TIMEOUT_MS}")
+
+    def _create_tables(self):
+        """
+        Creates the inbox and outbox tables if they don't exist, migrating
+        tables from an older schema version in place.
+        """
+        try:
+            with self._transaction(): # Any migration and the DDL below commit (or roll back) together
+                version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+                legacy = version < 1 and self.conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'inbox'"
+                ).fetchone() is not None
+                if legacy:
+                    # Version 0 stored times as REAL seconds. Move the old tables aside
+                    # (dropping their indexes so the names are free) and copy them below.
+                    logger.info("Migrating database time columns to integer microseconds.")
+                    for index in ('idx_inbox_received_time', 'idx_outbox_status_attempt', 'idx_outbox_queue',
+                                  'idx_outbox_created_time', 'idx_outbox_status_created'):
+                        self.conn.execute(f'DROP INDEX IF EXISTS {index}')
+                    self.conn.execute('ALTER TABLE inbox RENAME TO inbox_v0')
+                    self.conn.execute('ALTER TABLE outbox RENAME TO outbox_v0')
+
                 # Inbox: Stores emails received by this node
                 self.conn.execute('''
                     CREATE TABLE IF NOT EXISTS inbox (
@@ -59,9 +499,9 @@ class AkitaDatabase:
                         from_node_id INTEGER NOT NULL,
                         subject TEXT,
                         body TEXT NOT NULL,
-                        timestamp REAL NOT NULL, -- Original send time
+                        timestamp INTEGER NOT NULL, -- Original send time (microseconds)
                         hops INTEGER NOT NULL,
-                        received_time REAL DEFAULT (strftime('%s', 'now')) -- When we received it
+                        received_time INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER) * 1000000) -- When we received it
                     )
                 ''')
                 # Outbox: Stores emails originated from or being forwarded by this node
@@ -72,23 +512,53 @@ class AkitaDatabase:
                         from_node_id INTEGER NOT NULL, -- Original sender
                         subject TEXT,
                         body TEXT NOT NULL,
-                        timestamp REAL NOT NULL,    -- Original creation time
+                        timestamp INTEGER NOT NULL, -- Original creation time (microseconds)
                         hops INTEGER DEFAULT 0,     -- Hops when *we* send/forward it
                         status TEXT NOT NULL DEFAULT 'pending', -- pending, sent, acked, failed
-                        last_attempt_time REAL DEFAULT 0,
+                        last_attempt_time INTEGER NOT NULL DEFAULT 0, -- Microseconds
                         retry_count INTEGER DEFAULT 0,
-                        created_time REAL DEFAULT (strftime('%s', 'now')), -- When added to our outbox
+                        created_time INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER) * 1000000), -- When added to our outbox
                         acked_by_node_id INTEGER -- Node ID that sent the ACK
                     )
                 ''')
                 # Add indexes for performance on common lookups
                 self.conn.execute('CREATE INDEX IF NOT EXISTS idx_inbox_received_time ON inbox(received_time)')
-                self.conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_status_attempt ON outbox(status, last_attempt_time)')
+                # idx_outbox_queue supersedes the older (status, last_attempt_time) index
+                self.conn.execute('DROP INDEX IF EXISTS idx_outbox_status_attempt')
+                self.conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_queue ON outbox(status, last_attempt_time, created_time)')
                 self.conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_created_time ON outbox(created_time)')
+                self.conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_status_created ON outbox(status, created_time)')
+
+                if legacy:
+                    self.conn.execute('''
+                        INSERT INTO inbox
+                        SELECT message_id, to_node_id, from_node_id, subject, body,
+                               CAST(ROUND(timestamp * 1000000) AS INTEGER), hops,
+                               CAST(ROUND(COALESCE(received_time, timestamp) * 1000000) AS INTEGER)
+                        FROM inbox_v0
+                    ''')
+                    self.conn.execute('''
+                        INSERT INTO outbox
+                        SELECT message_id, to_node_id, from_node_id, subject, body,
+                               CAST(ROUND(timestamp * 1000000) AS INTEGER), hops, status,
+                               CAST(ROUND(COALESCE(last_attempt_time, 0) * 1000000) AS INTEGER), retry_count,
+                               CAST(ROUND(COALESCE(created_time, timestamp) * 1000000) AS INTEGER), acked_by_node_id
+                        FROM outbox_v0
+                    ''')
+                    self.conn.execute('DROP TABLE inbox_v0')
+                    self.conn.execute('DROP TABLE outbox_v0')
+                self.conn.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+
+            # Gather planner statistics once, the first time the tables are seen
+            has_stats = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+            ).fetchone()
+            if not has_stats:
+                self.conn.execute("ANALYZE")
 
             logger.debug("Database tables verified/created.")
         except sqlite3.Error as e:
-            logger.error(f"Failed to create/verify database tables: {e}", exc_info=True)
+            logger.error("Failed to create/verify database tables: %s", e, exc_info=True)
             raise DatabaseError(f"Failed to create/verify tables: {e}") from e
 
     def add_incoming_email(self, email: Email) -> bool:
@@ -104,25 +574,55 @@ class AkitaDatabase:
         Raises:
             DatabaseError: If the database operation fails.
         """
-        if not self.conn: raise DatabaseError("Database not connected")
+        # Group-committed with other queued writes; the caller still gets the new/duplicate
+        # answer it needs for ACKs and notifications. Bulk imports should use add_incoming_emails.
+        try:
+            rowcount = self._group_commit(
+                _SQL_ADD_INBOX,
+                (email.message_id, email.to_node_id, email.from_node_id,
+                 email.subject, email.body, _to_us(email.timestamp), email.hops,
+                 _to_us(time.time()))
+            )
+        except sqlite3.Error as e:
+            logger.error("Failed to add incoming email %s: %s", email.message_id, e, exc_info=True)
+            raise DatabaseError(f"Failed to add incoming email: {e}") from e
+        # rowcount comes straight from sqlite3_changes(); 0 means OR IGNORE skipped a duplicate
+        if rowcount > 0:
+            logger.info("Stored incoming email %s from %#x", email.message_id, email.from_node_id)
+            return True
+        logger.debug("Ignored duplicate incoming email %s", email.message_id)
+        return False
+
+    def add_incoming_emails(self, emails: List[Email]) -> int:
+        """
+        Stores a batch of received emails in the inbox table within a single transaction.
+        Duplicates (by message_id) are ignored.
+
+        Args:
+            emails: The Email objects to store.
+
+        Returns:
+            The number of emails actually added.
+
+        Raises:
+            DatabaseError: If the database operation fails.
+        """
+        if not emails:
+            return 0
         try:
-            with self.conn:
-                cursor = self.conn.execute(
-                    '''INSERT OR IGNORE INTO inbox
-                       (message_id, to_node_id, from_node_id, subject, body, timestamp, hops)
-                       VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                    (email.message_id, email.to_node_id, email.from_node_id,
-                     email.subject, email.body, email.timestamp, email.hops)
+            with self._transaction():
+                received_us = _to_us(time.time())
+                cursor = self.conn.executemany(
+                    _SQL_ADD_INBOX,
+                    [(email.message_id, email.to_node_id, email.from_node_id,
+                      email.subject, email.body, _to_us(email.timestamp), email.hops,
+                      received_us)
+                     for email in emails]
                 )
-            if cursor.rowcount > 0:
-                logger.info(f"Stored incoming email {email.message_id} from {email.from_node_id:#0x}")
-                return True
-            else:
-                logger.debug(f"Ignored duplicate incoming email {email.message_id}")
-                return False
+            return max(cursor.rowcount, 0)
         except sqlite3.Error as e:
-            logger.error(f"Failed to add incoming email {email.message_id}: {e}", exc_info=True)
-            raise DatabaseError(f"Failed to add incoming email {email.message_id}: {e}") from e
+            logger.error("Failed to add %s incoming email(s): %s", len(emails), e, exc_info=True)
+            raise DatabaseError(f"Failed to add incoming emails: {e}") from e
 
     def add_outgoing_email(self, email: Email) -> bool:
         """
@@ -138,205 +638,369 @@ class AkitaDatabase:
         Raises:
             DatabaseError: If the database operation fails.
         """
-        if not self.conn: raise DatabaseError("Database not connected")
         try:
-            with self.conn:
-                cursor = self.conn.execute(
-                    '''INSERT OR IGNORE INTO outbox
-                       (message_id, to_node_id, from_node_id, subject, body, timestamp, hops, status, created_time)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                    (email.message_id, email.to_node_id, email.from_node_id,
-                     email.subject, email.body, email.timestamp, email.hops,
-                     STATUS_PENDING, email.created_time) # Start as pending
+            rowcount = self._group_commit(
+                _SQL_ADD_OUTBOX,
+                (email.message_id, email.to_node_id, email.from_node_id,
+                 email.subject, email.body, _to_us(email.timestamp), email.hops,
+                 STATUS_PENDING, _to_us(email.created_time)) # Start as pending
+            )
+        except sqlite3.Error as e:
+            logger.error("Failed to queue outgoing email %s: %s", email.message_id, e, exc_info=True)
+            raise DatabaseError(f"Failed to queue outgoing email: {e}") from e
+        if rowcount > 0:
+            with self._status_lock:
+                self._cache_status_row((email.message_id, email.to_node_id, email.from_node_id, email.subject,
+                                        email.timestamp, email.hops, STATUS_PENDING, 0.0, 0,
+                                        email.created_time, None))
+            logger.info("Queued outgoing/forwarding email %s to %#x", email.message_id, email.to_node_id)
+            return True
+        logger.debug("Ignored duplicate outgoing/forwarding email %s", email.message_id)
+        return False
+
+    def add_outgoing_emails(self, emails: List[Email]) -> int:
+        """
+        Adds a batch of emails to the outbox queue within a single transaction.
+        Duplicates (by message_id) are ignored.
+
+        Args:
+            emails: The Email objects to queue.
+
+        Returns:
+            The number of emails actually queued.
+
+        Raises:
+            DatabaseError: If the database operation fails.
+        """
+        if not emails:
+            return 0
+        try:
+            with self._transaction():
+                cursor = self.conn.executemany(
+                    _SQL_ADD_OUTBOX,
+                    [(email.message_id, email.to_node_id, email.from_node_id,
+                      email.subject, email.body, _to_us(email.timestamp), email.hops,
+                      STATUS_PENDING, _to_us(email.created_time)) # Start as pending
+                     for email in emails]
                 )
-            if cursor.rowcount > 0:
-                logger.info(f"Queued outgoing/forwarding email {email.message_id} to {email.to_node_id:#0x}")
-                return True
-            else:
-                logger.debug(f"Ignored duplicate outgoing/forwarding email {email.message_id}")
-                return False
+            return max(cursor.rowcount, 0)
         except sqlite3.Error as e:
-            logger.error(f"Failed to queue outgoing email {email.message_id}: {e}", exc_info=True)
-            raise DatabaseError(f"Failed to queue outgoing email {email.message_id}: {e}") from e
+            logger.error("Failed to queue %s outgoing email(s): %s", len(emails), e, exc_info=True)
+            raise DatabaseError(f"Failed to queue outgoing emails: {e}") from e
 
-    def get_emails_to_send(self) -> List[Email]:
+    def get_emails_to_send(self, limit: Optional[int] = None) -> List[Email]:
         """
         Retrieves emails from the outbox that need sending or retrying.
         Checks retry intervals and expiry times. Marks expired messages as failed.
 
+        Args:
+            limit: Maximum number of emails to return (oldest first), or None for all.
+
         Returns:
             A list of Email objects ready to be sent/retried.
         """
-        if not self.conn: raise DatabaseError("Database not connected")
         emails_to_send = []
+        self.flush_writes() # Don't pick up messages whose send attempt is still queued
         now = time.time()
-        retry_cutoff = now - config.MESSAGE_RETRY_INTERVAL
-        expiry_cutoff = now - config.MESSAGE_EXPIRY_TIME
+        retry_cutoff = now - _RETRY_INTERVAL
+        expiry_cutoff = now - _EXPIRY_TIME
 
         try:
-            with self.conn: # Transaction for reading and potentially updating expired
+            with self._transaction(): # Transaction for expiring old messages and reading the rest
+                # Fail every unfinished message past its lifetime or at the hop limit in one statement
+                expire_cursor = self.conn.execute(
+                    _SQL_EXPIRE_OUTBOX,
+                    (STATUS_FAILED, _to_us(now), STATUS_PENDING, STATUS_SENT, _to_us(expiry_cutoff), _HOP_LIMIT)
+                )
+                if expire_cursor.rowcount > 0:
+                    logger.warning("%s outbox email(s) expired after %ss or reached the hop limit (%s). Marked as failed.",
+                                   expire_cursor.rowcount, _EXPIRY_TIME, _HOP_LIMIT)
+                    with self._status_lock:
+                        self._status_generation += 1
+                        for mid, row in self._status_cache.items():
+                            if row[6] in (STATUS_PENDING, STATUS_SENT) and (row[9] < expiry_cutoff or row[5] >= _HOP_LIMIT):
+                                self._status_cache[mid] = row[:6] + (STATUS_FAILED, now) + row[8:]
+
                 # Select messages that are pending or sent but past the retry interval
+                # (expired and hop-limited messages were already marked failed above, so they never match)
                 read_cursor = self.conn.execute(
-                    f'''SELECT * FROM outbox
-                       WHERE status = ? OR (status = ? AND last_attempt_time < ?)
-                       ORDER BY created_time ASC''', # Process oldest first
-                    (STATUS_PENDING, STATUS_SENT, retry_cutoff)
+                    _SQL_OUTBOX_QUEUE,
+                    (STATUS_PENDING, STATUS_SENT, _to_us(retry_cutoff), -1 if limit is None else limit)
                 )
 
-                for row in read_cursor.fetchall():
-                    # Check for expiry first
-                    if row['created_time'] < expiry_cutoff:
-                        if row['status'] != STATUS_FAILED: # Avoid redundant updates
-                            logger.warning(f"Email {row['message_id']} to {row['to_node_id']:#0x} expired after {config.MESSAGE_EXPIRY_TIME}s. Marking as failed.")
-                            self.conn.execute(
-                                "UPDATE outbox SET status = ?, last_attempt_time = ? WHERE message_id = ?",
-                                (STATUS_FAILED, now, row['message_id'])
-                            )
-                        continue # Skip this expired message
-
-                    # If not expired, create Email object and add to list
-                    email = Email(
-                        message_id=row['message_id'],
-                        to_node_id=row['to_node_id'],
-                        from_node_id=row['from_node_id'],
-                        subject=row['subject'],
-                        body=row['body'],
-                        timestamp=row['timestamp'],
-                        hops=row['hops'],
-                        status=row['status'],
-                        last_attempt_time=row['last_attempt_time'],
-                        retry_count=row['retry_count'],
-                        created_time=row['created_time'],
-                        acked_by_node_id=row['acked_by_node_id']
-                    )
-                    emails_to_send.append(email)
+                # Columns are selected in Email.from_row parameter order; times come back in microseconds
+                us = _US_PER_SECOND
+                emails_to_send = [
+                    Email.from_row(mid, to_id, from_id, subj, body, ts / us, hops, status, lat / us, rc, ct / us, acked)
+                    for (mid, to_id, from_id, subj, body, ts, hops, status, lat, rc, ct, acked) in read_cursor
+                ]
 
             return emails_to_send
         except sqlite3.Error as e:
-            logger.error(f"Failed to retrieve pending emails: {e}", exc_info=True)
+            logger.error("Failed to retrieve pending emails: %s", e, exc_info=True)
             # Don't raise here to avoid crashing the queue processor, return empty list
             return []
 
     def update_outbox_after_send_attempt(self, message_id: str):
-        """Updates the outbox after a send attempt: increments retry, sets status to 'sent', updates time."""
-        if not self.conn: raise DatabaseError("Database not connected")
+        """Queues the outbox update after a send attempt: increments retry, sets status to 'sent', updates time."""
         now = time.time()
-        try:
-            with self.conn:
-                self.conn.execute(
-                    '''UPDATE outbox
-                       SET status = ?, last_attempt_time = ?, retry_count = retry_count + 1
-                       WHERE message_id = ?''',
-                    (STATUS_SENT, now, message_id)
-                )
-            logger.debug(f"Updated outbox status to '{STATUS_SENT}' for {message_id} after send attempt.")
-        except sqlite3.Error as e:
-            logger.error(f"Failed to update outbox status after send attempt for {message_id}: {e}", exc_info=True)
-            # Log error but don't raise to keep queue processor running
+        self._queue_status_change(_SQL_MARK_SENT, (STATUS_SENT, _to_us(now), message_id),
+                                  message_id, STATUS_SENT, now, attempted=True)
+        logger.debug("Queued outbox status '%s' for %s after send attempt.", STATUS_SENT, message_id)
+
+    def update_outbox_after_send_attempts(self, message_ids: List[str]):
+        """Queues the outbox update after send attempts for several messages."""
+        now = time.time()
+        now_us = _to_us(now)
+        for message_id in message_ids:
+            self._queue_status_change(_SQL_MARK_SENT, (STATUS_SENT, now_us, message_id),
+                                      message_id, STATUS_SENT, now, attempted=True)
+
+    def apply_outbox_results(self, results: List[Tuple[str, OutboxStatus]]):
+        """
+        Records the outcomes of a batch of send attempts. Each result is a
+        (message_id, outcome) pair, where outcome is STATUS_SENT (an attempt was
+        made) or STATUS_FAILED (the message was given up on). The updates are
+        queued together, so the writer thread commits them in one transaction.
+        """
+        now = time.time()
+        now_us = _to_us(now)
+        for message_id, outcome in results:
+            if outcome == STATUS_SENT:
+                self._queue_status_change(_SQL_MARK_SENT, (STATUS_SENT, now_us, message_id),
+                                          message_id, STATUS_SENT, now, attempted=True)
+            elif outcome == STATUS_FAILED:
+                self._queue_status_change(_SQL_MARK_FAILED, (STATUS_FAILED, now_us, message_id),
+                                          message_id, STATUS_FAILED, now)
+            else:
+                raise ValueError(f"Unsupported outbox result '{outcome}' for {message_id}")
+        logger.debug("Queued %s outbox send result(s).", len(results))
 
     def mark_outbox_acked(self, message_id: str, acked_by: NodeId):
-        """Marks an outbox message as acknowledged."""
-        if not self.conn: raise DatabaseError("Database not connected")
+        """Queues marking an outbox message as acknowledged."""
         now = time.time()
+        self._queue_status_change(_SQL_MARK_ACKED, (STATUS_ACKED, _to_us(now), acked_by, message_id),
+                                  message_id, STATUS_ACKED, now, acked_by=acked_by)
+        logger.info("Marked outbox email %s as '%s' by %#x.", message_id, STATUS_ACKED, acked_by)
+
+    def mark_outbox_failed(self, message_id: str):
+        """Queues explicitly marking an outbox message as failed (e.g., due to encoding error)."""
+        now = time.time()
+        self._queue_status_change(_SQL_MARK_FAILED, (STATUS_FAILED, _to_us(now), message_id),
+                                  message_id, STATUS_FAILED, now)
+        logger.warning("Marked outbox email %s as '%s'.", message_id, STATUS_FAILED)
+
+    def outbox_pending_count(self) -> int:
+        """
+        Returns the number of outbox messages waiting for their first send attempt.
+        Send attempts still queued for the writer thread are not counted yet.
+        """
         try:
-            with self.conn:
-                self.conn.execute(
-                    '''UPDATE outbox
-                       SET status = ?, last_attempt_time = ?, acked_by_node_id = ?
-                       WHERE message_id = ?''',
-                    (STATUS_ACKED, now, acked_by, message_id)
-                )
-            logger.info(f"Marked outbox email {message_id} as '{STATUS_ACKED}' by {acked_by:#0x}.")
+            with self._reader() as conn:
+                return conn.execute(_SQL_OUTBOX_PENDING_COUNT, (STATUS_PENDING,)).fetchone()[0]
         except sqlite3.Error as e:
-            logger.error(f"Failed to mark outbox email {message_id} as '{STATUS_ACKED}': {e}", exc_info=True)
-            # Log error but don't raise
+            logger.error("Failed to count pending outbox emails: %s", e, exc_info=True)
+            return 0
 
-    def mark_outbox_failed(self, message_id: str):
-        """Explicitly marks an outbox message as failed (e.g., due to encoding error)."""
-        if not self.conn: raise DatabaseError("Database not connected")
+    def next_outbox_due_time(self) -> Optional[float]:
+        """
+        Returns the epoch time at which get_emails_to_send next has work without new mail
+        being queued: the earliest retry of a sent-but-unACKed message or the earliest
+        expiry of an unfinished one. None if nothing is outstanding.
+
+        Raises:
+            DatabaseError: If the outbox cannot be read, so the caller backs off rather than rechecking at once.
+        """
+        self.flush_writes() # Queued send attempts move retry times forward
+        try:
+            with self._reader() as conn:
+                next_retry, oldest_pending, oldest_sent = conn.execute(
+                    _SQL_OUTBOX_NEXT_DUE, (STATUS_SENT, STATUS_PENDING, STATUS_SENT)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error("Failed to read the next outbox due time: %s", e, exc_info=True)
+            raise DatabaseError(f"Failed to read the next outbox due time: {e}") from e
+        due = [t / _US_PER_SECOND + _RETRY_INTERVAL for t in (next_retry,) if t is not None]
+        due += [t / _US_PER_SECOND + _EXPIRY_TIME for t in (oldest_pending, oldest_sent) if t is not None]
+        return min(due) if due else None
+
+    def evict_oldest_pending(self, n: int = 1, for_message_id: Optional[str] = None) -> List[str]:
+        """
+        Marks the n oldest pending outbox messages as failed, to make room when the outbox is full.
+
+        Args:
+            n: How many pending messages to drop.
+            for_message_id: The message the room is being made for. If it is already in the
+                outbox, queuing it again is a duplicate, so nothing is dropped.
+
+        Returns:
+            The message IDs that were dropped.
+        """
+        self.flush_writes() # Let queued send attempts land so they aren't counted as pending
         now = time.time()
         try:
-            with self.conn:
-                self.conn.execute(
-                    '''UPDATE outbox SET status = ?, last_attempt_time = ?
-                       WHERE message_id = ?''',
-                    (STATUS_FAILED, now, message_id)
-                )
-            logger.warning(f"Marked outbox email {message_id} as '{STATUS_FAILED}'.")
+            with self._transaction() as conn:
+                if for_message_id is not None and conn.execute(_SQL_OUTBOX_EXISTS, (for_message_id,)).fetchone():
+                    return []
+                evicted = [mid for (mid,) in conn.execute(_SQL_OLDEST_PENDING, (STATUS_PENDING, n))]
+                conn.executemany(_SQL_MARK_FAILED, [(STATUS_FAILED, _to_us(now), mid) for mid in evicted])
         except sqlite3.Error as e:
-            logger.error(f"Failed to mark outbox email {message_id} as '{STATUS_FAILED}': {e}", exc_info=True)
-            # Log error but don't raise
+            logger.error("Failed to evict pending outbox emails: %s", e, exc_info=True)
+            return []
+        if evicted:
+            with self._status_lock:
+                self._status_generation += 1
+                for mid in evicted:
+                    row = self._status_cache.get(mid)
+                    if row is not None:
+                        self._status_cache[mid] = row[:6] + (STATUS_FAILED, now) + row[8:]
+        return evicted
 
 
     def get_inbox_emails(self, limit: int = 50) -> List[Email]:
         """Retrieves emails from the inbox, newest received first."""
-        if not self.conn: raise DatabaseError("Database not connected")
         emails = []
         try:
-            with self.conn: # Read operation, transaction not strictly needed but good practice
-                cursor = self.conn.execute(
-                    '''SELECT * FROM inbox
-                       ORDER BY received_time DESC LIMIT ?''', (limit,)
-                )
-                for row in cursor.fetchall():
-                    email = Email(
-                        message_id=row['message_id'],
-                        to_node_id=row['to_node_id'],
-                        from_node_id=row['from_node_id'],
-                        subject=row['subject'],
-                        body=row['body'],
-                        timestamp=row['timestamp'],
-                        hops=row['hops'],
-                        status=STATUS_RECEIVED, # Mark as received for consistency
-                        created_time=row['received_time'] # Use received time here
+            with self._reader() as conn:
+                cursor = conn.execute(_SQL_INBOX_PAGE, (limit,))
+                # Step through the cursor rather than materializing it with fetchall()
+                us = _US_PER_SECOND
+                emails = [
+                    Email.from_row(
+                        mid, to_id, from_id, subj, body, ts / us, hops,
+                        STATUS_RECEIVED, # Mark as received for consistency
+                        created_time=received / us # Use received time here
                     )
-                    emails.append(email)
+                    for (mid, to_id, from_id, subj, body, ts, hops, received) in cursor
+                ]
             return emails
         except sqlite3.Error as e:
-            logger.error(f"Failed to retrieve inbox emails: {e}", exc_info=True)
+            logger.error("Failed to retrieve inbox emails: %s", e, exc_info=True)
             return [] # Return empty list on error
 
+    def get_inbox_email_dicts(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Like get_inbox_emails, but returns the rows already shaped like
+        protocol.email_to_dict() output, skipping the Email objects entirely.
+        Used for RESP_INBOX_LIST responses.
+        """
+        try:
+            with self._reader() as conn:
+                cursor = conn.execute(_SQL_INBOX_PAGE, (limit,))
+                us = _US_PER_SECOND
+                return [
+                    {
+                        'message_id': mid,
+                        'to_node_id': to_id,
+                        'from_node_id': from_id,
+                        'subject': subj if subj is not None else "",
+                        'body': body if body is not None else "",
+                        'timestamp': ts / us,
+                        'hops': hops,
+                        'status': STATUS_RECEIVED,
+                        'last_attempt_time': 0.0,
+                        'retry_count': 0,
+                        'created_time': received / us,
+                        'acked_by_node_id': None,
+                    }
+                    for (mid, to_id, from_id, subj, body, ts, hops, received) in cursor
+                ]
+        except sqlite3.Error as e:
+            logger.error("Failed to retrieve inbox emails: %s", e, exc_info=True)
+            return []
+
     def get_outbox_status(self, message_id: str) -> Optional[Email]:
-        """Retrieves the current status and details of a specific outbox message."""
-        if not self.conn: raise DatabaseError("Database not connected")
+        """
+        Retrieves the current status and details of a specific outbox message.
+        The returned Email's body is left empty; only status and routing fields are loaded.
+        Served from the status cache when possible.
+        """
+        with self._status_lock:
+            row = self._status_cache.get(message_id)
+            if row is not None:
+                self._status_cache.move_to_end(message_id)
+            generation = self._status_generation
         try:
-            with self.conn:
-                cursor = self.conn.execute(
-                    "SELECT * FROM outbox WHERE message_id = ?", (message_id,)
-                )
-                row = cursor.fetchone()
-                if row:
-                    return Email(
-                        message_id=row['message_id'],
-                        to_node_id=row['to_node_id'],
-                        from_node_id=row['from_node_id'],
-                        subject=row['subject'],
-                        body=row['body'], # Might not need body for status check?
-                        timestamp=row['timestamp'],
-                        hops=row['hops'],
-                        status=row['status'],
-                        last_attempt_time=row['last_attempt_time'],
-                        retry_count=row['retry_count'],
-                        created_time=row['created_time'],
-                        acked_by_node_id=row['acked_by_node_id']
-                    )
-                else:
+            if row is None:
+                self.flush_writes()
+                with self._reader() as conn:
+                    # The body is not needed for a status check, so it is not read
+                    cursor = conn.execute(_SQL_OUTBOX_STATUS, (message_id,))
+                    row = cursor.fetchone()
+                if row is None:
                     return None # Message not found
+                # Cache (and return) times in seconds, like the rest of the Python side
+                us = _US_PER_SECOND
+                row = row[:4] + (row[4] / us, row[5], row[6], row[7] / us, row[8], row[9] / us, row[10])
+                with self._status_lock:
+                    # Skip the fill if a status change was queued while the row was being read
+                    if generation == self._status_generation:
+                        self._cache_status_row(row)
+            (mid, to_id, from_id, subj, ts, hops, status, lat, rc, ct, acked) = row
+            return Email.from_row(
+                mid, to_id, from_id, subj, "", ts, hops, status, lat, rc, ct, acked
+            )
         except sqlite3.Error as e:
-            logger.error(f"Failed to retrieve outbox status for {message_id}: {e}", exc_info=True)
+            logger.error("Failed to retrieve outbox status for %s: %s", message_id, e, exc_info=True)
             return None # Return None on error
 
+    def optimize(self):
+        """Runs PRAGMA optimize so the query planner's statistics track the current data."""
+        try:
+            with self._write_lock: # May run ANALYZE, which writes
+                self.conn.execute("PRAGMA optimize")
+            logger.debug("Ran PRAGMA optimize.")
+        except sqlite3.Error as e:
+            logger.warning("PRAGMA optimize failed: %s", e)
+
     def close(self):
-        """Closes the database connection."""
-        if self.conn:
+        """
+        Commits any queued outbox updates, stops the writer thread and closes
+        the database connection and any pooled reader connections.
+        """
+        writer, self._writer_thread = self._writer_thread, None
+        if writer is not None and writer.is_alive():
+            self._write_q.put(_WRITER_STOP)
+            writer.join()
+        # Commit anything queued after the stop marker (raced with close()) on this thread
+        stranded: List[Tuple[str, tuple, Optional[Future]]] = []
+        while True:
+            try:
+                item = self._write_q.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is not _WRITER_STOP:
+                stranded.append(item)
+        if stranded and self.conn is not _CLOSED:
+            self._commit_batch(stranded)
+        with self._readers_lock:
+            readers = list(self._readers)
+            self._readers.clear()
+        for reader in readers:
+            try:
+                reader.close()
+            except sqlite3.Error as e:
+                logger.error("Error closing reader connection: %s", e, exc_info=True)
+        # Reads after close() fall through to the closed writer and raise DatabaseError
+        self._reader_pool = None
+        with self._status_lock:
+            self._status_cache.clear()
+        if self.conn is not _CLOSED:
+            self.optimize()
             try:
                 self.conn.close()
-                self.conn = None
+                self.conn = _CLOSED
                 logger.info("Database connection closed.")
             except sqlite3.Error as e:
-                logger.error(f"Error closing database connection: {e}", exc_info=True)
+                logger.error("Error closing database connection: %s", e, exc_info=True)
+        if self._finalizer is not None:
+            self._finalizer.detach()
+
+    def __enter__(self) -> "AkitaDatabase":
+        return self
 
-    def __del__(self):
-        """Ensure connection is closed when the object is garbage collected."""
+    def __exit__(self, exc_type, exc_value, traceback):
         self.close()
 
@@ -2,7 +2,7 @@
 import time
 import uuid
 from dataclasses import dataclass, field
-from typing import NewType
+from typing import NewType, Optional
 
 # Define a specific type for Meshtastic Node IDs for clarity
 # Node IDs are unsigned 32-bit integers in Meshtastic
@@ -16,18 +16,20 @@ STATUS_ACKED = OutboxStatus('acked')     # ACK received, delivery confirmed
 STATUS_FAILED = OutboxStatus('failed')   # Max retries or expiry reached
 STATUS_RECEIVED = OutboxStatus('received') # Used for inbox emails for consistency
 
-@dataclass
+@dataclass(slots=True)
 class Email:
     """
     Represents an email message within the Akita system.
     Used for both incoming (Inbox) and outgoing (Outbox) messages.
+    Constructing an Email validates its fields; rows read back from the
+    database go through Email.from_row, which skips that validation.
     """
     # Core Email Fields (transmitted over LoRa)
     to_node_id: NodeId          # Destination Meshtastic Node ID
     from_node_id: NodeId        # Source Meshtastic Node ID
     subject: str                # Email subject line
     body: str                   # Email content/body
-    message_id: str = field(default_factory=lambda: str(uuid.uuid4())) # Unique ID
+    message_id: str = field(default_factory=lambda: uuid.uuid4().hex) # Unique ID (32 hex chars, no dashes)
     timestamp: float = field(default_factory=time.time) # Original creation time (epoch float)
     hops: int = 0               # Hop count (incremented on forward)
 
@@ -39,15 +41,42 @@ class Email:
     # Optional: Store the Node ID of the node that sent the ACK for this message
     acked_by_node_id: NodeId | None = None
 
+    @classmethod
+    def from_row(cls, message_id: str, to_node_id: NodeId, from_node_id: NodeId,
+                 subject: str, body: str, timestamp: float, hops: int,
+                 status: OutboxStatus = STATUS_PENDING, last_attempt_time: float = 0.0,
+                 retry_count: int = 0, created_time: float = 0.0,
+                 acked_by_node_id: Optional[NodeId] = None) -> "Email":
+        """
+        Builds an Email from a trusted database row, skipping __post_init__ validation.
+        Parameters follow the outbox table's column order.
+        """
+        email = object.__new__(cls)
+        email.to_node_id = to_node_id
+        email.from_node_id = from_node_id
+        email.subject = subject if subject is not None else ""
+        email.body = body if body is not None else ""
+        email.message_id = message_id
+        email.timestamp = timestamp
+        email.hops = hops
+        email.status = status
+        email.last_attempt_time = last_attempt_time
+        email.retry_count = retry_count
+        email.created_time = created_time
+        email.acked_by_node_id = acked_by_node_id
+        return email
+
     def __post_init__(self):
         """Basic validation after initialization."""
         if not isinstance(self.to_node_id, int):
              raise ValueError("to_node_id must be an integer")
         if not isinstance(self.from_node_id, int):
              raise ValueError("from_node_id must be an integer")
-        # Ensure subject and body are strings, even if empty
-        self.subject = str(self.subject) if self.subject is not None else ""
-        self.body = str(self.body) if self.body is not None else ""
+        # Ensure subject and body are strings, even if empty (already-str values are left as is)
+        if type(self.subject) is not str:
+            self.subject = str(self.subject) if self.subject is not None else ""
+        if type(self.body) is not str:
+            self.body = str(self.body) if self.body is not None else ""
 
 
 # You could potentially add other models here later, e.g., for Aliases if
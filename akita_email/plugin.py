@@ -1,15 +1,25 @@
 # akita_email/plugin.py
+import collections
+import functools
 import meshtastic
 import meshtastic.serial_interface
 import meshtastic.tcp_interface
 import meshtastic.util
 import meshtastic.mesh_interface
+import os
+import re
 import serial
+import selectors
+import sys
 import threading
 import time
 import logging
-from typing import Optional, Any, Dict, List, cast
-from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from pubsub import pub # pypubsub, installed with meshtastic; used to wait for the connection
+except ImportError:
+    pub = None
+from typing import Optional, Any, Dict, List, Tuple, cast
 
 from . import config, protocol, database, models
 from .exceptions import AkitaEmailError, CommunicationError, ProtocolError, RoutingError, DatabaseError, ConfigurationError
@@ -18,6 +28,58 @@ from .models import NodeId # Explicitly import NodeId
 # Get a logger specific to this module
 logger = config.setup_logger(__name__, config.PLUGIN_LOG_LEVEL, config.PLUGIN_LOG_FILE)
 
+# Bound once at import so the per-packet path skips the module attribute lookups
+_decode_lora_packet = protocol.decode_lora_packet
+_encode_companion_response = protocol.encode_companion_response
+_MSG_KEY_TYPE = config.MSG_KEY_TYPE
+_MSG_KEY_ID = config.MSG_KEY_ID
+_MSG_KEY_TO = config.MSG_KEY_TO
+_MSG_KEY_FROM = config.MSG_KEY_FROM
+_MSG_KEY_HOPS = config.MSG_KEY_HOPS
+_MSG_KEY_SUBJECT = config.MSG_KEY_SUBJECT
+_MSG_KEY_BODY = config.MSG_KEY_BODY
+_MSG_KEY_TIMESTAMP = config.MSG_KEY_TIMESTAMP
+_MSG_TYPE_EMAIL = config.MSG_TYPE_EMAIL
+_MSG_TYPE_ACK = config.MSG_TYPE_ACK
+
+# Node short names: up to 12 printable ASCII characters (empty clears the alias), checked in one regex pass
+_MAX_ALIAS_LEN = 12
+
+# Parameters send_email cannot do without; the remaining checks also coerce values, so they stay inline
+_SEND_EMAIL_REQUIRED = frozenset(('to_node_id', 'body'))
+_ALIAS_RE = re.compile(r'[\x20-\x7E]{0,%d}' % _MAX_ALIAS_LEN)
+
+@functools.lru_cache(maxsize=512)
+def _fmt_node(node_id: int) -> str:
+    """Formats a Node ID as hex for log messages; the handful of nodes on a mesh repeat constantly."""
+    return f"{node_id:#0x}"
+
+def _set_low_latency(ser: serial.Serial):
+    """
+    Puts a USB serial adapter into low-latency mode on Linux, so short command
+    lines are delivered right away instead of waiting out the adapter's latency
+    timer (16 ms by default on FTDI chips). Sets ASYNC_LOW_LATENCY through
+    pyserial; if the driver refuses, tries the usb-serial sysfs latency_timer.
+    Does nothing on other platforms.
+    """
+    if not sys.platform.startswith('linux'):
+        return
+    try:
+        ser.set_low_latency_mode(True) # TIOCGSERIAL/TIOCSSERIAL with ASYNC_LOW_LATENCY
+        logger.debug(f"Enabled low-latency mode on {ser.port}")
+        return
+    except (AttributeError, ValueError, OSError) as e:
+        logger.debug(f"ASYNC_LOW_LATENCY not available on {ser.port}: {e}")
+
+    tty = os.path.basename(os.path.realpath(ser.port))
+    latency_timer = f"/sys/bus/usb-serial/devices/{tty}/latency_timer"
+    try:
+        with open(latency_timer, 'w') as f:
+            f.write("1")
+        logger.debug(f"Set {latency_timer} to 1 ms")
+    except OSError as e:
+        logger.debug(f"Could not set USB latency timer for {ser.port}: {e}")
+
 class AkitaEmailPlugin:
     """
     The core Akita eMail plugin logic that interacts with Meshtastic,
@@ -41,6 +103,42 @@ class AkitaEmailPlugin:
         self.running = False
         self._lock = threading.Lock() # General purpose lock if needed for shared state
         self._threads: List[threading.Thread] = []
+        self._pool: Optional[ThreadPoolExecutor] = None # Processes received packets off the Meshtastic callback thread
+        self._inflight = threading.BoundedSemaphore(config.PLUGIN_MAX_INFLIGHT) # Caps packets queued in the pool
+        self._outbox_event = threading.Event() # Set when mail is queued (or on stop) to wake the queue processor
+        self._stop_event = threading.Event() # Set by stop(); background threads wait on it instead of sleeping
+        self._companion_wake_pipe: Optional[Tuple[int, int]] = None # (read_fd, write_fd) waking the companion listener's select()
+        self._companion_wake_lock = threading.Lock() # Keeps a wake write from racing the pipe being closed
+        # Lines waiting for the companion writer thread; when full, the oldest line is dropped
+        self._companion_tx: "collections.deque[bytes]" = collections.deque(maxlen=config.COMPANION_TX_QUEUE_SIZE)
+        self._companion_tx_cond = threading.Condition()
+        self._companion_tx_overflowed = False # Overflow is logged once per episode
+        # (ack_for_id, ack_to_node_id, payload) waiting for the ACK sender thread, so packet
+        # workers never block on the radio; when full, the oldest ACK is dropped
+        self._ack_tx: "collections.deque[Tuple[str, NodeId, bytes]]" = collections.deque(maxlen=config.ACK_TX_QUEUE_SIZE)
+        self._ack_tx_cond = threading.Condition()
+        self._ack_sender: Optional[threading.Thread] = None
+        self._outbox_throttled = False # Last backpressure state sent to the companion
+        # Recently received email IDs -> time.monotonic() of our last ACK for them (LRU order)
+        self._recent_received: "collections.OrderedDict[str, float]" = collections.OrderedDict()
+        self._recent_received_lock = threading.Lock()
+        self._duplicates_suppressed = 0 # Duplicate emails dropped without a DB lookup or ACK
+        # message_id -> encoded LoRa payload, so retries skip re-encoding (queue processor thread only)
+        self._payload_cache: "collections.OrderedDict[str, bytes]" = collections.OrderedDict()
+        self._last_evict_log = float('-inf') # time.monotonic() of the last eviction warning (at most one a minute)
+        # Received Akita message type -> handler; add new message types here
+        self._packet_handlers = {
+            _MSG_TYPE_EMAIL: self._handle_received_email_packet,
+            _MSG_TYPE_ACK: self._handle_received_ack_packet,
+        }
+        # Companion command -> handler returning the response line; add new commands here
+        self._command_handlers = {
+            config.CMD_SEND_EMAIL: self._handle_send_email_command,
+            config.CMD_READ_EMAILS: self._handle_read_emails_command,
+            config.CMD_GET_STATUS: self._handle_get_status_command,
+            config.CMD_SET_ALIAS: self._handle_set_alias_command,
+            config.CMD_PING_PLUGIN: self._handle_ping_command,
+        }
         self._local_node_id: Optional[NodeId] = None
         self._local_node_info: Optional[Dict[str, Any]] = None # Store more info if needed
 
@@ -59,14 +157,44 @@ class AkitaEmailPlugin:
 
         logger.info(f"AkitaEmailPlugin initialized for Node ID: {self._local_node_id:#0x}")
 
+    def _has_node_info(self) -> bool:
+        my_info = self.interface.myInfo
+        return bool(my_info) and my_info.my_node_num is not None
+
+    def _wait_for_node_info(self, timeout: float = 5.0):
+        """
+        Waits up to `timeout` seconds for the interface to report the local node.
+        Wakes on meshtastic's "connection established" message when pypubsub is
+        available, otherwise polls once a second.
+        """
+        if pub is None:
+            deadline = time.monotonic() + timeout
+            while not self._has_node_info() and time.monotonic() < deadline:
+                time.sleep(1)
+            return
+
+        connected = threading.Event()
+        def on_connected(interface=None, topic=pub.AUTO_TOPIC):
+            if interface is None or interface is self.interface:
+                connected.set()
+        pub.subscribe(on_connected, "meshtastic.connection.established")
+        try:
+            # Re-check after subscribing, in case the connection came up in between
+            if not self._has_node_info():
+                connected.wait(timeout)
+        finally:
+            pub.unsubscribe(on_connected, "meshtastic.connection.established")
+
     def _get_local_node_info(self):
         """Fetches and stores the local node's information from the interface."""
         try:
+            my_info = self.interface.myInfo
+            if self._local_node_id is not None and my_info and my_info.my_node_num == self._local_node_id:
+                return # Already known and unchanged (e.g. start() after __init__)
+
             # Wait briefly for interface to potentially connect and get info
-            for _ in range(5): # Try for ~5 seconds
-                if self.interface.myInfo and self.interface.myInfo.my_node_num is not None:
-                    break
-                time.sleep(1)
+            if not self._has_node_info():
+                self._wait_for_node_info(timeout=5)
 
             if not self.interface.myInfo or self.interface.myInfo.my_node_num is None:
                 raise AkitaEmailError("Meshtastic interface did not provide local node info.")
@@ -93,8 +221,10 @@ class AkitaEmailPlugin:
                 timeout=1 # Read timeout
             )
             logger.info(f"Successfully connected to companion interface on {config.COMPANION_SERIAL_PORT}")
+            if config.COMPANION_LOW_LATENCY:
+                _set_low_latency(self.companion_serial)
 
-            # Start the listener thread only if connection is successful
+            # Start the listener and writer threads only if connection is successful
             companion_thread = threading.Thread(
                 target=self._companion_listener_thread,
                 name="CompanionListener",
@@ -102,6 +232,13 @@ class AkitaEmailPlugin:
             )
             self._threads.append(companion_thread)
             companion_thread.start()
+            writer_thread = threading.Thread(
+                target=self._companion_writer_thread,
+                name="CompanionWriter",
+                daemon=True
+            )
+            self._threads.append(writer_thread)
+            writer_thread.start()
 
         except serial.SerialException as e:
             logger.warning(f"Companion interface connection failed on {config.COMPANION_SERIAL_PORT}: {e}. Plugin will run without companion features.")
@@ -118,6 +255,7 @@ class AkitaEmailPlugin:
 
         logger.info(f"Starting Akita eMail Plugin v{config.VERSION}...")
         self.running = True
+        self._stop_event.clear()
 
         # Re-confirm local node ID on start, just in case
         self._get_local_node_info()
@@ -125,10 +263,24 @@ class AkitaEmailPlugin:
         # Attempt companion connection
         self._init_companion_connection()
 
+        # Worker pool for received packets (created before the handler is registered)
+        self._pool = ThreadPoolExecutor(
+            max_workers=config.PLUGIN_WORKER_THREADS,
+            thread_name_prefix="AkitaWorker"
+        )
+
+        # ACK sender, started before packets (and so ACKs) can arrive
+        self._ack_sender = threading.Thread(
+            target=self._ack_sender_thread,
+            name="AckSender",
+            daemon=True
+        )
+        self._threads.append(self._ack_sender)
+        self._ack_sender.start()
+
         # Register Meshtastic receive handler
-        # Use functools.partial to pass 'self' instance to the handler method
-        receive_handler_partial = partial(AkitaEmailPlugin._meshtastic_receive_handler, self)
-        self.interface.addReceiveHandler(receive_handler_partial)
+        # The bound method already carries 'self'
+        self.interface.addReceiveHandler(self._meshtastic_receive_handler)
         logger.debug("Registered Meshtastic receive handler.")
 
         # Start outgoing message processing thread
@@ -150,6 +302,13 @@ class AkitaEmailPlugin:
 
         logger.info("Stopping Akita eMail Plugin...")
         self.running = False # Signal threads to stop
+        self._stop_event.set() # Cut short any pacing or back-off wait
+        self._wake_companion_listener()
+        self._outbox_event.set() # Wake the queue processor so it sees running is False
+        with self._companion_tx_cond:
+            self._companion_tx_cond.notify_all() # Wake the companion writer so it can drain and exit
+        with self._ack_tx_cond:
+            self._ack_tx_cond.notify_all() # Wake the ACK sender so it can drain and exit
 
         # Note: meshtastic-python doesn't have a removeReceiveHandler method.
         # The handler check self.running internally.
@@ -157,10 +316,10 @@ class AkitaEmailPlugin:
         # Wait for threads to finish (with a timeout)
         shutdown_timeout = 5.0 # seconds
         logger.debug(f"Waiting up to {shutdown_timeout}s for threads to complete...")
-        start_time = time.time()
+        deadline = time.monotonic() + shutdown_timeout
         for thread in self._threads:
             if thread.is_alive():
-                 join_timeout = max(0.1, shutdown_timeout - (time.time() - start_time))
+                 join_timeout = max(0.1, deadline - time.monotonic())
                  try:
                      thread.join(timeout=join_timeout)
                      if thread.is_alive():
@@ -168,6 +327,12 @@ class AkitaEmailPlugin:
                  except Exception as e:
                       logger.error(f"Error joining thread {thread.name}: {e}", exc_info=True)
         self._threads.clear() # Clear the list after attempting to join
+        self._ack_sender = None
+
+        # Finish packets already being processed; drop the ones still queued
+        if self._pool:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
 
         # Close companion serial connection
         if self.companion_serial and self.companion_serial.is_open:
@@ -192,117 +357,215 @@ class AkitaEmailPlugin:
 
         logger.info("Akita eMail Plugin stopped.")
 
-    def _send_to_companion(self, message_payload: str):
+    def _send_to_companion(self, message_payload: bytes, wait: bool = False):
         """
-        Sends a pre-encoded JSON string line to the connected companion device.
-        Handles potential serial communication errors.
+        Queues a pre-encoded JSON line (see protocol.encode_companion_response) for the connected companion device.
+        The companion writer thread does the serial write, so packet handling never
+        waits on the USB link. If the queue is full, the oldest line is dropped,
+        unless `wait` is set: then the caller blocks until the writer makes room
+        (used for multi-line responses whose lines must all arrive).
+
+        Returns:
+            True if the line was queued, False if no companion is connected.
         """
-        if self.companion_serial and self.companion_serial.is_open:
+        if not (self.companion_serial and self.companion_serial.is_open):
+            # logger.debug("No companion connected or port closed, message not sent.")
+            return False
+        with self._companion_tx_cond:
+            if wait:
+                while len(self._companion_tx) == self._companion_tx.maxlen and self.running and self.companion_serial:
+                    self._companion_tx_cond.wait(1.0) # Timeout only as a safety net; the writer notifies
+            if len(self._companion_tx) == self._companion_tx.maxlen:
+                if not self._companion_tx_overflowed:
+                    logger.warning(f"Companion output queue full ({self._companion_tx.maxlen} lines); dropping oldest lines.")
+                    self._companion_tx_overflowed = True
+            else:
+                self._companion_tx_overflowed = False
+            self._companion_tx.append(message_payload)
+            self._companion_tx_cond.notify()
+        return True
+
+    def _companion_writer_thread(self):
+        """
+        Background thread that writes queued lines to the companion serial port.
+        Lines queued while a write is in progress are coalesced into the next write,
+        up to COMPANION_WRITE_CHUNK_BYTES per write (a longer line goes out on its own).
+        """
+        logger.info("Companion writer thread started.")
+        chunk_limit = config.COMPANION_WRITE_CHUNK_BYTES
+        tx = self._companion_tx
+        while True:
+            lines: List[bytes] = []
+            with self._companion_tx_cond:
+                while self.running and not tx:
+                    self._companion_tx_cond.wait()
+                size = 0
+                while tx and (not lines or size + len(tx[0]) <= chunk_limit):
+                    line = tx.popleft()
+                    lines.append(line)
+                    size += len(line)
+                if lines:
+                    self._companion_tx_cond.notify_all() # Wake senders waiting for room (see _send_to_companion)
+            if not lines:
+                break # Stopping and nothing left to send
+
+            ser = self.companion_serial
+            if not (ser and ser.is_open):
+                logger.info("Companion serial port closed or unavailable. Writer thread stopping.")
+                break
             try:
-                self.companion_serial.write(message_payload.encode('utf-8'))
-                logger.debug(f"Sent to companion: {message_payload.strip()}")
-                return True
+                ser.write(b"".join(lines))
+                if logger.isEnabledFor(logging.DEBUG):
+                    for line in lines:
+                        logger.debug(f"Sent to companion: {line.strip().decode('utf-8', errors='replace')}")
             except serial.SerialException as e:
                 logger.error(f"Serial error sending to companion: {e}. Closing port.")
                 # Attempt to close the problematic port
                 try:
-                    self.companion_serial.close()
+                    ser.close()
                 except Exception:
                     pass # Ignore errors during close
                 self.companion_serial = None # Mark as disconnected
-                return False
+                self._wake_companion_listener() # Let the listener see the port is gone
+                break
             except Exception as e:
                 logger.error(f"Unexpected error sending to companion: {e}", exc_info=True)
-                return False
-        else:
-            # logger.debug("No companion connected or port closed, message not sent.")
-            return False
+        logger.info("Companion writer thread stopped.")
 
     # --- Meshtastic Packet Handling ---
 
     def _meshtastic_receive_handler(self, packet: Dict[str, Any], interface: meshtastic.mesh_interface.MeshInterface):
         """
         Callback method registered with meshtastic-python to handle incoming packets.
-        Decodes, validates, and processes Akita messages (Email, ACK).
+        Decodes the packet here and hands valid Akita messages to the worker pool,
+        so the Meshtastic callback thread never waits on the database or serial port.
         """
         if not self.running or not self._local_node_id or not self.db:
             # logger.debug("Plugin stopped or not fully initialized, ignoring packet.")
             return # Ignore packets if plugin is stopped or not ready
 
         # Decode the packet using the protocol module
-        decoded_data = protocol.decode_lora_packet(packet)
+        decoded_data = _decode_lora_packet(packet)
         if not decoded_data:
             # Not a valid Akita message or failed decoding (already logged by decode)
             return
 
+        pool = self._pool
+        if pool is None:
+            # Not started (or already stopped): process inline
+            self._process_packet(decoded_data)
+            return
+
+        if not self._inflight.acquire(blocking=False):
+            logger.warning(f"Too many packets in flight ({config.PLUGIN_MAX_INFLIGHT}); dropping message {decoded_data[_MSG_KEY_ID]}.")
+            return
+        try:
+            future = pool.submit(self._process_packet, decoded_data)
+        except RuntimeError:
+            # Pool shut down between the check above and submit()
+            self._inflight.release()
+            return
+        future.add_done_callback(lambda _f: self._inflight.release())
+
+    def _process_packet(self, decoded_data: Dict[str, Any]):
+        """Processes a decoded Akita message (Email, ACK). Runs on a worker thread."""
         # Extract key information
-        msg_type = decoded_data[config.MSG_KEY_TYPE]
-        message_id = decoded_data[config.MSG_KEY_ID]
-        packet_info = decoded_data['_packet_info_']
+        msg_type = decoded_data[_MSG_KEY_TYPE]
+        message_id = decoded_data[_MSG_KEY_ID]
         # Node ID of the node that *directly* sent us this packet
-        immediate_sender_id = cast(NodeId, packet_info['from_node_id'])
+        immediate_sender_id: NodeId = decoded_data['_packet_info_']['from_node_id']
 
-        logger.debug(f"Processing '{msg_type}' message (ID: {message_id}) received from {immediate_sender_id:#0x}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Processing '{msg_type}' message (ID: {message_id}) received from {_fmt_node(immediate_sender_id)}")
 
         try:
-            if msg_type == config.MSG_TYPE_EMAIL:
-                self._handle_received_email_packet(decoded_data)
-            elif msg_type == config.MSG_TYPE_ACK:
-                self._handle_received_ack_packet(decoded_data)
-            # Handle other types like ALIAS if implemented
+            handler = self._packet_handlers.get(msg_type)
+            if handler is not None:
+                handler(decoded_data)
             else:
                 # Should not happen if decode_lora_packet is correct
                 logger.warning(f"Received unhandled but decoded Akita message type '{msg_type}' (ID: {message_id})")
 
         except (DatabaseError, ProtocolError, CommunicationError, AkitaEmailError) as e:
             # Log specific Akita errors
-            logger.error(f"Error processing message {message_id} from {immediate_sender_id:#0x}: {e}", exc_info=True)
+            logger.error(f"Error processing message {message_id} from {_fmt_node(immediate_sender_id)}: {e}", exc_info=True)
         except Exception as e:
             # Log unexpected errors
-            logger.error(f"Unexpected critical error processing message {message_id} from {immediate_sender_id:#0x}: {e}", exc_info=True)
+            logger.error(f"Unexpected critical error processing message {message_id} from {_fmt_node(immediate_sender_id)}: {e}", exc_info=True)
 
 
     def _handle_received_email_packet(self, data: Dict[str, Any]):
         """Processes a decoded EMAIL message packet."""
-        if not self.db or not self._local_node_id: return # Should not happen if called correctly
+        # Local aliases: stop() may clear self.db while a worker is still in here
+        db = self.db
+        local_node_id = self._local_node_id
+        if not db or not local_node_id: return # Should not happen if called correctly
 
-        message_id = data[config.MSG_KEY_ID]
-        to_node_id = cast(NodeId, data[config.MSG_KEY_TO]) # Final destination
-        original_sender_id = cast(NodeId, data[config.MSG_KEY_FROM])
-        hops = data[config.MSG_KEY_HOPS]
-        packet_info = data['_packet_info_']
-        immediate_sender_id = cast(NodeId, packet_info['from_node_id'])
+        message_id = data[_MSG_KEY_ID]
+        to_node_id: NodeId = data[_MSG_KEY_TO] # Final destination
+        original_sender_id: NodeId = data[_MSG_KEY_FROM]
+        hops = data[_MSG_KEY_HOPS]
+        immediate_sender_id: NodeId = data['_packet_info_']['from_node_id']
 
         # --- Check if the message is for this node ---
-        if to_node_id == self._local_node_id:
+        if to_node_id == local_node_id:
             # --- Message is for us ---
-            logger.info(f"Received direct email (ID: {message_id}) from {original_sender_id:#0x} via {immediate_sender_id:#0x}")
+            # Duplicates of a recent email skip the database; they are only re-ACKed every
+            # DUPLICATE_ACK_INTERVAL seconds, so a sender that missed our ACK still stops retrying.
+            now = time.monotonic()
+            with self._recent_received_lock:
+                recent = self._recent_received
+                last_ack = recent.get(message_id)
+                if last_ack is not None and now - last_ack < config.DUPLICATE_ACK_INTERVAL:
+                    self._duplicates_suppressed += 1
+                    recent.move_to_end(message_id)
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"Suppressed duplicate email (ID: {message_id}) from {_fmt_node(original_sender_id)}; ACKed {now - last_ack:.0f}s ago.")
+                    return
+                recent[message_id] = now
+                recent.move_to_end(message_id)
+                if len(recent) > config.RECEIVED_ID_CACHE_SIZE:
+                    recent.popitem(last=False)
+
+            if last_ack is not None:
+                # Already stored; the sender is still retrying, so ACK again
+                logger.info(f"Re-ACKing duplicate email (ID: {message_id}) from {_fmt_node(original_sender_id)} via {_fmt_node(immediate_sender_id)}")
+                self._send_ack(ack_for_id=message_id, ack_to_node_id=original_sender_id, ack_from_node_id=local_node_id)
+                return
+
+            logger.info(f"Received direct email (ID: {message_id}) from {_fmt_node(original_sender_id)} via {_fmt_node(immediate_sender_id)}")
 
             # Create Email object from received data
             email = models.Email(
                 message_id=message_id,
                 to_node_id=to_node_id,
                 from_node_id=original_sender_id,
-                subject=data[config.MSG_KEY_SUBJECT],
-                body=data[config.MSG_KEY_BODY],
-                timestamp=data[config.MSG_KEY_TIMESTAMP],
+                subject=data[_MSG_KEY_SUBJECT],
+                body=data[_MSG_KEY_BODY],
+                timestamp=data[_MSG_KEY_TIMESTAMP],
                 hops=hops,
                 status=models.STATUS_RECEIVED # Mark as received
             )
 
             # Store in inbox (add_incoming_email handles duplicates)
-            was_new = self.db.add_incoming_email(email)
+            try:
+                was_new = db.add_incoming_email(email)
+            except Exception:
+                # Not stored: forget the ID so the sender's retry is processed in full
+                with self._recent_received_lock:
+                    self._recent_received.pop(message_id, None)
+                raise
 
             # Send ACK back to the original sender
             self._send_ack(
                 ack_for_id=message_id,
                 ack_to_node_id=original_sender_id, # Send ACK to original sender
-                ack_from_node_id=self._local_node_id # ACK originates from us
+                ack_from_node_id=local_node_id # ACK originates from us
             )
 
             # Notify companion device only if it was a new email
             if was_new:
-                notification_payload = protocol.encode_companion_response(
+                notification_payload = _encode_companion_response(
                     config.RESP_NEW_EMAIL_NOTIFY,
                     message_id=message_id,
                     from_node_id=email.from_node_id,
@@ -312,13 +575,14 @@ class AkitaEmailPlugin:
 
         else:
             # --- Message is NOT for us - Attempt to forward ---
-            logger.debug(f"Email (ID: {message_id}) from {original_sender_id:#0x} to {to_node_id:#0x} received for forwarding.")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Email (ID: {message_id}) from {_fmt_node(original_sender_id)} to {_fmt_node(to_node_id)} received for forwarding.")
 
             # Increment hop count
             new_hops = hops + 1
 
-            # Check hop limit BEFORE storing/forwarding
-            if new_hops > config.MESSAGE_HOP_LIMIT:
+            # Check hop limit BEFORE storing/forwarding; a message at the limit has no hops left to send with
+            if new_hops >= config.MESSAGE_HOP_LIMIT:
                 logger.warning(f"Dropping email {message_id} - Hop limit exceeded ({new_hops}/{config.MESSAGE_HOP_LIMIT})")
                 return # Do not forward
 
@@ -327,43 +591,54 @@ class AkitaEmailPlugin:
                 message_id=message_id, # Keep original ID
                 to_node_id=to_node_id,
                 from_node_id=original_sender_id, # Keep original sender
-                subject=data[config.MSG_KEY_SUBJECT],
-                body=data[config.MSG_KEY_BODY],
-                timestamp=data[config.MSG_KEY_TIMESTAMP], # Keep original timestamp
+                subject=data[_MSG_KEY_SUBJECT],
+                body=data[_MSG_KEY_BODY],
+                timestamp=data[_MSG_KEY_TIMESTAMP], # Keep original timestamp
                 hops=new_hops, # Use incremented hop count
                 # Status defaults to PENDING
             )
 
+            # Keep the outbox bounded: make room by dropping the oldest pending message,
+            # unless this email is already queued (a re-heard copy is only a duplicate)
+            if db.outbox_pending_count() >= config.OUTBOX_MAX_PENDING:
+                evicted = db.evict_oldest_pending(1, for_message_id=message_id)
+                now = time.monotonic()
+                if evicted and now - self._last_evict_log >= 60:
+                    self._last_evict_log = now
+                    logger.warning(f"Outbox full ({config.OUTBOX_MAX_PENDING} pending); dropped oldest pending email {evicted[0]} to forward {message_id}.")
+
             # Add to *our* outbox to be processed by the queue processor
             # add_outgoing_email handles duplicates (won't re-queue if already processing)
-            self.db.add_outgoing_email(email_to_forward)
+            if db.add_outgoing_email(email_to_forward):
+                self._outbox_event.set()
 
 
     def _handle_received_ack_packet(self, data: Dict[str, Any]):
         """Processes a decoded ACK message packet."""
-        if not self.db or not self._local_node_id: return
+        db = self.db
+        if not db or not self._local_node_id: return
 
-        ack_message_id = data[config.MSG_KEY_ID]
+        ack_message_id = data[_MSG_KEY_ID]
         ack_for_id = data[config.MSG_KEY_ACK_FOR] # ID of the email being ACKed
-        ack_to_node_id = cast(NodeId, data[config.MSG_KEY_TO]) # Who the ACK is intended for (us)
-        ack_from_node_id = cast(NodeId, data[config.MSG_KEY_FROM]) # Who sent the ACK (original recipient)
-        packet_info = data['_packet_info_']
-        immediate_sender_id = cast(NodeId, packet_info['from_node_id']) # Node that forwarded the ACK to us
+        ack_to_node_id: NodeId = data[_MSG_KEY_TO] # Who the ACK is intended for (us)
+        ack_from_node_id: NodeId = data[_MSG_KEY_FROM] # Who sent the ACK (original recipient)
+        immediate_sender_id: NodeId = data['_packet_info_']['from_node_id'] # Node that forwarded the ACK to us
 
         # Ensure the ACK is actually intended for this node
         if ack_to_node_id != self._local_node_id:
-            logger.debug(f"Ignoring ACK (ID: {ack_message_id}) intended for {ack_to_node_id:#0x}, not us ({self._local_node_id:#0x}).")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Ignoring ACK (ID: {ack_message_id}) intended for {_fmt_node(ack_to_node_id)}, not us ({_fmt_node(self._local_node_id)}).")
             # Note: We could potentially forward ACKs too, but it adds complexity.
             # If the original sender doesn't get the ACK, they will retry the email.
             return
 
-        logger.info(f"Received ACK (ID: {ack_message_id}) for email (ID: {ack_for_id}) from {ack_from_node_id:#0x} via {immediate_sender_id:#0x}.")
+        logger.info(f"Received ACK (ID: {ack_message_id}) for email (ID: {ack_for_id}) from {_fmt_node(ack_from_node_id)} via {_fmt_node(immediate_sender_id)}.")
 
         # Update the status of the original message in *our* outbox
-        self.db.mark_outbox_acked(ack_for_id, ack_from_node_id)
+        db.mark_outbox_acked(ack_for_id, ack_from_node_id)
 
         # Notify companion device of the successful delivery confirmation
-        status_update_payload = protocol.encode_companion_response(
+        status_update_payload = _encode_companion_response(
             config.RESP_STATUS_UPDATE,
             message_id=ack_for_id,
             status=models.STATUS_ACKED,
@@ -373,10 +648,45 @@ class AkitaEmailPlugin:
 
 
     def _send_ack(self, ack_for_id: str, ack_to_node_id: NodeId, ack_from_node_id: NodeId):
-        """Encodes and sends an ACK message via Meshtastic."""
+        """
+        Encodes an ACK message and queues it for the ACK sender thread, which does the
+        Meshtastic send. Sends inline if the sender is not running (plugin not started).
+        """
         try:
             ack_payload_bytes = protocol.encode_ack_to_lora(ack_for_id, ack_to_node_id, ack_from_node_id)
-            logger.info(f"Sending ACK for email {ack_for_id} to {ack_to_node_id:#0x}")
+        except ProtocolError as e:
+            # Error during ACK encoding
+            logger.error(f"Protocol error encoding ACK for {ack_for_id}: {e}", exc_info=True)
+            return
+
+        sender = self._ack_sender
+        if sender is None or not sender.is_alive():
+            self._transmit_ack(ack_for_id, ack_to_node_id, ack_payload_bytes)
+            return
+        with self._ack_tx_cond:
+            if len(self._ack_tx) == self._ack_tx.maxlen:
+                logger.warning(f"ACK queue full ({self._ack_tx.maxlen}); dropping ACK for {self._ack_tx[0][0]}.")
+            self._ack_tx.append((ack_for_id, ack_to_node_id, ack_payload_bytes))
+            self._ack_tx_cond.notify()
+
+    def _ack_sender_thread(self):
+        """Background thread that sends queued ACKs, draining the queue before it exits."""
+        logger.info("ACK sender thread started.")
+        tx = self._ack_tx
+        while True:
+            with self._ack_tx_cond:
+                while self.running and not tx:
+                    self._ack_tx_cond.wait()
+                if not tx:
+                    break # Stopping and nothing left to send
+                ack = tx.popleft()
+            self._transmit_ack(*ack)
+        logger.info("ACK sender thread stopped.")
+
+    def _transmit_ack(self, ack_for_id: str, ack_to_node_id: NodeId, ack_payload_bytes: bytes):
+        """Sends an encoded ACK message via Meshtastic."""
+        try:
+            logger.info(f"Sending ACK for email {ack_for_id} to {_fmt_node(ack_to_node_id)}")
 
             # ACKs are sent directly. We don't store ACKs in the outbox or wait for ACKs-of-ACKs.
             # Send directly to the node the ACK is intended for.
@@ -388,14 +698,11 @@ class AkitaEmailPlugin:
                 # Use default hop limit for ACKs, maybe lower? Default seems reasonable.
                 # hopLimit=config.MESSAGE_HOP_LIMIT
             )
-            logger.debug(f"ACK for {ack_for_id} sent successfully to mesh.")
+            logger.debug("ACK for %s sent successfully to mesh.", ack_for_id)
 
-        except ProtocolError as e:
-            # Error during ACK encoding
-            logger.error(f"Protocol error encoding ACK for {ack_for_id}: {e}", exc_info=True)
         except Exception as e:
             # Error during the Meshtastic send operation itself
-            logger.error(f"Meshtastic error sending ACK for {ack_for_id} to {ack_to_node_id:#0x}: {e}", exc_info=True)
+            logger.error(f"Meshtastic error sending ACK for {ack_for_id} to {_fmt_node(ack_to_node_id)}: {e}", exc_info=True)
             # Cannot do much if ACK send fails. The original sender will eventually retry the email.
 
 
@@ -404,60 +711,98 @@ class AkitaEmailPlugin:
     def _outgoing_queue_processor_thread(self):
         """Background thread loop that processes the outbox queue."""
         logger.info("Outgoing queue processor thread started.")
+        last_optimize_time = time.monotonic()
         while self.running:
             try:
                 if not self.db: # Check if DB is available
                      logger.error("Database not available in queue processor. Sleeping.")
-                     time.sleep(15)
+                     self._stop_event.wait(15)
                      continue
 
-                # Get messages needing processing (pending or retry)
-                emails_to_process = self.db.get_emails_to_send()
+                # Periodically refresh the query planner's statistics
+                if time.monotonic() - last_optimize_time >= config.PLUGIN_DB_OPTIMIZE_INTERVAL:
+                    self.db.optimize()
+                    last_optimize_time = time.monotonic()
 
-                if not emails_to_process:
-                    # Queue is empty, sleep longer
-                    time.sleep(5)
-                    continue
+                self._update_backpressure()
 
-                logger.debug(f"Processing {len(emails_to_process)} email(s) from outgoing queue.")
-                for email in emails_to_process:
-                    if not self.running: break # Exit loop if plugin is stopping
+                # Clear before reading the queue, so mail queued after this point wakes the wait below
+                self._outbox_event.clear()
+                # Get the next batch of messages needing processing (pending or retry)
+                emails_to_process = self.db.get_emails_to_send(limit=config.OUTBOX_SEND_BATCH_SIZE)
 
-                    # Double-check hop limit just before sending
-                    if email.hops >= config.MESSAGE_HOP_LIMIT:
-                        logger.warning(f"Dropping email {email.message_id} from queue - Hop limit {email.hops}/{config.MESSAGE_HOP_LIMIT} reached before sending.")
-                        self.db.mark_outbox_failed(email.message_id)
-                        continue
-
-                    # Attempt to send the email via Meshtastic
-                    send_success = self._attempt_send_email(email)
-
-                    # Update DB status based on send attempt *outcome*
-                    if send_success:
-                        self.db.update_outbox_after_send_attempt(email.message_id)
-                    else:
-                        # If _attempt_send_email failed (e.g., encoding error), it might have already marked it failed.
-                        # If it was a Meshtastic send error, we just leave it for the next retry cycle.
-                        logger.warning(f"Send attempt failed for email {email.message_id}. Will retry later if applicable.")
-                        # Optionally: Notify companion immediately about send *attempt* failure? Less critical.
+                if not emails_to_process:
+                    # Nothing to send: sleep until new mail is queued or the next retry/expiry comes due
+                    due = self.db.next_outbox_due_time() # On a DB error, raises and backs off below
+                    timeout = config.OUTBOX_IDLE_WAIT
+                    if due is not None:
+                        # A little past the due time, since the queue scan compares strictly
+                        timeout = min(timeout, max(0.0, due - time.time()) + 0.01)
+                    self._outbox_event.wait(timeout=timeout)
+                    continue
 
-                    # Small delay between processing messages to avoid flooding
-                    time.sleep(1.0)
+                logger.debug("Processing %d email(s) from outgoing queue.", len(emails_to_process))
+                batch_start = time.monotonic()
+                results: List[Tuple[str, models.OutboxStatus]] = [] # (message_id, outcome), recorded together
+                try:
+                    # get_emails_to_send fails messages at the hop limit instead of returning them
+                    for email in emails_to_process:
+                        if not self.running: break # Exit loop if plugin is stopping
+
+                        # Attempt to send the email via Meshtastic
+                        if self._attempt_send_email(email):
+                            results.append((email.message_id, models.STATUS_SENT))
+                        else:
+                            # If _attempt_send_email failed (e.g., encoding error), it might have already marked it failed.
+                            # If it was a Meshtastic send error, we just leave it for the next retry cycle.
+                            logger.warning(f"Send attempt failed for email {email.message_id}. Will retry later if applicable.")
+                            # Optionally: Notify companion immediately about send *attempt* failure? Less critical.
+                finally:
+                    # Record the batch's outcomes, even if the loop was interrupted
+                    if results:
+                        self.db.apply_outbox_results(results)
+
+                # Pace the batch to OUTBOX_SEND_GAP seconds per message sent, to avoid flooding the mesh
+                sent_count = sum(1 for _, outcome in results if outcome == models.STATUS_SENT)
+                if sent_count == 0:
+                    # Every attempt failed and the rows are still due; back off instead of refetching them at once
+                    self._stop_event.wait(config.OUTBOX_SEND_ERROR_WAIT)
+                    continue
+                self._stop_event.wait(max(0.0, sent_count * config.OUTBOX_SEND_GAP - (time.monotonic() - batch_start)))
 
             except DatabaseError as e:
                 logger.error(f"Database error in outgoing queue processor: {e}", exc_info=True)
-                time.sleep(10) # Wait longer after DB errors
+                self._stop_event.wait(10) # Wait longer after DB errors
             except Exception as e:
                 logger.critical(f"Unexpected critical error in outgoing queue processor: {e}", exc_info=True)
                 # Avoid tight loop on critical errors
-                time.sleep(10)
-
-            # Regular sleep even if queue wasn't empty, before checking again
-            time.sleep(1)
+                self._stop_event.wait(10)
 
         logger.info("Outgoing queue processor thread stopped.")
 
 
+    def _update_backpressure(self):
+        """
+        Tells the companion when the pending outbox crosses OUTBOX_BACKPRESSURE_LEVEL,
+        in either direction, so the user can hold off queuing more mail.
+        """
+        db = self.db
+        if not db: return
+        pending = db.outbox_pending_count()
+        fill_ratio = pending / max(1, config.OUTBOX_MAX_PENDING)
+        throttled = fill_ratio >= config.OUTBOX_BACKPRESSURE_LEVEL
+        if throttled == self._outbox_throttled:
+            return
+        self._outbox_throttled = throttled
+        logger.info(f"Outbox {'above' if throttled else 'back below'} backpressure level: {pending}/{config.OUTBOX_MAX_PENDING} pending.")
+        self._send_to_companion(_encode_companion_response(
+            config.RESP_BACKPRESSURE,
+            throttle=throttled,
+            fill_ratio=round(fill_ratio, 3),
+            pending=pending,
+            limit=config.OUTBOX_MAX_PENDING
+        ))
+
     def _attempt_send_email(self, email: models.Email) -> bool:
         """
         Encodes and attempts to send a single email via Meshtastic.
@@ -473,8 +818,16 @@ class AkitaEmailPlugin:
         if not self._local_node_id: return False # Should not happen
 
         try:
-            # Encode the email payload for LoRa
-            email_payload_bytes = protocol.encode_email_to_lora(email)
+            # Encode the email payload for LoRa. An outbox row never changes between
+            # attempts, so retries reuse the bytes encoded for the first attempt.
+            email_payload_bytes = self._payload_cache.get(email.message_id)
+            if email_payload_bytes is None:
+                email_payload_bytes = protocol.encode_email_to_lora(email)
+                self._payload_cache[email.message_id] = email_payload_bytes
+                if len(self._payload_cache) > config.OUTBOX_MAX_PENDING:
+                    self._payload_cache.popitem(last=False)
+            else:
+                self._payload_cache.move_to_end(email.message_id)
 
             # Determine the destination ID for the Meshtastic app-data send.
             # We send directly to the *final* recipient's Node ID.
@@ -482,11 +835,11 @@ class AkitaEmailPlugin:
             destination_id = email.to_node_id
 
             logger.info(f"Attempting to send/forward email {email.message_id} (Hop {email.hops}) "
-                        f"from {email.from_node_id:#0x} to {destination_id:#0x} "
+                        f"from {_fmt_node(email.from_node_id)} to {_fmt_node(destination_id)} "
                         f"(Originated: {email.from_node_id == self._local_node_id})")
 
-            # Calculate remaining hop limit for this transmission
-            # Ensure it's at least 1 if hops already match limit (should have been caught earlier)
+            # Remaining hop limit for this transmission. The queue scan fails messages at the limit,
+            # but a lowered MESSAGE_HOP_LIMIT must still never hand Meshtastic a hopLimit below 1.
             remaining_hops = max(1, config.MESSAGE_HOP_LIMIT - email.hops)
 
             # Send the app payload via Meshtastic on a private application port.
@@ -497,7 +850,7 @@ class AkitaEmailPlugin:
                 channelIndex=config.PRIMARY_CHANNEL_INDEX,
                 hopLimit=remaining_hops # Tell Meshtastic the max hops *from this point*
             )
-            logger.debug(f"Email {email.message_id} handed off to Meshtastic interface for sending.")
+            logger.debug("Email %s handed off to Meshtastic interface for sending.", email.message_id)
             return True # Send attempt initiated
 
         except ProtocolError as e:
@@ -508,38 +861,100 @@ class AkitaEmailPlugin:
             return False # Send attempt failed (permanently)
         except Exception as e:
             # Error during the Meshtastic send operation itself
-            logger.error(f"Meshtastic error during send attempt for email {email.message_id} to {email.to_node_id:#0x}: {e}", exc_info=True)
+            logger.error(f"Meshtastic error during send attempt for email {email.message_id} to {_fmt_node(email.to_node_id)}: {e}", exc_info=True)
             # Do not mark as failed yet, allow retry mechanism to handle it
             return False # Send attempt failed
 
 
     # --- Companion Interaction ---
 
+    def _wake_companion_listener(self):
+        """
+        Wakes the companion listener if it is blocked waiting for data: posts a byte to
+        its wake pipe, or cancels the pending read on ports that are not selectable (Windows).
+        """
+        with self._companion_wake_lock:
+            wake_pipe = self._companion_wake_pipe
+            if wake_pipe:
+                try:
+                    os.write(wake_pipe[1], b'\0')
+                except OSError:
+                    pass # Pipe full (a wake is already pending)
+                return
+        ser = self.companion_serial
+        if ser and ser.is_open:
+            try:
+                ser.cancel_read()
+            except Exception:
+                pass # Not supported by this pyserial backend; the read timeout still applies
+
     def _companion_listener_thread(self):
-        """Background thread loop to listen for commands from the companion CLI."""
+        """
+        Background thread loop to listen for commands from the companion CLI.
+        Blocks in a selector on both the serial port's file descriptor and a wake pipe,
+        so it reacts to incoming bytes and to stop() without polling; ports without a
+        selectable descriptor fall back to blocking reads bounded by the port's read
+        timeout. Bytes accumulate in one buffer that is split on newlines; a line
+        longer than COMPANION_MAX_LINE_BYTES is dropped without being buffered whole.
+        """
         logger.info("Companion listener thread started.")
+        sel: Optional[selectors.BaseSelector] = None
+        wake_r = wake_w = -1
+        rx_buffer = bytearray() # Bytes received but not yet terminated by a newline
+        max_line = config.COMPANION_MAX_LINE_BYTES
+        discarding = False # Dropping the rest of an overlong line, up to its newline
+        try:
+            sel = selectors.DefaultSelector()
+            sel.register(self.companion_serial.fileno(), selectors.EVENT_READ)
+            wake_r, wake_w = os.pipe()
+            os.set_blocking(wake_w, False) # A full pipe already holds a pending wake
+            sel.register(wake_r, selectors.EVENT_READ)
+            self._companion_wake_pipe = (wake_r, wake_w)
+        except (AttributeError, OSError, ValueError, serial.SerialException):
+            # pyserial on Windows does not expose a selectable descriptor
+            if sel is not None:
+                sel.close()
+            sel = None
+            logger.debug("Companion serial port is not selectable, using blocking reads.")
+
+        # If stop() ran before the wake pipe existed, self.running is already False here
         while self.running:
-            if not self.companion_serial or not self.companion_serial.is_open:
+            ser = self.companion_serial
+            if not ser or not ser.is_open:
                 logger.info("Companion serial port closed or unavailable. Listener thread stopping.")
                 break # Exit thread if serial port is closed
 
             try:
-                if self.companion_serial.in_waiting > 0:
-                    # Read a line from the serial port
-                    line = self.companion_serial.readline().decode('utf-8', errors='ignore')
-                    line = line.strip()
-
-                    if line:
-                        logger.debug(f"Received from companion: {line}")
-                        # Decode the JSON message
-                        command_data = protocol.decode_companion_message(line)
-
-                        if command_data and 'cmd' in command_data and 'params' in command_data:
-                            # Process the valid command
-                            self._handle_companion_command(command_data['cmd'], command_data['params'])
-                        elif command_data:
-                             logger.warning(f"Malformed command structure from companion: {command_data}")
-                        # else: decode_companion_message already logged warnings for non-JSON etc.
+                if sel is None:
+                    # Returns b'' when the read timeout expires, so self.running is re-checked
+                    rx_buffer += ser.read(ser.in_waiting or 1)
+                else:
+                    for key, _ in sel.select(timeout=None):
+                        if key.fd == wake_r:
+                            os.read(wake_r, 64) # Drain wake bytes; the loop condition decides whether to stop
+                        elif ser.is_open:
+                            rx_buffer += ser.read(ser.in_waiting or 1)
+
+                # Handle every complete line; a trailing partial line waits for more bytes
+                line_start = 0
+                newline_pos = rx_buffer.find(b'\n')
+                while newline_pos >= 0:
+                    if discarding:
+                        discarding = False # Tail of an overlong line
+                    elif newline_pos - line_start <= max_line:
+                        self._handle_companion_line(rx_buffer[line_start:newline_pos])
+                    else:
+                        logger.warning(f"Discarded companion line longer than {max_line} bytes.")
+                    line_start = newline_pos + 1
+                    newline_pos = rx_buffer.find(b'\n', line_start)
+                if line_start:
+                    del rx_buffer[:line_start]
+                if len(rx_buffer) > max_line:
+                    # No newline within the limit: drop what we have and skip to the next newline
+                    if not discarding:
+                        logger.warning(f"Discarding companion line longer than {max_line} bytes.")
+                    rx_buffer.clear()
+                    discarding = True
 
             except serial.SerialException as e:
                 logger.error(f"Companion serial communication error: {e}. Listener stopping.")
@@ -549,17 +964,36 @@ class AkitaEmailPlugin:
                     except Exception: pass
                 self.companion_serial = None
                 break # Exit thread
-            except UnicodeDecodeError as e:
-                 logger.warning(f"Companion sent non-UTF8 data, ignoring line: {e}")
             except Exception as e:
                 # Catch unexpected errors in the listener loop
                 logger.error(f"Unexpected error in companion listener: {e}", exc_info=True)
-                time.sleep(1) # Avoid tight loop on unexpected errors
+                self._stop_event.wait(1) # Avoid tight loop on unexpected errors
+
+        if sel is not None:
+            sel.close()
+            # Under the wake lock, so no waker still holds these fds when they are closed (and reused)
+            with self._companion_wake_lock:
+                self._companion_wake_pipe = None
+                os.close(wake_r)
+                os.close(wake_w)
+        logger.info("Companion listener thread stopped.")
 
-            # Small sleep to prevent high CPU usage if no data is waiting
-            time.sleep(0.1)
+    def _handle_companion_line(self, raw_line: bytes):
+        """Decodes one newline-terminated line from the companion and dispatches its command."""
+        if not raw_line or raw_line.isspace():
+            return
 
-        logger.info("Companion listener thread stopped.")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Received from companion: {bytes(raw_line).decode('utf-8', errors='replace').strip()}")
+        # Decode the JSON message straight from the received bytes; the parser skips the trailing newline
+        command_data = protocol.decode_companion_message(raw_line)
+
+        if command_data and 'cmd' in command_data and 'params' in command_data:
+            # Process the valid command
+            self._handle_companion_command(command_data['cmd'], command_data['params'])
+        elif command_data:
+             logger.warning(f"Malformed command structure from companion: {command_data}")
+        # else: decode_companion_message already logged warnings for non-JSON etc.
 
 
     def _handle_companion_command(self, command: str, params: Dict[str, Any]):
@@ -569,136 +1003,18 @@ class AkitaEmailPlugin:
              self._send_error_to_companion("Plugin not fully initialized.")
              return
 
-        logger.debug(f"Handling companion command: {command} with params: {params}")
-        response_payload = None # Prepare for potential response
+        logger.debug("Handling companion command: %s with params: %s", command, params)
 
         try:
-            if command == config.CMD_SEND_EMAIL:
-                # Validate required parameters
-                if not all(k in params for k in ['to_node_id', 'body']):
-                    raise ProtocolError("Missing parameters for send_email command (to_node_id, body required)")
-
-                # Validate and convert recipient ID (allow hex/decimal)
-                try:
-                    to_node_id_int = int(str(params['to_node_id']), 0)
-                    to_node_id = cast(NodeId, to_node_id_int) # Cast to NodeId
-                except (ValueError, TypeError):
-                    raise ProtocolError(f"Invalid to_node_id format: {params['to_node_id']}. Use decimal or 0xHEX.")
-
-                subject = params.get('subject', '') # Optional subject, default to empty
-                body = params['body']
-
-                if not isinstance(body, str) or not body:
-                    raise ProtocolError("Email body cannot be empty.")
-
-                # Create and queue the email
-                email = models.Email(
-                    to_node_id=to_node_id,
-                    from_node_id=self._local_node_id, # Use plugin's node ID as sender
-                    subject=str(subject), # Ensure string
-                    body=body
-                    # timestamp, message_id, etc., handled by model default factory
-                )
-                payload_size = protocol.validate_email_for_lora(email)
-                was_added = self.db.add_outgoing_email(email)
-                if was_added:
-                    logger.info(
-                        f"Email to {to_node_id:#0x} (ID: {email.message_id}) queued via companion command "
-                        f"with payload size {payload_size} bytes."
-                    )
-                    response_payload = protocol.encode_companion_response(
-                        config.RESP_STATUS_UPDATE,
-                        message_id=email.message_id,
-                        status=models.STATUS_PENDING,
-                        info="Email queued for sending."
-                    )
-                else:
-                    logger.warning(f"Attempted to queue duplicate email via companion (ID: {email.message_id})")
-                    response_payload = protocol.encode_companion_response(
-                        config.RESP_ERROR,
-                        command=command,
-                        message="Duplicate email ignored."
-                    )
-
-
-            elif command == config.CMD_READ_EMAILS:
-                limit = params.get('limit', 50)
-                try:
-                    limit = int(limit)
-                    if limit <= 0:
-                        limit = 50
-                except ValueError:
-                    limit = 50
-
-                logger.debug(f"Companion requested inbox emails (limit: {limit}).")
-                inbox_emails = self.db.get_inbox_emails(limit=limit)
-                email_list_dicts = [protocol.email_to_dict(mail) for mail in inbox_emails]
-                response_payload = protocol.encode_companion_response(
-                    config.RESP_INBOX_LIST,
-                    emails=email_list_dicts
-                )
-
-            elif command == config.CMD_GET_STATUS:
-                message_id = params.get('message_id')
-                if not message_id or not isinstance(message_id, str):
-                    raise ProtocolError("Missing or invalid 'message_id' parameter for get_status.")
-
-                logger.debug(f"Companion requested status for message ID: {message_id}")
-                email_status = self.db.get_outbox_status(message_id)
-                if email_status:
-                    response_payload = protocol.encode_companion_response(
-                        config.RESP_STATUS_UPDATE,
-                        message_id=message_id,
-                        status=email_status.status,
-                        recipient_node_id=email_status.to_node_id,
-                        acked_by=email_status.acked_by_node_id,
-                        retry_count=email_status.retry_count,
-                        last_attempt=email_status.last_attempt_time
-                    )
-                else:
-                    response_payload = protocol.encode_companion_response(
-                        config.RESP_ERROR,
-                        command=command,
-                        message_id=message_id,
-                        message="Message ID not found in outbox."
-                    )
-
-
-            elif command == config.CMD_SET_ALIAS:
-                alias = params.get('alias')
-                if alias is None:
-                    raise ProtocolError("Missing 'alias' parameter for set_alias command.")
-                alias = str(alias).strip()
-
-                MAX_ALIAS_LEN = 12
-                if len(alias) > MAX_ALIAS_LEN or not alias.isascii() or not alias.isprintable():
-                    logger.warning(f"Invalid alias requested: '{alias}'. Length/characters invalid.")
-                    raise ProtocolError(f"Invalid alias. Max {MAX_ALIAS_LEN} printable ASCII chars.")
-
-                logger.info(f"Setting Meshtastic node short name to '{alias}' via companion command.")
-                try:
-                    self.interface.getNode(self._local_node_id).setShortName(alias)
-                    response_payload = protocol.encode_companion_response(
-                        config.RESP_STATUS_UPDATE,
-                        status='alias_set',
-                        alias=alias,
-                        info="Alias set request sent to node. May require node restart."
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to send setShortName request to node: {e}", exc_info=True)
-                    raise CommunicationError(f"Failed to set node alias via Meshtastic: {e}") from e
-
-            elif command == config.CMD_PING_PLUGIN:
-                logger.debug("Received ping from companion.")
-                response_payload = protocol.encode_companion_response(config.RESP_PONG, timestamp=time.time())
+            if type(params) is not dict:
+                raise ProtocolError(f"'params' for {command} must be an object.")
 
+            handler = self._command_handlers.get(command) if type(command) is str else None
+            if handler is not None:
+                response_payload = handler(params)
             else:
                 logger.warning(f"Received unknown command from companion: {command}")
-                response_payload = protocol.encode_companion_response(
-                    config.RESP_ERROR,
-                    command=command,
-                    message="Unknown command received by plugin."
-                )
+                response_payload = protocol.encode_error(command, "Unknown command received by plugin.")
 
             # Send the prepared response (if any) back to the companion
             if response_payload:
@@ -711,14 +1027,133 @@ class AkitaEmailPlugin:
             logger.critical(f"Unexpected critical error handling companion command '{command}': {e}", exc_info=True)
             self._send_error_to_companion("Internal plugin error occurred.", command)
 
-    def _send_error_to_companion(self, error_message: str, command: Optional[str] = None):
-        """Helper method to send a formatted error response to the companion."""
+    # --- Companion command handlers (see self._command_handlers) ---
+    # Each takes the command's params dict and returns the encoded response line, or None
+    # if it sent its own response(s). Raised ProtocolError etc. become error responses.
+
+    def _handle_send_email_command(self, params: Dict[str, Any]) -> Optional[bytes]:
+        # Validate required parameters
+        if not _SEND_EMAIL_REQUIRED.issubset(params):
+            raise ProtocolError("Missing parameters for send_email command (to_node_id, body required)")
+
+        # Validate and convert recipient ID (allow hex/decimal)
         try:
-            error_payload = protocol.encode_companion_response(
+            to_node_id_int = int(str(params['to_node_id']), 0)
+            to_node_id = cast(NodeId, to_node_id_int) # Cast to NodeId
+        except (ValueError, TypeError):
+            raise ProtocolError(f"Invalid to_node_id format: {params['to_node_id']}. Use decimal or 0xHEX.")
+
+        subject = params.get('subject', '') # Optional subject, default to empty
+        body = params['body']
+
+        if not isinstance(body, str) or not body:
+            raise ProtocolError("Email body cannot be empty.")
+
+        # Create and queue the email
+        email = models.Email(
+            to_node_id=to_node_id,
+            from_node_id=self._local_node_id, # Use plugin's node ID as sender
+            subject=str(subject), # Ensure string
+            body=body
+            # timestamp, message_id, etc., handled by model default factory
+        )
+        payload_size = protocol.validate_email_for_lora(email)
+        was_added = self.db.add_outgoing_email(email)
+        if not was_added:
+            logger.warning(f"Attempted to queue duplicate email via companion (ID: {email.message_id})")
+            return protocol.encode_error(config.CMD_SEND_EMAIL, "Duplicate email ignored.")
+
+        self._outbox_event.set()
+        logger.info(
+            f"Email to {to_node_id:#0x} (ID: {email.message_id}) queued via companion command "
+            f"with payload size {payload_size} bytes."
+        )
+        return _encode_companion_response(
+            config.RESP_STATUS_UPDATE,
+            message_id=email.message_id,
+            status=models.STATUS_PENDING,
+            info="Email queued for sending."
+        )
+
+    def _handle_read_emails_command(self, params: Dict[str, Any]) -> Optional[bytes]:
+        limit = params.get('limit', 50)
+        try:
+            limit = int(limit)
+            if limit <= 0:
+                limit = 50
+        except ValueError:
+            limit = 50
+
+        logger.debug("Companion requested inbox emails (limit: %s).", limit)
+        # Stream the inbox one email per line (rows come back already shaped like
+        # protocol.email_to_dict() output), so the companion can show the first
+        # emails while the rest are still on the wire; RESP_INBOX_END closes the list.
+        if config.COMPANION_WIRE_FORMAT == "binary":
+            encode_row = protocol.encode_inbox_row_frame
+        else:
+            encode_row = protocol.encode_inbox_row
+        count = 0
+        for count, email_dict in enumerate(self.db.get_inbox_email_dicts(limit=limit), 1):
+            self._send_to_companion(encode_row(count, email_dict), wait=True)
+        self._send_to_companion(
+            _encode_companion_response(config.RESP_INBOX_END, count=count), wait=True
+        )
+        return None
+
+    def _handle_get_status_command(self, params: Dict[str, Any]) -> Optional[bytes]:
+        message_id = params.get('message_id')
+        if not message_id or not isinstance(message_id, str):
+            raise ProtocolError("Missing or invalid 'message_id' parameter for get_status.")
+
+        logger.debug("Companion requested status for message ID: %s", message_id)
+        email_status = self.db.get_outbox_status(message_id)
+        if not email_status:
+            return _encode_companion_response(
                 config.RESP_ERROR,
-                command=command,
-                message=str(error_message)
+                command=config.CMD_GET_STATUS,
+                message_id=message_id,
+                message="Message ID not found in outbox."
             )
+        return protocol.encode_status_update(
+            message_id,
+            email_status.status,
+            email_status.to_node_id,
+            email_status.acked_by_node_id,
+            email_status.retry_count,
+            email_status.last_attempt_time
+        )
+
+    def _handle_set_alias_command(self, params: Dict[str, Any]) -> Optional[bytes]:
+        alias = params.get('alias')
+        if alias is None:
+            raise ProtocolError("Missing 'alias' parameter for set_alias command.")
+        alias = str(alias).strip()
+
+        if not _ALIAS_RE.fullmatch(alias):
+            logger.warning(f"Invalid alias requested: '{alias}'. Length/characters invalid.")
+            raise ProtocolError(f"Invalid alias. Max {_MAX_ALIAS_LEN} printable ASCII chars.")
+
+        logger.info(f"Setting Meshtastic node short name to '{alias}' via companion command.")
+        try:
+            self.interface.getNode(self._local_node_id).setShortName(alias)
+        except Exception as e:
+            logger.error(f"Failed to send setShortName request to node: {e}", exc_info=True)
+            raise CommunicationError(f"Failed to set node alias via Meshtastic: {e}") from e
+        return _encode_companion_response(
+            config.RESP_STATUS_UPDATE,
+            status='alias_set',
+            alias=alias,
+            info="Alias set request sent to node. May require node restart."
+        )
+
+    def _handle_ping_command(self, params: Dict[str, Any]) -> Optional[bytes]:
+        logger.debug("Received ping from companion.")
+        return protocol.encode_pong()
+
+    def _send_error_to_companion(self, error_message: str, command: Optional[str] = None):
+        """Helper method to send a formatted error response to the companion."""
+        try:
+            error_payload = protocol.encode_error(command, str(error_message))
             self._send_to_companion(error_payload)
         except Exception as e:
             logger.error(f"Failed to send error message to companion: {e}", exc_info=True)
@@ -1,12 +1,27 @@
 # akita_email/protocol.py
+import functools
 import json
 import logging
+import operator
+import os
+import random
+import re
+import struct
 import time
-import uuid
-from typing import Dict, Any, Optional, Union, cast
+from typing import Dict, Any, Optional, Tuple, Union, cast
 
 from meshtastic.protobuf import mesh_pb2
 
+try:
+    import orjson # Optional: much faster JSON encoding/parsing if installed
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack # Optional: binary LoRa payloads (config.LORA_WIRE_FORMAT = "msgpack")
+except ImportError:
+    msgpack = None
+
 from . import config
 from .models import Email, NodeId, STATUS_RECEIVED # Import STATUS_RECEIVED
 from .exceptions import ProtocolError
@@ -14,23 +29,65 @@ from .exceptions import ProtocolError
 # Get a logger specific to this module
 logger = config.setup_logger(__name__, config.PLUGIN_LOG_LEVEL, config.PLUGIN_LOG_FILE, console=False)
 
+# JSON parser for LoRa payloads and serial messages; orjson raises a json.JSONDecodeError
+# subclass, so callers can treat both implementations the same way.
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+# JSON serializer producing compact UTF-8 bytes. Both implementations give the same
+# output for our payloads, and both raise a TypeError (subclass) for unserializable data.
+if orjson is not None:
+    _json_dumps = orjson.dumps
+else:
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
 # --- LoRa Message Encoding/Decoding (JSON for now) ---
 
-def _encode_base(msg_type: str, msg_id: str) -> Dict[str, Any]:
-    """Creates the base dictionary structure for an Akita LoRa message."""
-    if not msg_id:
-        msg_id = str(uuid.uuid4()) # Ensure message always has an ID
-        logger.warning(f"Generated missing message ID for type {msg_type}: {msg_id}")
-    return {
-        config.MSG_KEY_TYPE: msg_type,
-        config.MSG_KEY_ID: msg_id,
-    }
+# ACK IDs only need a few random characters to tell repeated ACKs apart; they are not secrets
+_ack_suffix_rand = random.Random()
+
+def _generate_missing_id(msg_type: str) -> str:
+    """Ensures a message always has an ID; only reached for Emails built without one."""
+    msg_id = os.urandom(16).hex() # 32 hex chars, like uuid4().hex
+    logger.warning(f"Generated missing message ID for type {msg_type}: {msg_id}")
+    return msg_id
 
 def _get_meshtastic_payload_limit() -> int:
     return int(mesh_pb2.Constants.DATA_PAYLOAD_LEN)
 
+# First byte of a MessagePack LoRa payload. 0xAE can never start a UTF-8 string,
+# so receivers tell it apart from a JSON payload without trying to parse either.
+_MSGPACK_MAGIC = b'\xae'
+_MSGPACK_KEY_NAMES = {number: key for key, number in config.MSG_KEY_INT_MAP.items()}
+_msgpack_missing_warned = False
+
 def _serialize_payload(payload: Dict[str, Any]) -> bytes:
-    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    global _msgpack_missing_warned
+    if config.LORA_WIRE_FORMAT == "msgpack":
+        if msgpack is not None:
+            key_map = config.MSG_KEY_INT_MAP
+            # Keys without a number (none today) go out as their string names
+            return _MSGPACK_MAGIC + msgpack.packb({key_map.get(k, k): v for k, v in payload.items()}, use_bin_type=True)
+        if not _msgpack_missing_warned:
+            _msgpack_missing_warned = True
+            logger.warning("LORA_WIRE_FORMAT is 'msgpack' but the msgpack package is not installed; sending JSON.")
+    return _json_dumps(payload)
+
+def _unpack_msgpack_payload(raw: bytes) -> Any:
+    """
+    Unpacks a MessagePack LoRa payload (magic byte included) into a dict with the usual string keys.
+
+    Raises:
+        ProtocolError: If the payload is not valid MessagePack.
+    """
+    try:
+        packed = msgpack.unpackb(raw[1:], raw=False, strict_map_key=False)
+    except (ValueError, TypeError) as e: # msgpack's unpack errors are ValueError subclasses
+        raise ProtocolError(f"malformed MessagePack payload: {e}") from e
+    if not isinstance(packed, dict):
+        return packed
+    key_names = _MSGPACK_KEY_NAMES
+    return {key_names.get(k, k): v for k, v in packed.items()}
 
 def _validate_payload_size(payload_bytes: bytes, label: str) -> bytes:
     payload_limit = _get_meshtastic_payload_limit()
@@ -64,48 +121,79 @@ def _decode_payload_text(decoded_part: Dict[str, Any]) -> Optional[str]:
     return None
 
 def _email_payload_dict(email: Email) -> Dict[str, Any]:
-    payload = _encode_base(config.MSG_TYPE_EMAIL, email.message_id)
-    payload.update({
+    # One dict literal per message shape; type and ID lead, as the wire format has always had them
+    return {
+        config.MSG_KEY_TYPE: config.MSG_TYPE_EMAIL,
+        config.MSG_KEY_ID: email.message_id or _generate_missing_id(config.MSG_TYPE_EMAIL),
         config.MSG_KEY_TO: email.to_node_id,
         config.MSG_KEY_FROM: email.from_node_id,
         config.MSG_KEY_SUBJECT: email.subject,
         config.MSG_KEY_BODY: email.body,
         config.MSG_KEY_TIMESTAMP: int(email.timestamp),
         config.MSG_KEY_HOPS: email.hops,
-    })
-    return payload
+    }
+
+# Fast path for the common all-ASCII email when orjson is not installed: a %-template of
+# the exact JSON json.dumps would produce, built once from the configured keys (about twice
+# as fast as dict + json.dumps; orjson itself beats both, so it is skipped then). Only used
+# when every string field is printable ASCII without '"' or '\\', so nothing needs escaping.
+_EMAIL_TEMPLATE_FAST_PATH = orjson is None
+_JSON_SAFE_TEXT_RE = re.compile(r'[ !#-\[\]-~]*')
+_EMAIL_JSON_TEMPLATE = (
+    '{' + json.dumps(config.MSG_KEY_TYPE) + ':' + json.dumps(config.MSG_TYPE_EMAIL)
+    + ',' + json.dumps(config.MSG_KEY_ID) + ':"%s"'
+    + ',' + json.dumps(config.MSG_KEY_TO) + ':%d'
+    + ',' + json.dumps(config.MSG_KEY_FROM) + ':%d'
+    + ',' + json.dumps(config.MSG_KEY_SUBJECT) + ':"%s"'
+    + ',' + json.dumps(config.MSG_KEY_BODY) + ':"%s"'
+    + ',' + json.dumps(config.MSG_KEY_TIMESTAMP) + ':%d'
+    + ',' + json.dumps(config.MSG_KEY_HOPS) + ':%d}'
+)
+
+def _serialize_email(email: Email) -> bytes:
+    """Serializes an email's LoRa payload; same bytes as _serialize_payload(_email_payload_dict(email))."""
+    message_id, subject, body = email.message_id, email.subject, email.body
+    safe = _JSON_SAFE_TEXT_RE.fullmatch
+    if (_EMAIL_TEMPLATE_FAST_PATH and config.LORA_WIRE_FORMAT != "msgpack" and message_id
+            and type(email.to_node_id) is int and type(email.from_node_id) is int and type(email.hops) is int
+            and type(message_id) is str and type(subject) is str and type(body) is str
+            and safe(message_id) and safe(subject) and safe(body)):
+        return (_EMAIL_JSON_TEMPLATE % (message_id, email.to_node_id, email.from_node_id, subject, body,
+                                        int(email.timestamp), email.hops)).encode('ascii')
+    return _serialize_payload(_email_payload_dict(email))
 
 def encode_email_to_lora(email: Email) -> bytes:
     """
-    Encodes an Email object into a compact JSON byte payload for Meshtastic.
+    Encodes an Email object into a compact byte payload for Meshtastic
+    (JSON, or MessagePack when config.LORA_WIRE_FORMAT is "msgpack").
 
     Args:
         email: The Email object to encode.
 
     Returns:
-        A compact UTF-8 JSON byte payload.
+        The encoded byte payload.
 
     Raises:
         ProtocolError: If encoding fails.
     """
-    payload = _email_payload_dict(email)
     try:
-        return _validate_payload_size(_serialize_payload(payload), "Email")
+        return _validate_payload_size(_serialize_email(email), "Email")
     except (TypeError, UnicodeError) as e:
-        logger.error(f"Failed to JSON encode email {email.message_id}: {e}", exc_info=True)
+        logger.error(f"Failed to encode email {email.message_id}: {e}", exc_info=True)
         raise ProtocolError(f"Failed to encode email: {e}") from e
 
 def estimate_email_payload_size(email: Email) -> int:
-    return len(_serialize_payload(_email_payload_dict(email)))
+    return len(_serialize_email(email))
 
 def validate_email_for_lora(email: Email) -> int:
-    payload_bytes = _serialize_payload(_email_payload_dict(email))
+    payload_bytes = _serialize_email(email)
     _validate_payload_size(payload_bytes, "Email")
     return len(payload_bytes)
 
 def encode_ack_to_lora(ack_for_id: str, to_node_id: NodeId, from_node_id: NodeId) -> bytes:
     """
-    Encodes an ACK message into a compact JSON byte payload for Meshtastic.
+    Encodes an ACK message into a compact byte payload for Meshtastic
+    (JSON, or MessagePack when config.LORA_WIRE_FORMAT is "msgpack").
 
     Args:
         ack_for_id: The message_id of the email being acknowledged.
@@ -113,31 +201,56 @@ def encode_ack_to_lora(ack_for_id: str, to_node_id: NodeId, from_node_id: NodeId
         from_node_id: The NodeId sending the ACK (original recipient).
 
     Returns:
-        A compact UTF-8 JSON byte payload.
+        The encoded byte payload.
 
     Raises:
         ProtocolError: If encoding fails.
     """
     # Create a unique ID for the ACK itself, derived from the original ID
-    ack_msg_id = f"ack_{ack_for_id}_{uuid.uuid4().hex[:6]}"
+    ack_msg_id = f"ack_{ack_for_id}_{_ack_suffix_rand.getrandbits(24):06x}"
     if len(ack_msg_id) > config.MESSAGE_ID_MAX_LENGTH:
         raise ProtocolError(
             f"Generated ACK ID exceeds maximum length of {config.MESSAGE_ID_MAX_LENGTH} characters"
         )
-    payload = _encode_base(config.MSG_TYPE_ACK, ack_msg_id)
-    payload.update({
+    payload = {
+        config.MSG_KEY_TYPE: config.MSG_TYPE_ACK,
+        config.MSG_KEY_ID: ack_msg_id,
         config.MSG_KEY_ACK_FOR: ack_for_id,
         config.MSG_KEY_TO: to_node_id,       # Destination of the ACK
         config.MSG_KEY_FROM: from_node_id,   # Source of the ACK
         config.MSG_KEY_TIMESTAMP: int(time.time()), # Timestamp of ACK generation
         config.MSG_KEY_HOPS: 0,              # ACK starts with 0 hops
-    })
+    }
     try:
         return _validate_payload_size(_serialize_payload(payload), "ACK")
     except (TypeError, UnicodeError) as e:
-        logger.error(f"Failed to JSON encode ACK for {ack_for_id}: {e}", exc_info=True)
+        logger.error(f"Failed to encode ACK for {ack_for_id}: {e}", exc_info=True)
         raise ProtocolError(f"Failed to encode ACK: {e}") from e
 
+# Per-type field checks for decode_lora_packet: (required keys, int keys, str keys).
+# Add an entry here when a new message type (like ALIAS) is implemented.
+_NUMERIC_KEYS = (config.MSG_KEY_TO, config.MSG_KEY_FROM, config.MSG_KEY_TIMESTAMP, config.MSG_KEY_HOPS)
+_MSG_SCHEMAS = {
+    config.MSG_TYPE_EMAIL: (frozenset(_NUMERIC_KEYS + (config.MSG_KEY_BODY,)), _NUMERIC_KEYS, (config.MSG_KEY_BODY,)),
+    config.MSG_TYPE_ACK: (frozenset(_NUMERIC_KEYS + (config.MSG_KEY_ACK_FOR,)), _NUMERIC_KEYS, (config.MSG_KEY_ACK_FOR,)),
+}
+
+def _validate_fields(data: Dict[str, Any], required: frozenset, int_keys: Tuple[str, ...],
+                     str_keys: Tuple[str, ...]) -> Optional[str]:
+    """Returns None if data passes its type's schema, else a short description of the first problem."""
+    if not required.issubset(data): # Iterates the frozenset, hashing into the dict; no keys view needed
+        return f"missing keys {sorted(required - data.keys())}"
+    # type() is int, not isinstance: JSON true/false must not pass as node IDs or hop counts
+    if not all(type(data[key]) is int for key in int_keys):
+        return "non-integer numeric field"
+    if not all(type(data[key]) is str for key in str_keys):
+        return "non-string text field"
+    if not (0 <= data[config.MSG_KEY_TO] <= 0xFFFFFFFF and 0 <= data[config.MSG_KEY_FROM] <= 0xFFFFFFFF):
+        return "invalid node ID"
+    if data[config.MSG_KEY_TIMESTAMP] < 0 or data[config.MSG_KEY_HOPS] < 0:
+        return "invalid timestamp/hops"
+    return None
+
 def decode_lora_packet(packet: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """
     Decodes a received Meshtastic packet potentially containing an Akita message.
@@ -163,15 +276,25 @@ def decode_lora_packet(packet: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     if not _is_supported_meshtastic_port(portnum):
         return None
 
-    payload_str = _decode_payload_text(decoded_part)
-    if not payload_str:
-        return None
+    raw_payload = decoded_part.get('payload')
+    is_msgpack = isinstance(raw_payload, (bytes, bytearray)) and raw_payload[:1] == _MSGPACK_MAGIC
+    if is_msgpack:
+        if msgpack is None:
+            logger.warning("Received a MessagePack Akita payload, but the msgpack package is not installed")
+            return None
+        payload_str = repr(bytes(raw_payload)) # Only used in log messages
+    else:
+        payload_str = _decode_payload_text(decoded_part)
+        if not payload_str:
+            return None
+        if payload_str[0] != '{' and not payload_str[0].isspace():
+            return None # Ordinary chat text on a shared port; skip the failed JSON parse
 
     try:
-        # Attempt to parse the JSON payload
-        data = json.loads(payload_str)
+        # Attempt to parse the payload
+        data = _unpack_msgpack_payload(raw_payload) if is_msgpack else _json_loads(payload_str)
         if not isinstance(data, dict):
-            logger.warning(f"Received non-dict JSON payload: {payload_str}")
+            logger.warning(f"Received non-dict Akita payload: {payload_str}")
             return None
 
         # --- Basic Akita Message Validation ---
@@ -204,71 +327,35 @@ def decode_lora_packet(packet: Dict[str, Any]) -> Optional[Dict[str, Any]]:
 
 
         # --- Type-Specific Validation ---
+        schema = _MSG_SCHEMAS.get(msg_type)
+        if schema is None:
+            logger.warning(f"Received unknown Akita message type '{msg_type}' (ID: {msg_id}): {data}")
+            return None # Unknown type
+        problem = _validate_fields(data, *schema)
+        if problem is not None:
+            logger.warning(f"Rejected {msg_type} message (ID: {msg_id}): {problem}: {data}")
+            return None
+
         if msg_type == config.MSG_TYPE_EMAIL:
-            required_keys = [config.MSG_KEY_TO, config.MSG_KEY_FROM, config.MSG_KEY_BODY,
-                             config.MSG_KEY_TIMESTAMP, config.MSG_KEY_HOPS]
-            if not all(key in data for key in required_keys):
-                logger.warning(f"Received incomplete EMAIL message (ID: {msg_id}): Missing keys in {data}")
-                return None
-            # Validate numeric types
-            for key in [config.MSG_KEY_TO, config.MSG_KEY_FROM, config.MSG_KEY_TIMESTAMP, config.MSG_KEY_HOPS]:
-                if not isinstance(data.get(key), int):
-                    logger.warning(f"Invalid type for key '{key}' in EMAIL (ID: {msg_id}): {data}")
-                    return None
-            if not _is_valid_node_id(data.get(config.MSG_KEY_TO)) or not _is_valid_node_id(data.get(config.MSG_KEY_FROM)):
-                logger.warning(f"Invalid node ID in EMAIL (ID: {msg_id}): {data}")
-                return None
-            if data[config.MSG_KEY_TIMESTAMP] < 0 or data[config.MSG_KEY_HOPS] < 0:
-                logger.warning(f"Invalid timestamp/hops in EMAIL (ID: {msg_id}): {data}")
-                return None
-            if not isinstance(data.get(config.MSG_KEY_BODY), str):
-                logger.warning(f"Invalid body type in EMAIL (ID: {msg_id}): {data}")
-                return None
             # Ensure subject is present (even if empty string), default if missing
-            data.setdefault(config.MSG_KEY_SUBJECT, "")
-            if not isinstance(data.get(config.MSG_KEY_SUBJECT), str):
+            if type(data.setdefault(config.MSG_KEY_SUBJECT, "")) is not str:
                 data[config.MSG_KEY_SUBJECT] = "" # Force to empty string
-
-
-        elif msg_type == config.MSG_TYPE_ACK:
-            required_keys = [config.MSG_KEY_ACK_FOR, config.MSG_KEY_TO, config.MSG_KEY_FROM,
-                             config.MSG_KEY_TIMESTAMP, config.MSG_KEY_HOPS]
-            if not all(key in data for key in required_keys):
-                logger.warning(f"Received incomplete ACK message (ID: {msg_id}): Missing keys in {data}")
-                return None
-            # Validate numeric types
-            for key in [config.MSG_KEY_TO, config.MSG_KEY_FROM, config.MSG_KEY_TIMESTAMP, config.MSG_KEY_HOPS]:
-                if not isinstance(data.get(key), int):
-                    logger.warning(f"Invalid type for key '{key}' in ACK (ID: {msg_id}): {data}")
-                    return None
-            if not _is_valid_node_id(data.get(config.MSG_KEY_TO)) or not _is_valid_node_id(data.get(config.MSG_KEY_FROM)):
-                logger.warning(f"Invalid node ID in ACK (ID: {msg_id}): {data}")
-                return None
-            if data[config.MSG_KEY_TIMESTAMP] < 0 or data[config.MSG_KEY_HOPS] < 0:
-                logger.warning(f"Invalid timestamp/hops in ACK (ID: {msg_id}): {data}")
-                return None
-            # Validate ACK_FOR is a string
-            if not isinstance(data.get(config.MSG_KEY_ACK_FOR), str):
-                logger.warning(f"Invalid type for ack_for key in ACK (ID: {msg_id}): {data}")
-                return None
-            if len(data[config.MSG_KEY_ACK_FOR]) > config.MESSAGE_ID_MAX_LENGTH:
-                logger.warning(f"ACK references oversized message ID (ID: {msg_id}): {data}")
-                return None
-
-        # Add validation for other message types (like ALIAS) here if implemented
-
-        else:
-            logger.warning(f"Received unknown Akita message type '{msg_type}' (ID: {msg_id}): {data}")
-            return None # Unknown type
+        elif len(data[config.MSG_KEY_ACK_FOR]) > config.MESSAGE_ID_MAX_LENGTH:
+            logger.warning(f"ACK references oversized message ID (ID: {msg_id}): {data}")
+            return None
 
         # If all checks pass, return the validated data dictionary
-        logger.debug(f"Successfully decoded packet type '{msg_type}' (ID: {msg_id}) from {packet_info['from_node_id']:#0x}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Successfully decoded packet type '%s' (ID: %s) from %#0x", msg_type, msg_id, packet_info['from_node_id'])
         return data
 
     except json.JSONDecodeError:
         # Ignore messages that are clearly not JSON, might be other mesh traffic
         # logger.debug(f"Received non-JSON text message: {payload_str}")
         return None
+    except ProtocolError as e:
+        logger.warning(f"Received undecodable Akita payload ({e}): {payload_str}")
+        return None
     except KeyError as e:
         # This shouldn't happen with .get() usage, but catch just in case
         logger.warning(f"Missing expected key {e} during decoding: {payload_str}", exc_info=True)
@@ -281,9 +368,14 @@ def decode_lora_packet(packet: Dict[str, Any]) -> Optional[Dict[str, Any]]:
 
 # --- Companion <-> Plugin Communication Protocol (Serial JSON Lines) ---
 
-def encode_companion_command(command_type: str, **kwargs) -> str:
+@functools.lru_cache(maxsize=64)
+def _encode_bare_command(command_type: str) -> bytes:
+    """Encodes a parameterless command (e.g. ping) once per command type."""
+    return _json_dumps({"cmd": command_type, "params": {}}) + b"\n"
+
+def encode_companion_command(command_type: str, **kwargs) -> bytes:
     """
-    Encodes a command dictionary into a JSON string line for sending
+    Encodes a command dictionary into a JSON line for sending
     FROM the Companion CLI TO the Plugin over serial.
 
     Args:
@@ -291,21 +383,28 @@ def encode_companion_command(command_type: str, **kwargs) -> str:
         **kwargs: Parameters for the command.
 
     Returns:
-        A newline-terminated JSON string.
+        A newline-terminated, UTF-8 encoded JSON line, ready to write to the port.
 
     Raises:
         ProtocolError: If encoding fails.
     """
-    payload = {"cmd": command_type, "params": kwargs}
     try:
+        if not kwargs and isinstance(command_type, str):
+            return _encode_bare_command(command_type)
+        payload = {"cmd": command_type, "params": kwargs}
         # Add newline for line-based serial reading
-        return json.dumps(payload) + "\n"
-    except TypeError as e:
+        return _json_dumps(payload) + b"\n"
+    except (TypeError, UnicodeError) as e:
         raise ProtocolError(f"Failed to encode companion command {command_type}: {e}") from e
 
-def encode_companion_response(response_type: str, **kwargs) -> str:
+@functools.lru_cache(maxsize=64)
+def _companion_response_prefix(response_type: str) -> bytes:
+    """The constant '{"resp":"<type>","data":' head of a response line, encoded once per type."""
+    return b'{"resp":' + _json_dumps(response_type) + b',"data":'
+
+def encode_companion_response(response_type: str, **kwargs) -> bytes:
     """
-    Encodes a response or notification dictionary into a JSON string line
+    Encodes a response or notification dictionary into a JSON line
     for sending FROM the Plugin TO the Companion CLI over serial.
 
     Args:
@@ -313,33 +412,208 @@ def encode_companion_response(response_type: str, **kwargs) -> str:
         **kwargs: Data associated with the response.
 
     Returns:
-        A newline-terminated JSON string.
+        A newline-terminated, UTF-8 encoded JSON line, ready to write to the port.
 
     Raises:
         ProtocolError: If encoding fails.
     """
-    payload = {"resp": response_type, "data": kwargs}
     try:
-        # Add newline for line-based serial reading
-        return json.dumps(payload) + "\n"
-    except TypeError as e:
+        # Same bytes as serializing {"resp": ..., "data": kwargs}; only the data part is serialized per call
+        return b''.join((_companion_response_prefix(response_type), _json_dumps(kwargs), b'}\n'))
+    except (TypeError, UnicodeError) as e:
         raise ProtocolError(f"Failed to encode companion response {response_type}: {e}") from e
 
-def decode_companion_message(line: str) -> Optional[Dict[str, Any]]:
+# Fixed-shape responses are assembled from prebuilt byte templates instead of a dict + dumps per call
+_PONG_PREFIX = _companion_response_prefix(config.RESP_PONG) + b'{"timestamp":'
+_RESPONSE_SUFFIX = b'}}\n'
+
+def encode_pong(timestamp: Optional[float] = None) -> bytes:
+    """Encodes a RESP_PONG line; same bytes as encode_companion_response(config.RESP_PONG, timestamp=...)."""
+    if timestamp is None:
+        timestamp = time.time()
+    return _PONG_PREFIX + repr(float(timestamp)).encode('ascii') + _RESPONSE_SUFFIX
+
+_STATUS_PREFIX = _companion_response_prefix(config.RESP_STATUS_UPDATE) + b'{"message_id":'
+
+def _json_scalar(value: Any) -> bytes:
+    """Serializes one response field; plain ints and None skip the JSON encoder."""
+    if type(value) is int:
+        return str(value).encode('ascii')
+    if value is None:
+        return b'null'
+    return _json_dumps(value)
+
+def encode_status_update(message_id: str, status: str, recipient_node_id: Optional[NodeId],
+                         acked_by: Optional[NodeId], retry_count: int, last_attempt: float) -> bytes:
+    """
+    Encodes the full RESP_STATUS_UPDATE line sent for get_status; same bytes as
+    encode_companion_response() with these keyword arguments, built from a fixed template.
+
+    Raises:
+        ProtocolError: If encoding fails.
+    """
+    try:
+        return b''.join((
+            _STATUS_PREFIX, _json_dumps(message_id),
+            b',"status":', _json_dumps(status),
+            b',"recipient_node_id":', _json_scalar(recipient_node_id),
+            b',"acked_by":', _json_scalar(acked_by),
+            b',"retry_count":', _json_scalar(retry_count),
+            b',"last_attempt":', _json_scalar(last_attempt),
+            _RESPONSE_SUFFIX,
+        ))
+    except (TypeError, UnicodeError) as e:
+        raise ProtocolError(f"Failed to encode companion response {config.RESP_STATUS_UPDATE}: {e}") from e
+
+_INBOX_ROW_PREFIX = _companion_response_prefix(config.RESP_INBOX_ROW) + b'{"index":'
+
+def encode_inbox_row(index: int, email_dict: Dict[str, Any]) -> bytes:
+    """
+    Encodes one streamed RESP_INBOX_ROW line; same bytes as
+    encode_companion_response(config.RESP_INBOX_ROW, index=..., email=...).
+    Only the row dict itself goes through the JSON encoder.
+
+    Raises:
+        ProtocolError: If encoding fails.
+    """
+    try:
+        return b''.join((_INBOX_ROW_PREFIX, str(int(index)).encode('ascii'), b',"email":',
+                         _json_dumps(email_dict), _RESPONSE_SUFFIX))
+    except (TypeError, UnicodeError) as e:
+        raise ProtocolError(f"Failed to encode companion response {config.RESP_INBOX_ROW}: {e}") from e
+
+# Binary companion frames (config.COMPANION_WIRE_FORMAT = "binary"): magic, payload length and
+# frame type, then the payload. 0xAE cannot start a UTF-8 JSON line, so the companion tells
+# frames and lines apart by their first byte.
+COMPANION_FRAME_MAGIC = b'\xae\xb1'
+_FRAME_HEADER = struct.Struct('<2sHB')
+_FRAME_INBOX_ROW = 1
+# index, to, from, timestamp, hops, last_attempt_time, retry_count, created_time,
+# acked_by (-1 for None), then the byte lengths of message_id, status, subject and body
+_INBOX_ROW_STRUCT = struct.Struct('<IIIdIdIdqBBHH')
+
+def encode_inbox_row_frame(index: int, email_dict: Dict[str, Any]) -> bytes:
+    """
+    Encodes one streamed RESP_INBOX_ROW as a binary companion frame, which carries the
+    same row in well under half the bytes of the JSON line. Rows a frame cannot hold
+    exactly (missing or None fields, oversized text) are encoded with encode_inbox_row.
+
+    Raises:
+        ProtocolError: If the JSON fallback fails to encode.
+    """
+    try:
+        acked_by = email_dict['acked_by_node_id']
+        strings = (email_dict['message_id'].encode('utf-8'), email_dict['status'].encode('utf-8'),
+                   email_dict['subject'].encode('utf-8'), email_dict['body'].encode('utf-8'))
+        fixed = _INBOX_ROW_STRUCT.pack(
+            index, email_dict['to_node_id'], email_dict['from_node_id'], email_dict['timestamp'],
+            email_dict['hops'], email_dict['last_attempt_time'], email_dict['retry_count'],
+            email_dict['created_time'], -1 if acked_by is None else acked_by,
+            *map(len, strings)
+        )
+        return b''.join((_FRAME_HEADER.pack(COMPANION_FRAME_MAGIC, len(fixed) + sum(map(len, strings)), _FRAME_INBOX_ROW),
+                         fixed) + strings)
+    except (KeyError, AttributeError, UnicodeError, struct.error):
+        return encode_inbox_row(index, email_dict)
+
+def companion_frame_end(buffer: Union[bytes, bytearray], start: int = 0) -> Optional[int]:
+    """
+    For a buffer holding a binary companion frame at `start` (it begins with
+    COMPANION_FRAME_MAGIC), returns the offset just past the frame, or None if
+    the rest of the frame has not arrived yet.
+    """
+    if len(buffer) - start < _FRAME_HEADER.size:
+        return None
+    end = start + _FRAME_HEADER.size + _FRAME_HEADER.unpack_from(buffer, start)[1]
+    return end if end <= len(buffer) else None
+
+def decode_companion_frame(frame: Union[bytes, bytearray]) -> Optional[Dict[str, Any]]:
+    """
+    Decodes a complete binary companion frame into the same {'resp': ..., 'data': ...}
+    dict its JSON line would decode to.
+
+    Returns:
+        The decoded message, or None if the frame is malformed or of an unknown type.
+    """
+    try:
+        magic, size, frame_type = _FRAME_HEADER.unpack_from(frame)
+        if magic != COMPANION_FRAME_MAGIC or size != len(frame) - _FRAME_HEADER.size:
+            logger.warning(f"Received malformed binary frame over serial ({len(frame)} bytes)")
+            return None
+        if frame_type != _FRAME_INBOX_ROW:
+            logger.warning(f"Received binary frame of unknown type {frame_type} over serial")
+            return None
+        (index, to_id, from_id, ts, hops, last_attempt, retry_count, created, acked_by,
+         *lengths) = _INBOX_ROW_STRUCT.unpack_from(frame, _FRAME_HEADER.size)
+        pos = _FRAME_HEADER.size + _INBOX_ROW_STRUCT.size
+        if pos + sum(lengths) != len(frame):
+            logger.warning(f"Received binary inbox row with inconsistent lengths ({len(frame)} bytes)")
+            return None
+        strings = []
+        for length in lengths:
+            strings.append(frame[pos:pos + length].decode('utf-8'))
+            pos += length
+    except (struct.error, UnicodeDecodeError) as e:
+        logger.warning(f"Received undecodable binary frame over serial: {e}")
+        return None
+    message_id, status, subject, body = strings
+    return {
+        'resp': config.RESP_INBOX_ROW,
+        'data': {
+            'index': index,
+            'email': {
+                'message_id': message_id,
+                'to_node_id': to_id,
+                'from_node_id': from_id,
+                'subject': subject,
+                'body': body,
+                'timestamp': ts,
+                'hops': hops,
+                'status': status,
+                'last_attempt_time': last_attempt,
+                'retry_count': retry_count,
+                'created_time': created,
+                'acked_by_node_id': None if acked_by < 0 else acked_by,
+            },
+        },
+    }
+
+@functools.lru_cache(maxsize=64)
+def _error_response_prefix(command: Optional[str]) -> bytes:
+    """The '{"resp":"error_response","data":{"command":<cmd>,"message":' head, built once per command."""
+    return _companion_response_prefix(config.RESP_ERROR) + b'{"command":' + _json_dumps(command) + b',"message":'
+
+def encode_error(command: Optional[str], message: str) -> bytes:
+    """
+    Encodes a RESP_ERROR line for the companion, reusing a cached template per command.
+
+    Raises:
+        ProtocolError: If encoding fails.
+    """
+    if command is not None and not isinstance(command, str):
+        # Malformed commands are neither cache keys nor worth caching; encode the slow way
+        return encode_companion_response(config.RESP_ERROR, command=command, message=message)
+    try:
+        return _error_response_prefix(command) + _json_dumps(message) + _RESPONSE_SUFFIX
+    except (TypeError, UnicodeError) as e:
+        raise ProtocolError(f"Failed to encode companion response {config.RESP_ERROR}: {e}") from e
+
+def decode_companion_message(line: Union[str, bytes]) -> Optional[Dict[str, Any]]:
     """
     Decodes a single line of JSON received over serial (either a command or response).
 
     Args:
-        line: The raw string line received from the serial port.
+        line: The line received from the serial port, as text or as the raw UTF-8 bytes
+              (both JSON parsers accept bytes and surrounding whitespace, so the line
+              needs neither a decode nor a strip() copy first).
 
     Returns:
         A dictionary representing the decoded JSON message, or None if decoding fails.
     """
-    line = line.strip()
-    if not line:
+    if not line or line.isspace():
         return None # Ignore empty lines
     try:
-        data = json.loads(line)
+        data = _json_loads(line)
         if not isinstance(data, dict):
              logger.warning(f"Received non-dict JSON over serial: {line}")
              return None
@@ -350,7 +624,7 @@ def decode_companion_message(line: str) -> Optional[Dict[str, Any]]:
              logger.warning(f"Received malformed JSON over serial (missing keys): {line}")
              return None
         return data
-    except json.JSONDecodeError:
+    except (json.JSONDecodeError, UnicodeDecodeError):
         logger.warning(f"Received non-JSON message over serial: {line}")
         return None
     except Exception as e:
@@ -358,20 +632,13 @@ def decode_companion_message(line: str) -> Optional[Dict[str, Any]]:
          return None
 
 # --- Helper to convert Email model to dict for companion responses ---
+_EMAIL_FIELDS = (
+    'message_id', 'to_node_id', 'from_node_id', 'subject', 'body', 'timestamp', 'hops',
+    'status', 'last_attempt_time', 'retry_count', 'created_time', 'acked_by_node_id',
+)
+_get_email_fields = operator.attrgetter(*_EMAIL_FIELDS)
+
 def email_to_dict(email: Email) -> Dict[str, Any]:
     """Converts an Email object to a dictionary suitable for companion responses."""
-    return {
-        'message_id': email.message_id,
-        'to_node_id': email.to_node_id,
-        'from_node_id': email.from_node_id,
-        'subject': email.subject,
-        'body': email.body,
-        'timestamp': email.timestamp,
-        'hops': email.hops,
-        'status': email.status,
-        'last_attempt_time': email.last_attempt_time,
-        'retry_count': email.retry_count,
-        'created_time': email.created_time,
-        'acked_by_node_id': email.acked_by_node_id,
-    }
+    return dict(zip(_EMAIL_FIELDS, _get_email_fields(email)))
 
@@ -0,0 +1,61 @@
+import io
+import json
+import os
+import unittest
+from unittest import mock
+
+from akita_email import config
+
+# Keep test runs out of the tracked log files; must precede the module imports that set up loggers
+config.PLUGIN_LOG_FILE = config.COMPANION_LOG_FILE = os.devnull
+
+from akita_email import companion_cli
+
+
+class _FakePluginPort:
+    """A non-selectable serial port that returns queued chunks, then stops the listener."""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.is_open = True
+
+    def fileno(self):
+        raise OSError("not selectable")
+
+    @property
+    def in_waiting(self):
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def read(self, size=1):
+        if not self.chunks:
+            companion_cli.listener_stop.set()
+            return b""
+        return self.chunks.pop(0)
+
+
+class ListenerTests(unittest.TestCase):
+    def setUp(self):
+        companion_cli.listener_stop.clear()
+
+    def tearDown(self):
+        companion_cli.listener_stop.clear()
+
+    def _status_line(self, status) -> bytes:
+        return json.dumps({"resp": config.RESP_STATUS_UPDATE, "data": {"status": status}}).encode() + b"\n"
+
+    def test_malformed_line_is_dropped_without_stalling_later_lines(self):
+        port = _FakePluginPort([self._status_line("sent") + self._status_line(5) + self._status_line("after")])
+
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as stdout, \
+                self.assertLogs(companion_cli.logger, "ERROR") as logs:
+            companion_cli.plugin_response_listener_thread(port)
+
+        shown = stdout.getvalue()
+        self.assertEqual(shown.count("Status: SENT"), 1)
+        self.assertEqual(shown.count("Status: AFTER"), 1)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("Failed to handle message from plugin", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,21 @@
+import contextlib
+import gc
+import os
+import sqlite3
+import tempfile
 import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
 from akita_email import config
+
+# Keep test runs out of the tracked log files; must precede the module imports that set up loggers
+config.PLUGIN_LOG_FILE = os.devnull
+
+from akita_email import database, protocol
 from akita_email.database import AkitaDatabase
-from akita_email.models import Email, STATUS_FAILED
+from akita_email.exceptions import DatabaseError
+from akita_email.models import Email, STATUS_ACKED, STATUS_FAILED, STATUS_SENT
 
 
 class DatabaseTests(unittest.TestCase):
@@ -36,6 +48,299 @@ class DatabaseTests(unittest.TestCase):
         self.assertIsNotNone(status)
         self.assertEqual(status.status, STATUS_FAILED)
 
+    def test_batch_outgoing_insert_ignores_duplicates_and_records_attempts(self):
+        emails = [
+            Email(message_id=f"batch-{i}", to_node_id=2, from_node_id=1, subject="s", body="b")
+            for i in range(3)
+        ]
+
+        self.assertEqual(self.db.add_outgoing_emails(emails), 3)
+        self.assertEqual(self.db.add_outgoing_emails(emails[:1]), 0)
+
+        self.db.update_outbox_after_send_attempts([email.message_id for email in emails])
+
+        for email in emails:
+            status = self.db.get_outbox_status(email.message_id)
+            self.assertEqual(status.status, STATUS_SENT)
+            self.assertEqual(status.retry_count, 1)
+
+    def test_queue_scan_returns_pending_and_due_retries_oldest_first(self):
+        now = time.time()
+        emails = [
+            Email(message_id=f"queued-{i}", to_node_id=2, from_node_id=1, subject="s", body="b",
+                  created_time=now - 30 + i)
+            for i in range(4)
+        ]
+        self.db.add_outgoing_emails(emails)
+        # queued-0 and queued-2 were sent long enough ago to be retried, queued-3 just now
+        self.db.update_outbox_after_send_attempts(["queued-0", "queued-2", "queued-3"])
+        self.db.flush_writes()
+        with self.db.conn:
+            self.db.conn.execute(
+                "UPDATE outbox SET last_attempt_time = ? WHERE message_id IN ('queued-0', 'queued-2')",
+                (round((now - config.MESSAGE_RETRY_INTERVAL - 5) * 1_000_000),),
+            )
+
+        ready_to_send = self.db.get_emails_to_send()
+
+        self.assertEqual([email.message_id for email in ready_to_send], ["queued-0", "queued-1", "queued-2"])
+
+    def test_queue_scan_fails_messages_at_hop_limit(self):
+        self.db.add_outgoing_email(Email(message_id="fresh", to_node_id=2, from_node_id=1, subject="s", body="b"))
+        self.db.add_outgoing_email(
+            Email(message_id="spent", to_node_id=2, from_node_id=1, subject="s", body="b", hops=config.MESSAGE_HOP_LIMIT)
+        )
+
+        self.assertEqual([email.message_id for email in self.db.get_emails_to_send()], ["fresh"])
+        self.assertEqual(self.db.get_outbox_status("spent").status, STATUS_FAILED)
+        self.assertEqual(self._stored_statuses()["spent"], STATUS_FAILED)
+        self.assertEqual(self.db.outbox_pending_count(), 1)
+
+    def _stored_statuses(self):
+        with self.db._write_lock:
+            return dict(self.db.conn.execute("SELECT message_id, status FROM outbox"))
+
+    def test_failed_write_does_not_drop_the_rest_of_its_batch(self):
+        self.db.add_outgoing_emails(
+            [Email(message_id=f"keep-{i}", to_node_id=2, from_node_id=1, subject="s", body="b") for i in range(2)]
+        )
+
+        with self.db._write_lock: # Hold the writer so the writes below are committed as one batch
+            self.db.update_outbox_after_send_attempt("keep-0")
+            self.db._queue_write("UPDATE no_such_table SET status = ?", (STATUS_FAILED,))
+            self.db.mark_outbox_acked("keep-1", 2)
+
+        self.assertTrue(self.db.flush_writes())
+        self.assertEqual(self._stored_statuses(), {"keep-0": STATUS_SENT, "keep-1": STATUS_ACKED})
+
+    def test_flush_writes_gives_up_after_timeout(self):
+        self.db.add_outgoing_email(Email(message_id="slow", to_node_id=2, from_node_id=1, subject="s", body="b"))
+
+        with self.db._write_lock:
+            self.db.update_outbox_after_send_attempt("slow")
+            self.assertFalse(self.db.flush_writes(timeout=0.2))
+
+        self.assertTrue(self.db.flush_writes())
+
+    def test_status_changes_commit_directly_without_writer_thread(self):
+        self.db.add_outgoing_email(Email(message_id="direct", to_node_id=2, from_node_id=1, subject="s", body="b"))
+        writer = self.db._writer_thread
+        self.db._write_q.put(database._WRITER_STOP)
+        writer.join()
+
+        self.db.update_outbox_after_send_attempt("direct")
+
+        self.assertTrue(self.db.flush_writes())
+        self.assertEqual(self._stored_statuses(), {"direct": STATUS_SENT})
+
+    def test_failed_commit_rolls_back_so_later_writes_succeed(self):
+        conn = self.db.conn
+
+        class FailingCommit:
+            """Delegates to the real connection but fails the first commit, as SQLITE_BUSY would."""
+            def __getattr__(self, name):
+                return getattr(conn, name)
+
+            def commit(self):
+                self.commit = conn.commit
+                raise sqlite3.OperationalError("database is locked")
+
+        self.db.conn = FailingCommit()
+        try:
+            with self.assertRaises(sqlite3.OperationalError):
+                with self.db._transaction() as tx:
+                    tx.execute("DELETE FROM outbox")
+            self.assertFalse(conn.in_transaction)
+
+            self.db.add_outgoing_email(Email(message_id="after", to_node_id=2, from_node_id=1, subject="s", body="b"))
+            self.db.update_outbox_after_send_attempt("after")
+            self.assertTrue(self.db.flush_writes())
+        finally:
+            self.db.conn = conn
+
+        self.assertEqual(self._stored_statuses(), {"after": STATUS_SENT})
+
+    def test_next_due_time_follows_retry_and_expiry(self):
+        self.assertIsNone(self.db.next_outbox_due_time())
+
+        created = time.time() - 10
+        email = Email(message_id="out-1", to_node_id=2, from_node_id=1, subject="s", body="b", created_time=created)
+        self.db.add_outgoing_email(email)
+        self.assertAlmostEqual(self.db.next_outbox_due_time(), created + config.MESSAGE_EXPIRY_TIME, places=3)
+
+        self.db.update_outbox_after_send_attempt(email.message_id)
+        attempt = self.db.get_outbox_status(email.message_id).last_attempt_time
+        self.assertAlmostEqual(self.db.next_outbox_due_time(), attempt + config.MESSAGE_RETRY_INTERVAL, places=3)
+
+    def test_next_due_time_raises_when_the_outbox_cannot_be_read(self):
+        self.db.conn.execute("DROP TABLE outbox")
+
+        self.assertEqual(self.db.get_emails_to_send(), [])
+        with self.assertRaises(DatabaseError):
+            self.db.next_outbox_due_time()
+
+    def test_limited_queue_scan_and_batch_results(self):
+        now = time.time()
+        emails = [
+            Email(message_id=f"limited-{i}", to_node_id=2, from_node_id=1, subject="s", body="b",
+                  created_time=now - 10 + i)
+            for i in range(3)
+        ]
+        self.db.add_outgoing_emails(emails)
+
+        batch = self.db.get_emails_to_send(limit=2)
+        self.assertEqual([email.message_id for email in batch], ["limited-0", "limited-1"])
+
+        self.db.apply_outbox_results([("limited-0", STATUS_SENT), ("limited-1", STATUS_FAILED)])
+
+        self.assertEqual([email.message_id for email in self.db.get_emails_to_send()], ["limited-2"])
+        self.assertEqual(self.db.get_outbox_status("limited-0").status, STATUS_SENT)
+        self.assertEqual(self.db.get_outbox_status("limited-1").status, STATUS_FAILED)
+
+    def test_evict_oldest_pending_fails_oldest_first(self):
+        now = time.time()
+        for i in range(3):
+            self.db.add_outgoing_email(
+                Email(message_id=f"cap-{i}", to_node_id=2, from_node_id=1, subject="s", body="b", created_time=now + i)
+            )
+        self.db.update_outbox_after_send_attempt("cap-0") # Sent messages are not evicted
+
+        self.assertEqual(self.db.evict_oldest_pending(1), ["cap-1"])
+        self.assertEqual(self.db.outbox_pending_count(), 1)
+        self.assertEqual(self.db.get_outbox_status("cap-1").status, STATUS_FAILED)
+        self.assertEqual(self.db.get_outbox_status("cap-0").status, STATUS_SENT)
+
+    def test_evict_skips_a_message_that_is_already_queued(self):
+        now = time.time()
+        for i in range(3):
+            self.db.add_outgoing_email(
+                Email(message_id=f"dup-{i}", to_node_id=2, from_node_id=1, subject="s", body="b", created_time=now + i)
+            )
+
+        self.assertEqual(self.db.evict_oldest_pending(1, for_message_id="dup-2"), [])
+        self.assertEqual(self.db.outbox_pending_count(), 3)
+        self.assertEqual(self.db.evict_oldest_pending(1, for_message_id="new"), ["dup-0"])
+
+    def test_dropped_database_stops_its_writer_thread(self):
+        db = AkitaDatabase(":memory:")
+        db.update_outbox_after_send_attempt("unknown") # Let the writer thread run a batch first
+        self.assertTrue(db.flush_writes())
+        writer, finalizer = db._writer_thread, db._finalizer
+
+        del db
+        gc.collect()
+
+        self.assertFalse(finalizer.alive)
+        writer.join(timeout=5)
+        self.assertFalse(writer.is_alive())
+
+    def test_outbox_status_cache_follows_queued_updates(self):
+        email = Email(message_id="cached-1", to_node_id=2, from_node_id=1, subject="s", body="b")
+        self.db.add_outgoing_email(email)
+        self.db.update_outbox_after_send_attempt(email.message_id)
+        self.db.mark_outbox_acked(email.message_id, 2)
+
+        cached = self.db.get_outbox_status(email.message_id)
+        self.db.flush_writes()
+        self.db._status_cache.clear()
+        stored = self.db.get_outbox_status(email.message_id)
+
+        for status in (cached, stored):
+            self.assertEqual(status.status, STATUS_ACKED)
+            self.assertEqual(status.retry_count, 1)
+            self.assertEqual(status.acked_by_node_id, 2)
+        self.assertIn(email.message_id, self.db._status_cache)
+
+
+class FileDatabaseTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = AkitaDatabase(os.path.join(self.tmpdir.name, "akita.db"))
+
+    def tearDown(self):
+        self.db.close()
+        self.tmpdir.cleanup()
+
+    def test_pooled_readers_see_committed_writes(self):
+        email = Email(message_id="inbox-1", to_node_id=1, from_node_id=2, subject="s", body="b")
+
+        self.assertTrue(self.db.add_incoming_email(email))
+
+        inbox = self.db.get_inbox_emails()
+        self.assertEqual([mail.message_id for mail in inbox], ["inbox-1"])
+        self.assertEqual(len(self.db._readers), 1)
+
+    def test_concurrent_inserts_report_new_and_duplicate_rows(self):
+        emails = [Email(message_id=f"inbox-{i}", to_node_id=1, from_node_id=2, subject="s", body="b") for i in range(16)]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            first = list(pool.map(self.db.add_incoming_email, emails))
+            again = list(pool.map(self.db.add_incoming_email, emails))
+
+        self.assertEqual(first, [True] * 16)
+        self.assertEqual(again, [False] * 16)
+        self.assertEqual(len(self.db.get_inbox_emails(limit=100)), 16)
+
+    def test_insert_is_unaffected_by_a_failing_write_in_its_batch(self):
+        email = Email(message_id="inbox-ok", to_node_id=1, from_node_id=2, subject="s", body="b")
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            with self.db._write_lock: # Hold the writer so the insert and the bad write share a batch
+                self.db._queue_write("UPDATE outbox SET status = status", ()) # Picked up first, alone
+                time.sleep(0.05)
+                future = pool.submit(self.db.add_incoming_email, email)
+                time.sleep(0.05)
+                self.db._queue_write("UPDATE no_such_table SET status = ?", (STATUS_FAILED,))
+
+            self.assertTrue(future.result(timeout=5))
+        self.assertEqual([mail.message_id for mail in self.db.get_inbox_emails()], ["inbox-ok"])
+
+    def test_inbox_dicts_match_email_to_dict(self):
+        self.db.add_incoming_email(Email(message_id="inbox-1", to_node_id=1, from_node_id=2, subject="s", body="b"))
+        self.db.add_incoming_email(Email(message_id="inbox-2", to_node_id=1, from_node_id=3, subject="", body="c"))
+
+        self.assertEqual(
+            self.db.get_inbox_email_dicts(),
+            [protocol.email_to_dict(mail) for mail in self.db.get_inbox_emails()],
+        )
+
+    def test_close_commits_queued_status_updates(self):
+        email = Email(message_id="outbox-1", to_node_id=2, from_node_id=1, subject="s", body="b")
+        self.db.add_outgoing_email(email)
+
+        self.db.update_outbox_after_send_attempt(email.message_id)
+        self.db.mark_outbox_acked(email.message_id, 2)
+        self.db.close()
+
+        self.db = AkitaDatabase(os.path.join(self.tmpdir.name, "akita.db"))
+        status = self.db.get_outbox_status(email.message_id)
+        self.assertEqual(status.status, STATUS_ACKED)
+        self.assertEqual(status.retry_count, 1)
+        self.assertEqual(status.acked_by_node_id, 2)
+
+
+    def test_legacy_real_second_times_are_migrated_to_microseconds(self):
+        self.db.close()
+        path = os.path.join(self.tmpdir.name, "legacy.db")
+        with contextlib.closing(sqlite3.connect(path)) as conn, conn:
+            conn.execute("""CREATE TABLE inbox (message_id TEXT PRIMARY KEY, to_node_id INTEGER NOT NULL,
+                            from_node_id INTEGER NOT NULL, subject TEXT, body TEXT NOT NULL,
+                            timestamp REAL NOT NULL, hops INTEGER NOT NULL, received_time REAL)""")
+            conn.execute("""CREATE TABLE outbox (message_id TEXT PRIMARY KEY, to_node_id INTEGER NOT NULL,
+                            from_node_id INTEGER NOT NULL, subject TEXT, body TEXT NOT NULL,
+                            timestamp REAL NOT NULL, hops INTEGER DEFAULT 0, status TEXT NOT NULL DEFAULT 'pending',
+                            last_attempt_time REAL DEFAULT 0, retry_count INTEGER DEFAULT 0,
+                            created_time REAL, acked_by_node_id INTEGER)""")
+            conn.execute("CREATE INDEX idx_outbox_status_attempt ON outbox(status, last_attempt_time)")
+            conn.execute("INSERT INTO inbox VALUES ('in-1', 1, 2, 's', 'b', 100.5, 0, 101.25)")
+            conn.execute("INSERT INTO outbox VALUES ('out-1', 2, 1, 's', 'b', 200.5, 0, 'sent', 201.75, 1, 200.5, NULL)")
+
+        self.db = AkitaDatabase(path)
+
+        inbox = self.db.get_inbox_emails()
+        status = self.db.get_outbox_status("out-1")
+        self.assertEqual((inbox[0].timestamp, inbox[0].created_time), (100.5, 101.25))
+        self.assertEqual((status.timestamp, status.last_attempt_time, status.created_time), (200.5, 201.75, 200.5))
+        self.assertEqual(self.db.conn.execute("SELECT created_time FROM outbox").fetchone()[0], 200_500_000)
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,49 @@
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+from akita_email import config
+
+# Keep test runs out of the tracked log files; must precede the module imports that set up loggers
+config.PLUGIN_LOG_FILE = os.devnull
+
+from akita_email import database, plugin
+from akita_email.models import Email
+
+
+class OutboxProcessorTests(unittest.TestCase):
+    def setUp(self):
+        self.interface = mock.MagicMock()
+        self.interface.myInfo.my_node_num = 1
+        in_memory_db = database.AkitaDatabase(":memory:")
+        with mock.patch.object(database, "AkitaDatabase", return_value=in_memory_db):
+            self.plugin = plugin.AkitaEmailPlugin(self.interface)
+
+    def tearDown(self):
+        self.plugin.db.close()
+
+    def _run_processor(self, seconds: float):
+        self.plugin.running = True
+        processor = threading.Thread(target=self.plugin._outgoing_queue_processor_thread, daemon=True)
+        processor.start()
+        time.sleep(seconds)
+        self.plugin.running = False
+        self.plugin._stop_event.set()
+        self.plugin._outbox_event.set()
+        processor.join(timeout=5)
+        self.assertFalse(processor.is_alive())
+
+    def test_failing_interface_backs_off_instead_of_resending_at_once(self):
+        self.interface.sendData.side_effect = OSError("radio unavailable")
+        self.plugin.db.add_outgoing_email(Email(message_id="out-1", to_node_id=2, from_node_id=1, subject="s", body="b"))
+
+        self._run_processor(0.5)
+
+        self.assertEqual(self.interface.sendData.call_count, 1)
+        self.assertEqual(self.plugin.db.get_outbox_status("out-1").retry_count, 0) # Still pending for a later retry
+
+
+if __name__ == "__main__":
+    unittest.main()
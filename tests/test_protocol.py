@@ -1,8 +1,16 @@
+import json
+import os
 import unittest
+from unittest import mock
 
 from meshtastic.protobuf import mesh_pb2
 
-from akita_email import config, protocol
+from akita_email import config
+
+# Keep test runs out of the tracked log files; must precede the module imports that set up loggers
+config.PLUGIN_LOG_FILE = os.devnull
+
+from akita_email import protocol
 from akita_email.exceptions import ProtocolError
 from akita_email.models import Email
 
@@ -34,6 +42,55 @@ class ProtocolTests(unittest.TestCase):
         self.assertEqual(decoded[config.MSG_KEY_ID], email.message_id)
         self.assertEqual(decoded[config.MSG_KEY_BODY], email.body)
 
+    @mock.patch.object(protocol, "_EMAIL_TEMPLATE_FAST_PATH", True)
+    def test_ascii_email_fast_path_matches_generic_encoder(self):
+        for subject, body in (("subject", "plain ascii body"), ("", "x"), ("q\"uote", "back\\slash"), ("s", "h\u00e9llo\n")):
+            email = self._email(body=body)
+            email.subject = subject
+            self.assertEqual(
+                protocol.encode_email_to_lora(email),
+                protocol._serialize_payload(protocol._email_payload_dict(email)),
+            )
+
+    @unittest.skipUnless(protocol.msgpack is not None, "msgpack not installed")
+    def test_msgpack_payload_round_trip_and_is_smaller(self):
+        email = self._email()
+        json_payload = protocol.encode_email_to_lora(email)
+
+        original_format = config.LORA_WIRE_FORMAT
+        config.LORA_WIRE_FORMAT = "msgpack"
+        try:
+            payload = protocol.encode_email_to_lora(email)
+        finally:
+            config.LORA_WIRE_FORMAT = original_format
+
+        self.assertLess(len(payload), len(json_payload))
+        decoded = protocol.decode_lora_packet(
+            {
+                "from": 1,
+                "to": 2,
+                "decoded": {"portnum": "PRIVATE_APP", "payload": payload},
+            }
+        )
+
+        self.assertIsNotNone(decoded)
+        self.assertEqual(decoded[config.MSG_KEY_ID], email.message_id)
+        self.assertEqual(decoded[config.MSG_KEY_BODY], email.body)
+
+    @unittest.skipUnless(protocol.msgpack is not None, "msgpack not installed")
+    def test_msgpack_unmapped_keys_and_malformed_payloads(self):
+        payload = {config.MSG_KEY_TYPE: config.MSG_TYPE_ACK, "extra": 1}
+        with mock.patch.object(config, "LORA_WIRE_FORMAT", "msgpack"):
+            packed = protocol._serialize_payload(payload)
+        self.assertEqual(protocol._unpack_msgpack_payload(packed), payload)
+
+        with self.assertLogs(protocol.logger, "WARNING") as logs:
+            decoded = protocol.decode_lora_packet(
+                {"from": 1, "decoded": {"portnum": "PRIVATE_APP", "payload": protocol._MSGPACK_MAGIC + b"\xc1"}}
+            )
+        self.assertIsNone(decoded)
+        self.assertEqual(len(logs.records), 1)
+
     def test_legacy_text_payload_round_trip(self):
         email = self._email()
 
@@ -49,6 +106,26 @@ class ProtocolTests(unittest.TestCase):
         self.assertIsNotNone(decoded)
         self.assertEqual(decoded[config.MSG_KEY_ID], email.message_id)
 
+    def test_plain_chat_text_is_ignored_without_parsing(self):
+        with mock.patch.object(protocol, "_json_loads") as loads:
+            decoded = protocol.decode_lora_packet(
+                {"from": 1, "decoded": {"portnum": "TEXT_MESSAGE_APP", "text": "hello mesh"}}
+            )
+
+        self.assertIsNone(decoded)
+        loads.assert_not_called()
+
+    def test_rejects_email_with_missing_or_mistyped_fields(self):
+        good = json.loads(protocol.encode_email_to_lora(self._email()))
+        missing_body = {k: v for k, v in good.items() if k != config.MSG_KEY_BODY}
+        bool_hops = dict(good, **{config.MSG_KEY_HOPS: True})
+
+        for payload in (missing_body, bool_hops):
+            decoded = protocol.decode_lora_packet(
+                {"from": 1, "decoded": {"portnum": "PRIVATE_APP", "payload": json.dumps(payload).encode()}}
+            )
+            self.assertIsNone(decoded)
+
     def test_rejects_oversized_email_payload(self):
         payload_limit = int(mesh_pb2.Constants.DATA_PAYLOAD_LEN)
         body = "x" * payload_limit
@@ -64,6 +141,78 @@ class ProtocolTests(unittest.TestCase):
         with self.assertRaises(ProtocolError):
             protocol.encode_ack_to_lora("x" * config.MESSAGE_ID_MAX_LENGTH, 2, 1)
 
+    def test_companion_command_round_trip(self):
+        line = protocol.encode_companion_command(config.CMD_READ_EMAILS, limit=5)
+
+        self.assertIsInstance(line, bytes)
+        self.assertTrue(line.endswith(b"\n"))
+        decoded = protocol.decode_companion_message(line.decode("utf-8"))
+        self.assertEqual(decoded, {"cmd": config.CMD_READ_EMAILS, "params": {"limit": 5}})
+        # Equal but differently typed parameters must not share an encoding
+        self.assertIn(b'"limit":true', protocol.encode_companion_command(config.CMD_READ_EMAILS, limit=True))
+        self.assertIn(b'"limit":1}', protocol.encode_companion_command(config.CMD_READ_EMAILS, limit=1))
+
+
+    def test_companion_response_is_compact_json_line(self):
+        line = protocol.encode_companion_response(config.RESP_STATUS_UPDATE, message_id="abc", status="acked")
+
+        self.assertIsInstance(line, bytes)
+        self.assertEqual(
+            line,
+            (json.dumps(
+                {"resp": config.RESP_STATUS_UPDATE, "data": {"message_id": "abc", "status": "acked"}},
+                separators=(",", ":"),
+            ) + "\n").encode("utf-8"),
+        )
+        decoded = protocol.decode_companion_message(line) # Raw bytes decode without a str round trip
+        self.assertEqual(decoded["data"]["status"], "acked")
+
+
+    def test_response_templates_match_generic_encoder(self):
+        self.assertEqual(
+            protocol.encode_pong(1_700_000_000.25),
+            protocol.encode_companion_response(config.RESP_PONG, timestamp=1_700_000_000.25),
+        )
+        for acked_by, last_attempt in ((None, 0.0), (2, 1_700_000_000.5)):
+            self.assertEqual(
+                protocol.encode_status_update("abc", "sent", 2, acked_by, 3, last_attempt),
+                protocol.encode_companion_response(
+                    config.RESP_STATUS_UPDATE, message_id="abc", status="sent", recipient_node_id=2,
+                    acked_by=acked_by, retry_count=3, last_attempt=last_attempt,
+                ),
+            )
+        row = protocol.email_to_dict(self._email(body="h\u00e9llo \"quoted\""))
+        self.assertEqual(
+            protocol.encode_inbox_row(3, row),
+            protocol.encode_companion_response(config.RESP_INBOX_ROW, index=3, email=row),
+        )
+        for command in (config.CMD_PING_PLUGIN, None, "b\u00e4d \"cmd\""):
+            self.assertEqual(
+                protocol.encode_error(command, "Unknown command received by plugin."),
+                protocol.encode_companion_response(
+                    config.RESP_ERROR, command=command, message="Unknown command received by plugin."
+                ),
+            )
+
+    def test_binary_inbox_row_decodes_like_json_line(self):
+        row = protocol.email_to_dict(self._email(body="h\u00e9llo\nworld"))
+        row["timestamp"] = float(row["timestamp"])
+        row["acked_by_node_id"] = 7
+
+        frame = protocol.encode_inbox_row_frame(3, row)
+
+        self.assertTrue(frame.startswith(protocol.COMPANION_FRAME_MAGIC))
+        self.assertLess(len(frame), len(protocol.encode_inbox_row(3, row)))
+        buffer = frame + b'{"resp":"pong"'
+        self.assertIsNone(protocol.companion_frame_end(buffer[:len(frame) - 1]))
+        self.assertEqual(protocol.companion_frame_end(buffer), len(frame))
+        self.assertEqual(
+            protocol.decode_companion_frame(frame),
+            protocol.decode_companion_message(protocol.encode_inbox_row(3, row)),
+        )
+        # Rows a frame cannot carry exactly fall back to the JSON line
+        row["subject"] = None
+        self.assertEqual(protocol.encode_inbox_row_frame(3, row), protocol.encode_inbox_row(3, row))
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file